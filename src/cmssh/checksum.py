@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Checksum verification of transferred files. Local files are read in a
+single streaming pass over their memory map and compared against the
+checksums DBS holds for them (adler32 and check_sum, the latter is the
+POSIX cksum value). Checksums are computed by a pool of worker processes,
+so several files are verified in parallel (zlib holds the GIL).
+"""
+
+# system modules
+import os
+import mmap
+import zlib
+import signal
+import threading
+import subprocess
+import multiprocessing
+
+BLOCK_SIZE = 16*1024*1024 # size of blocks fed into checksum algorithm
+
+def adler32(fname, bsize=BLOCK_SIZE):
+    "Return adler32 checksum of given file as 8 digits hex string"
+    value = 1
+    with open(fname, 'rb') as stream:
+        size = os.fstat(stream.fileno()).st_size
+        if  not size: # empty files can't be mapped
+            return '%08x' % value
+        data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in xrange(0, size, bsize):
+                value = zlib.adler32(buffer(data, offset, bsize), value)
+        finally:
+            data.close()
+    return '%08x' % (value & 0xffffffff)
+
+def cksum(fname):
+    "Return POSIX cksum of given file as decimal string"
+    proc = subprocess.Popen(['cksum', fname], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, close_fds=True)
+    stdout, stderr = proc.communicate()
+    if  proc.returncode:
+        raise OSError('cksum %s failed: %s' % (fname, stderr.strip()))
+    return stdout.split()[0]
+
+def file_checksum(fname, kind):
+    "Return checksum of given kind (DBS attribute name) of given file"
+    if  kind == 'adler32':
+        return adler32(fname)
+    if  kind == 'check_sum':
+        return cksum(fname)
+    raise NotImplementedError('Unsupported checksum %s' % kind)
+
+def same_checksum(kind, value1, value2):
+    "Compare two checksums of given kind, DBS may strip leading zeros"
+    try:
+        if  kind == 'adler32':
+            return int(str(value1), 16) == int(str(value2), 16)
+        return int(value1) == int(value2)
+    except ValueError:
+        return False
+
+def init_worker():
+    "Initialize worker process, Ctrl-C is handled by the shell"
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class ChecksumVerifier(object):
+    """
+    Verify local files against expected checksums in a pool of nworkers
+    processes. The pool is created on first use.
+    """
+    def __init__(self, nworkers=2):
+        self.nworkers = max(1, nworkers)
+        self.pool     = None
+        self.lock     = threading.Lock()
+
+    def get_pool(self):
+        "Return pool of worker processes"
+        with self.lock:
+            if  not self.pool:
+                self.pool = multiprocessing.Pool(self.nworkers, init_worker)
+            return self.pool
+
+    def verify_many(self, items):
+        """
+        Verify given list of (file name, expected checksums) pairs, where
+        expected checksums is a dict of DBS attributes, e.g. {'adler32':
+        'fa5e4b06'}. Return list of statuses: 'adler32 ok', 'cksum ok',
+        'mismatch' or 'unverified' if there is nothing to compare with.
+        """
+        jobs = []
+        for fname, expect in items:
+            # adler32 is much cheaper than cksum, use it whenever possible
+            kind = None
+            for key in ['adler32', 'check_sum']:
+                if  expect and expect.get(key):
+                    kind = key
+                    break
+            if  not kind or not os.path.isfile(fname):
+                jobs.append((None, None, None))
+                continue
+            res = self.get_pool().apply_async(file_checksum, (fname, kind))
+            jobs.append((kind, expect[kind], res))
+        statuses = []
+        for kind, value, res in jobs:
+            if  not res:
+                statuses.append('unverified')
+                continue
+            try:
+                result = res.get(86400*365) # timeout keeps Ctrl-C working
+            except (IOError, OSError):
+                statuses.append('unverified')
+                continue
+            if  same_checksum(kind, result, value):
+                name = 'adler32' if kind == 'adler32' else 'cksum'
+                statuses.append('%s ok' % name)
+            else:
+                statuses.append('mismatch')
+        return statuses
+
+    def verify(self, fname, expect):
+        "Verify given file against expected checksums, see verify_many"
+        return self.verify_many([(fname, expect)])[0]
+
+# create an singleton instance which will be used through the code
+VERIFIER = ChecksumVerifier(int(os.environ.get('CMSSH_CHECKSUM_WORKERS', 2)))
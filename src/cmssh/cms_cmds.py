@@ -23,9 +23,11 @@ import subprocess
 from cmssh.iprint import msg_red, msg_green, msg_blue
 from cmssh.iprint import print_warning, print_error, print_status, print_info
 from cmssh.filemover import copy_lfn, rm_lfn, mkdir, rmdir, list_se, dqueue
+from cmssh.filemover import list_se_tree, du_se
+from cmssh.filemover import copy_lfns, expand_sources
 from cmssh.utils import list_results, check_os, unsupported_linux, access2file
 from cmssh.utils import osparameters, check_voms_proxy, run, user_input
-from cmssh.utils import execmd, touch, platform, fix_so
+from cmssh.utils import execmd, touch, platform, fix_so, size_format
 from cmssh.cmsfs import dataset_info, block_info, file_info, site_info, run_info
 from cmssh.cmsfs import CMSMGR, apply_filter, validate_dbs_instance
 from cmssh.cmsfs import release_info, run_lumi_info
@@ -33,6 +35,8 @@ from cmssh.github import get_tickets, post_ticket
 from cmssh.cms_urls import dbs_instances, tc_url
 from cmssh.das import das_client
 from cmssh.url_utils import get_data, send_email
+from cmssh.url_cache import URL_CACHE
+from cmssh.das_cache import DAS_CACHE
 from cmssh.regex import pat_release, pat_site, pat_dataset, pat_block
 from cmssh.regex import pat_lfn, pat_run, pat_se, pat_user
 from cmssh.tagcollector import architectures as tc_architectures
@@ -214,13 +218,29 @@ def cms_find(arg):
 
 def cms_du(arg):
     """
-    cmssh disk utility cmssh command.
+    cmssh disk utility cmssh command. For directory on storage element it
+    walks its tree and reports size and number of files of every
+    subdirectory as soon as it is scanned, -s reports only the total.
     Examples:
         cmssh> du # UNIX command
         cmssh> du T3_US_Cornell
+        cmssh> du T3_US_Cornell:/store/user/user_name
+        cmssh> du -s T3_US_Cornell:/store/user/user_name
     """
     arg = arg.strip()
-    if  pat_site.match(arg):
+    try:
+        debug = get_ipython().debug
+    except:
+        debug = 0
+    summary = False
+    if  arg.startswith('-s '):
+        summary = True
+        arg = arg[3:].strip()
+    if  pat_se.match(arg):
+        res = du_se(arg, summary, debug)
+        RESMGR.assign(res)
+        list_results(res, debug=True)
+    elif pat_site.match(arg):
         lookup(arg)
     else:
         cmd = 'du ' + arg
@@ -237,9 +257,9 @@ def lookup(arg):
     if  len(args) == 1: # no filter
         res = CMSMGR.lookup(arg)
     else:
-        gen = CMSMGR.lookup(args[0].strip())
-        for flt in args[1:]:
-            res = apply_filter(flt.strip(), gen)
+        res = CMSMGR.lookup(args[0].strip())
+        for flt in args[1:]: # filters are chained
+            res = apply_filter(flt.strip(), res)
     RESMGR.assign(res)
     list_results(res, debug)
 
@@ -605,6 +625,41 @@ def cms_pager(arg=None):
         msg = "cmssh pager is set to: %s" % val
         print msg
 
+def cms_cache(arg=None):
+    """
+    cmssh command to show or clear on-disk cache of data-service responses
+    and in-memory cache of DAS queries
+    Examples:
+        cmssh> cache # shows cache statistics
+        cmssh> cache clear
+    """
+    arg = arg.strip() if arg else ''
+    if  arg == 'clear':
+        URL_CACHE.clear()
+        DAS_CACHE.clear()
+        print "Cleared cmssh cache %s" % URL_CACHE.path()
+    elif not arg or arg == 'info':
+        print "cmssh cache: %s" % URL_CACHE.path()
+        if  not URL_CACHE.enabled():
+            print_warning('cache is disabled, see CMSSH_CACHE')
+        stats = URL_CACHE.info()
+        for api in sorted(stats.keys()):
+            row = stats[api]
+            msg = '%s: %s entries, %s expired, %s' \
+                % (msg_green(api), row['entries'], row['expired'],
+                   size_format(row['size']))
+            print msg
+        if  not stats:
+            print "cache is empty"
+        row = DAS_CACHE.info()
+        if  row['entries'] or row['pids']:
+            msg = '%s: %s entries, %s expired, %s, %s pending queries' \
+                % (msg_green('das'), row['entries'], row['expired'],
+                   size_format(row['size']), row['pids'])
+            print msg
+    else:
+        print_error('Unsupported cache option %s' % arg)
+
 def dbs_instance(arg=None):
     """
     cmssh command to show or set DBS instance
@@ -655,6 +710,8 @@ def cms_help_msg():
     msg += msg_green('root        ') + ' invoke ROOT\n'
     msg += msg_green('du          ') \
         + ' display disk usage for given site, e.g. du T3_US_Cornell\n'
+    msg += msg_green('cache       ') \
+        + ' show or clear cache of data-service responses, e.g. cache clear\n'
     msg += '\nAvailable CMSSW commands (once you install any CMSSW release):\n'
     msg += msg_green('releases    ') \
         + ' list available CMSSW releases, accepts <list|all> args\n'
@@ -711,10 +768,13 @@ def cms_help(arg=None):
 def cms_rm(arg):
     """
     CMS rm command works with local files/dirs and CMS storate elements.
+    It accepts multiple files, files on storage element may contain
+    wild-cards.
     Examples:
         cmssh> rm local_file
         cmssh> rm -rf local_dir
         cmssh> rm T3_US_Cornell:/xrootdfs/cms/store/user/user_name/file.root
+        cmssh> rm T3_US_Cornell:/store/user/user_name/crab_out/*.root
     """
     arg = arg.strip()
     try:
@@ -724,12 +784,13 @@ def cms_rm(arg):
     if  not arg:
         print_error("Usage: rm <options> source_file")
     dst = arg.split()[-1]
+    paths = [a for a in arg.split() if pat_se.match(a)]
     if  os.path.exists(dst) or len(glob.glob(dst)):
         cmd = "rm %s" % arg
         run(cmd)
     else:
-        if  pat_lfn.match(arg.split(':')[-1]):
-            status = rm_lfn(arg, verbose=debug)
+        if  paths or pat_lfn.match(arg.split(':')[-1]):
+            status = rm_lfn(paths if paths else arg, verbose=debug)
             print_status(status)
         else:
             if  not os.path.exists(dst):
@@ -740,9 +801,12 @@ def cms_rm(arg):
 def cms_rmdir(arg):
     """
     cmssh rmdir command removes directory from local file system or CMS storage element.
+    It accepts multiple directories, directories on storage element may
+    contain wild-cards.
     Examples:
         cmssh> rmdir foo
         cmssh> rmdir T3_US_Cornell:/store/user/user_name/foo
+        cmssh> rmdir T3_US_Cornell:/store/user/user_name/crab_*
     """
     arg = arg.strip()
     try:
@@ -755,7 +819,7 @@ def cms_rmdir(arg):
         run("rmdir %s" % arg)
     else:
         try:
-            status = rmdir(arg, verbose=debug)
+            status = rmdir(arg.split(), verbose=debug)
             print_status(status)
         except:
             traceback.print_exc()
@@ -763,9 +827,11 @@ def cms_rmdir(arg):
 def cms_mkdir(arg):
     """
     cmssh mkdir command creates directory on local filesystem or remote CMS storage element.
+    It accepts multiple directories.
     Examples:
         cmssh> mkdir foo
         cmssh> mkdir T3_US_Cornell:/store/user/user_name/foo
+        cmssh> mkdir T3_US_Cornell:/store/user/user_name/foo T3_US_Cornell:/store/user/user_name/foo/bar
     """
     arg = arg.strip()
     try:
@@ -778,7 +844,7 @@ def cms_mkdir(arg):
         run("mkdir %s" % arg)
     else:
         try:
-            status = mkdir(arg, verbose=debug)
+            status = mkdir(arg.split(), verbose=debug)
             print_status(status)
         except:
             traceback.print_exc()
@@ -791,6 +857,7 @@ def cms_ls(arg):
         cmssh> ls # UNIX command
         cmssh> ls -l local_file
         cmssh> ls T3_US_Cornell:/store/user/valya
+        cmssh> ls -R T3_US_Cornell:/store/user/valya
         cmssh> ls run=160915
     """
     arg = arg.strip()
@@ -814,6 +881,9 @@ def cms_ls(arg):
     if  os.path.isfile(orig_arg) or os.path.isdir(orig_arg):
         cmd = 'ls ' + orig_arg
         run(cmd, shell=True)
+    elif arg.startswith('-R ') and pat_se.match(arg[3:].strip()):
+        arg = arg[3:].strip().replace('site=', '')
+        res = list_se_tree(arg, debug)
     elif pat_se.match(arg):
         arg = arg.replace('site=', '')
         res = list_se(arg, debug)
@@ -857,6 +927,7 @@ def cms_jobs(arg=None):
     list of options:
 
     - list, which lists local transfer jobs
+    - clear, which removes finished transfer jobs from local queue
     - site, which lists jobs at given site
     - dashboard, which lists jobs of current user
     - user, which lists jobs of given user
@@ -864,6 +935,7 @@ def cms_jobs(arg=None):
     Examples:
         cmssh> jobs
         cmssh> jobs list
+        cmssh> jobs clear
         cmssh> jobs site=T2_US_UCSD
         cmssh> jobs dashboard
         cmssh> jobs user=my_cms_user_name
@@ -881,7 +953,7 @@ def cms_jobs(arg=None):
         flt = None
     if  arg:
         arg = arg.strip()
-    if  not arg or arg == 'list':
+    if  not arg or arg in ['list', 'clear']:
         print_info('Local data transfer')
         dqueue(arg)
     elif arg == 'dashboard':
@@ -1044,11 +1116,21 @@ def cms_info(arg):
 def cms_cp(arg):
     """
     cmssh cp command copies local files/dirs to/from local files/dirs or CMS storate elements.
+    It accepts several sources, LFN globs, @file with list of LFNs, blocks and datasets.
+    Transfers are executed in parallel, see CMSSH_TRANSFER_LIMIT,
+    CMSSH_TRANSFER_SRC_LIMIT and CMSSH_TRANSFER_DST_LIMIT.
+    Set CMSSH_TRANSFER_METHOD=http for resumable chunk-parallel downloads
+    from HTTP endpoints of the sites, an interrupted cp resumes from the
+    last downloaded chunk.
     Examples:
         cmssh> cp file1 file2
         cmssh> cp file.root T3_US_Cornell:/store/user/name
         cmssh> cp /store/mc/file.root T3_US_Cornell:/store/user/name
         cmssh> cp T3_US_Cornell:/store/user/name/file.root T3_US_Omaha
+        cmssh> cp /store/mc/file1.root /store/mc/file2.root .
+        cmssh> cp @lfns.txt /data
+        cmssh> cp /store/user/name/skim/*.root /data &
+        cmssh> cp dataset=/Cosmics/CRUZET3-v1/RAW /data &
     """
     check_voms_proxy()
     background = False
@@ -1066,9 +1148,10 @@ def cms_cp(arg):
         if  dst == '.':
             dst = os.getcwd()
         # check if src still has options and user asked for -f
-        options = src.split(' ')
+        options = src.split()
         if  len(options) > 1 and options[0] == '-f':
             overwrite = True
+            options = options[1:]
         else:
             overwrite = False
     except:
@@ -1079,10 +1162,11 @@ def cms_cp(arg):
     except:
         debug = 0
     if  not arg:
-        print_error("Usage: cp <options> source_file target_{file,directory}")
+        print_error("Usage: cp <options> source_file(s) target_{file,directory}")
     pat  = pat_se
-    orig = src.split(' ')[-1]
-    if  os.path.exists(orig) and not pat.match(dst):
+    # local files are copied by UNIX cp, options are passed to it as is
+    local = [o for o in options if o[0] != '-']
+    if  local and all(os.path.exists(o) for o in local) and not pat.match(dst):
         if  background:
             cmd = 'cp %s' % orig_arg
             subprocess.call(cmd, shell=True)
@@ -1090,7 +1174,11 @@ def cms_cp(arg):
             run("cp %s %s" % (src, dst))
     else:
         try:
-            status = copy_lfn(orig, dst, debug, background, overwrite)
+            lfns = expand_sources(options)
+            if  len(lfns) == 1 and not background:
+                status = copy_lfn(lfns[0], dst, debug, background, overwrite)
+            else:
+                status = copy_lfns(lfns, dst, debug, background, overwrite)
             print_status(status)
         except:
             traceback.print_exc()
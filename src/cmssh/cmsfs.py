@@ -17,11 +17,12 @@ from   types import GeneratorType
 
 # cmssh modules
 from   cmssh.iprint import format_dict, print_warning, print_error
-from   cmssh.url_utils import get_data
+from   cmssh.url_utils import get_data, get_data_many, get_data_stream
 from   cmssh.cms_objects import Run, File, Block, Dataset, Site, User, Job
 from   cmssh.cms_objects import Release, CMSObj
 from   cmssh.tagcollector import releases
 from   cmssh.filemover import get_pfns, resolve_user_srm_path
+from   cmssh.replicas import REPLICAS
 from   cmssh.cms_urls import phedex_url, dbs_url, conddb_url, sitedb_url
 from   cmssh.cms_urls import dashboard_url, dbs_instances
 from   cmssh import dbs2
@@ -30,7 +31,8 @@ from   cmssh.lumidb import lumidb
 from   cmssh.regex import pat_dataset, pat_block, pat_lfn, pat_run
 from   cmssh.reqmgr import reqmgr
 from   cmssh.prepsrv import prep
-from   cmssh.utils import ranges
+from   cmssh.runlumi import RunLumiMask
+from   cmssh.unique import unique_rows
 
 def rowdict(columns, row):
     """Convert given row list into dict with column keys"""
@@ -53,21 +55,16 @@ def sitedb_parser(data):
         for row in data['result']:
             yield row
 
-def find_sites(url, params):
-    """Find sites"""
-    data = get_data(url, params)
+def find_sites(index):
+    """Find sites for given lfn: [(node, se), ...] replica index"""
     sites = {}
-    for files in data['phedex']['block']:
-        for fdict in files['file']:
-            replicas = fdict['replica']
-            for replica in replicas:
-                node = replica.get('node', None)
-                se = replica.get('se', None)
-                if  sites.has_key(node):
-                    if  se not in sites[node]:
-                        sites[node] += [se]
-                else:
-                    sites[node] = [se]
+    for replicas in index.itervalues():
+        for node, se in replicas:
+            if  sites.has_key(node):
+                if  se not in sites[node]:
+                    sites[node] += [se]
+            else:
+                sites[node] = [se]
     for key, val in sites.iteritems():
         yield Site({'node': key, 'se': val})
 
@@ -108,6 +105,9 @@ def apply_filter(flt, gen):
             for row in gen:
                 res += 1
             yield res
+        elif flt_func == 'unique' or flt_func == 'uniq':
+            for row in unique_rows(gen):
+                yield row
         else:
             raise NotImplementedError
     else:
@@ -197,10 +197,7 @@ class CMSFS(object):
         else:
             arg = ''.join([v for k, v in kwargs.items()])
             run_lumi = run_lumi_dict(arg)
-        rdict = {}
-        for run, lumis in run_lumi.items():
-            rdict[run] = list(ranges(lumis))
-        return [CMSObj(rdict)]
+        return [CMSObj(run_lumi.tojson())]
 
     def list_lumis(self, **kwargs):
         """
@@ -252,9 +249,8 @@ class CMSFS(object):
         if  kwargs.has_key('file'):
             kwargs['logical_file_name'] = kwargs['file']
             del kwargs['file']
-        data = get_data(url, kwargs)
-        plist = [Dataset(d) for d in data]
-        return plist
+        # stream datasets one by one, there can be plenty of them
+        return (Dataset(d) for d in get_data_stream(url, kwargs))
 
     def list_runs(self, **kwargs):
         """
@@ -280,25 +276,20 @@ class CMSFS(object):
         params = {'dataset': dataset, 'detail': 'True'}
         if  run:
             params.update({'run_num': run})
-        data = get_data(url, params)
-        plist = [File(f) for f in data]
-        return plist
+        # stream files one by one, large datasets contain 100k+ files
+        return (File(f) for f in get_data_stream(url, params))
 
     def list_sites4dataset(self, **kwargs):
         """
         Controller to get sites for given dataset
         """
-        url = phedex_url('fileReplicas')
-        params = {'dataset': kwargs['dataset']}
-        return find_sites(url, params)
+        return find_sites(REPLICAS.lookup(dataset=kwargs['dataset']))
 
     def list_sites4file(self, **kwargs):
         """
         Controller to get sites for given file
         """
-        url = phedex_url('fileReplicas')
-        params = {'lfn': kwargs['filename']}
-        return find_sites(url, params)
+        return find_sites(REPLICAS.lookup([kwargs['filename']]))
 
     def list_sites(self, **kwargs):
         """
@@ -391,7 +382,7 @@ def dataset_info(dataset, verbose=None):
     if  url.find('cmsdbsprod') != -1: # DBS2
         return dbs2.dataset_info(dataset, verbose)
     params = {'dataset': dataset, 'detail':'True'}
-    result = get_data(dbs_url('datasets'), params, verbose)
+    result = get_data(dbs_url('datasets'), params, verbose=verbose)
     res = [Dataset(r) for r in result]
     if  len(res) != 1:
         msg  = 'The %s dataset yield %s results' % (dataset, len(res))
@@ -404,7 +395,7 @@ def block_info(block, verbose=None):
     if  url.find('cmsdbsprod') != -1: # DBS2
         return dbs2.block_info(block, verbose)
     params = {'block_name': block, 'detail':'True'}
-    result = get_data(dbs_url('blocks'), params, verbose)
+    result = get_data(dbs_url('blocks'), params, verbose=verbose)
     res = [Block(r) for r in result][0]
     if  len(res) != 1:
         msg  = 'The %s block yield %s results' % (block, len(res))
@@ -417,7 +408,7 @@ def file_info(lfn, verbose=None):
     if  url.find('cmsdbsprod') != -1: # DBS2
         return dbs2.file_info(lfn, verbose)
     params = {'logical_file_name': lfn, 'detail':'True'}
-    result = get_data(dbs_url('files'), params, verbose)
+    result = get_data(dbs_url('files'), params, verbose=verbose)
     res = [File(r) for r in result]
     if  len(res) != 1:
         msg  = 'The %s LFN yield %s results' % (lfn, len(res))
@@ -467,45 +458,95 @@ def release_info(release, rfilter=None):
     return plist
 
 def run_lumi_subset(json_file, run_lumi):
-    "Return subset of good run/lumis based on provided golden json file and run lumi dict"
-    rdict = {}
-    for key, lumi_ranges in json_file.items():
-        for run, lumis in run_lumi.items():
-            if  int(run) == int(key):
-                all_lumis = (i for x in lumi_ranges for i in xrange(x[0], x[-1]+1))
-                if  lumis:
-                    rdict[run] = list(set(lumis) & set(all_lumis))
-                else:
-                    rdict[run] = list(set(all_lumis))
-    return rdict
+    """
+    Return subset of good run/lumis based on provided golden json file
+    and run lumi dict. Runs with empty lumi list in run lumi dict get
+    all their good lumis.
+    """
+    golden = json_file
+    if  not isinstance(golden, RunLumiMask):
+        golden = RunLumiMask(golden)
+    if  not isinstance(run_lumi, RunLumiMask):
+        run_lumi = RunLumiMask(run_lumi)
+    return run_lumi & golden
+
+class GoldenJSONCache(object):
+    """
+    Cache of parsed golden JSON files. Every file is parsed once into
+    RunLumiMask which is re-used until file modification time or size
+    is changed.
+    """
+    def __init__(self):
+        self.cache = {} # fname: ((mtime, size), mask)
+
+    def get(self, fname):
+        "Return RunLumiMask for given golden JSON file"
+        fstat = os.stat(fname)
+        fkey  = (fstat.st_mtime, fstat.st_size)
+        entry = self.cache.get(fname)
+        if  entry and entry[0] == fkey:
+            return entry[1]
+        with open(fname, 'r') as json_file:
+            mask = RunLumiMask(json.load(json_file))
+        self.cache[fname] = (fkey, mask)
+        return mask
+
+# create an singleton instance which will be used through the code
+GOLDEN_JSON = GoldenJSONCache()
 
 def run_lumi_golden_json():
-    "Get run lumi dict from golden JSON file"
+    "Get run lumi mask from golden JSON file"
     fname = os.environ.get('CMS_JSON', None)
-    if  os.path.isfile(fname):
-        with open(fname, 'r') as json_file:
-            try:
-                cms_json = json.load(json_file)
-                return fname, cms_json
-            except:
-                print_error('Unable to decode CMS JSON: %s' % fname)
-                return fname, {}
+    if  fname and os.path.isfile(fname):
+        try:
+            return fname, GOLDEN_JSON.get(fname)
+        except:
+            print_error('Unable to decode CMS JSON: %s' % fname)
+            return fname, {}
     else:
         msg  = 'Unable to locate CMS JSON file'
         print_warning(msg)
         return None, {}
 
-def parse_runlumis(filelumis):
-    "Parse DBS3 output of filelumis API and return run-lumi dict"
-    run_lumi = {}
+def merge_runlumis(run_lumi, filelumis):
+    """
+    Merge DBS3 output of filelumis API into given run-lumi mask
+    """
+    rdict = {}
     for row in filelumis:
-        run  = row['run_num']
-        lumi = row['lumi_section_num']
-        run_lumi.setdefault(run, []).append(lumi)
+        lumis = row['lumi_section_num']
+        if  isinstance(lumis, list):
+            rdict.setdefault(row['run_num'], []).extend(lumis)
+        else:
+            rdict.setdefault(row['run_num'], []).append(lumis)
+    for run, lumis in rdict.iteritems():
+        run_lumi.add(run, lumis)
+    return run_lumi
+
+def parse_runlumis(filelumis):
+    "Parse DBS3 output of filelumis API and return run-lumi mask"
+    return merge_runlumis(RunLumiMask(), filelumis)
+
+def dataset_runlumis(dataset, verbose=None):
+    """
+    Return run-lumi dict for given dataset. The filelumis look-ups are
+    done per dataset block, they are issued concurrently and their
+    results are merged as soon as they arrive.
+    """
+    params   = {'dataset': dataset}
+    url      = dbs_url('filelumis')
+    requests = [(url, {'block_name': row['block_name']}) \
+            for row in get_data(dbs_url('blocks'), params, verbose=verbose)]
+    run_lumi = RunLumiMask()
+    for _url, _params, rows in get_data_many(requests, verbose=verbose):
+        merge_runlumis(run_lumi, rows)
     return run_lumi
 
 def run_lumi_dict(arg, verbose=None):
-    "Return run-lumi info for given argument (dataset, block, file, run)"
+    """
+    Return run-lumi mask for given argument (dataset, block, file, run
+    or run-lumi dict)
+    """
     try:
         data = json.loads(arg)
     except:
@@ -514,29 +555,24 @@ def run_lumi_dict(arg, verbose=None):
         else:
             data = arg # assume it is dataset/file/block/run
     url = dbs_url()
-    run_lumi = {}
+    run_lumi = RunLumiMask()
     if  isinstance(data, dict): # we got run-lumi dict
-        for run, lumis in data.items():
-            run_lumi[int(run)] = lumis
+        run_lumi = RunLumiMask(data)
     else:
         if  url.find('cmsdbsprod') != -1: # DBS2
             run_lumi = dbs2.run_lumi(str(data), verbose)
         else:
-            if  pat_dataset.match(data):
-                params = {'dataset': data}
-                result = get_data(dbs_url('files'), params, verbose)
-                for row in result:
-                    params = {'logical_file_name': row['logical_file_name']}
-                    run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose))
-            elif pat_block.match(data):
+            if  pat_block.match(data):
                 params = {'block_name': data}
-                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose))
+                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose=verbose))
             elif pat_lfn.match(data):
                 params = {'logical_file_name': data}
-                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose))
+                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose=verbose))
             elif pat_run.match(data):
                 params = {'run_num': data}
-                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose))
+                run_lumi = parse_runlumis(get_data(dbs_url('filelumis'), params, verbose=verbose))
+            elif pat_dataset.match(data):
+                run_lumi = dataset_runlumis(data, verbose)
     return run_lumi
 
 def run_lumi_info(arg, verbose=None):
@@ -545,19 +581,20 @@ def run_lumi_info(arg, verbose=None):
     if  not run_lumi:
         print_error('Empty run-lumi list')
         return []
-    totlumi, lumiunit = lumidb(run_lumi_dict=run_lumi, lumi_report=verbose)
+    # lumidb drops unknown runs from its input, therefore we pass a copy
+    totlumi, lumiunit = lumidb(run_lumi_dict=dict(run_lumi), lumi_report=verbose)
     print "Delivered luminosity %s (%s)" % (totlumi, lumiunit)
     if  verbose:
-        print "Input run lumi dict", pprint.pprint(run_lumi)
+        print "Input run lumi dict", pprint.pprint(run_lumi.tojson())
     golden_fname, golden_json = run_lumi_golden_json()
     if  golden_json:
         if  verbose:
             print "Intersect with CMS JSON:", golden_fname
         rdict = run_lumi_subset(golden_json, run_lumi)
-        totlumi, lumiunit = lumidb(rdict, lumi_report=verbose)
+        totlumi, lumiunit = lumidb(dict(rdict), lumi_report=verbose)
         print "Delivered luminosity wrt CMS JSON: %s (%s)" % (totlumi, lumiunit)
         if  verbose:
-            print "Intersected run lumi dict", pprint.pprint(rdict)
+            print "Intersected run lumi dict", pprint.pprint(rdict.tojson())
     return []
 
 # create instance of CMSFS class (singleton)
@@ -15,13 +15,24 @@ import json
 import urllib
 import urllib2
 import httplib
+import itertools
+from   types import GeneratorType
 from   optparse import OptionParser
 
 # cmssh modules
 from cmssh.auth_utils import HTTPSClientAuthHandler, get_key_cert
 from cmssh.auth_utils import PEMMGR, working_pem
+from cmssh.das_cache import DAS_CACHE
+from cmssh.unique import unique_rows
+try:
+    from cmssh.pycurl_manager import RequestHandler
+except:
+    RequestHandler = None
 
-def convet_time(val):
+DAS_PAGE = int(os.environ.get('CMSSH_DAS_PAGE', 100)) # records per request
+PAT_PID  = re.compile(r'^[a-z0-9]{32}$')
+
+def convert_time(val):
     "Convert given timestamp into human readable format"
     if  isinstance(val, int) or isinstance(val, float):
         return time.strftime('%d/%b/%Y_%H:%M:%S_GMT', time.gmtime(val))
@@ -45,61 +56,63 @@ def unique_filter(rows):
     """
     Unique filter drop duplicate rows.
     """
-    old_row = {}
-    row = None
-    for row in rows:
-        row_data = dict(row)
-        try:
-            del row_data['_id']
-            del row_data['das']
-            del row_data['das_id']
-            del row_data['cache_id']
-        except:
-            pass
-        old_data = dict(old_row)
-        try:
-            del old_data['_id']
-            del old_data['das']
-            del old_data['das_id']
-            del old_data['cache_id']
-        except:
-            pass
-        if  row_data == old_data:
-            continue
-        if  old_row:
-            yield old_row
-        old_row = row
-    yield row
+    return unique_rows(rows)
 
-def get_value(data, filters):
-    """Filter data from a row for given list of filters"""
+# formatters of filter values, applied to the last key of filter path
+FORMATTERS = {'creation_time': convert_time, 'size': size_format}
+ACCESSORS  = {} # cache of compiled filters
+
+def compile_filter(ftr):
+    """
+    Compile given filter path, e.g. file.name, into accessor function
+    which returns string value of the path in given row. Lists met on
+    the way are fanned out, distinct values are returned as a list.
+    """
+    keys = ftr.split('.')
+    fmt  = FORMATTERS.get(keys[-1])
+    def accessor(row):
+        "Return value of compiled filter path in given row"
+        nodes = row if isinstance(row, list) else [row]
+        for key in keys:
+            found = []
+            for node in nodes:
+                if  isinstance(node, dict) and key in node:
+                    val = node[key]
+                    if  isinstance(val, list): # fan-out
+                        found.extend(val)
+                    else:
+                        found.append(val)
+            nodes = found
+        if  fmt:
+            nodes = [fmt(v) for v in nodes]
+        if  len(nodes) == 1:
+            val = nodes[0]
+        else:
+            values = []
+            for val in nodes:
+                if  val not in values:
+                    values.append(val)
+            if  len(values) != 1:
+                return str(values)
+            val = values[0]
+        return val if isinstance(val, basestring) else str(val)
+    return accessor
+
+def compile_filters(filters):
+    "Return list of accessors for given filters, conditions are skipped"
+    accessors = []
     for ftr in filters:
         if  ftr.find('>') != -1 or ftr.find('<') != -1 or ftr.find('=') != -1:
             continue
-        row = dict(data)
-        values = set()
-        for key in ftr.split('.'):
-            if  isinstance(row, dict) and row.has_key(key):
-                if  key == 'creation_time':
-                    row = convert_time(row[key])
-                elif  key == 'size':
-                    row = size_format(row[key])
-                else:
-                    row = row[key]
-            if  isinstance(row, list):
-                for item in row:
-                    if  isinstance(item, dict) and item.has_key(key):
-                        if  key == 'creation_time':
-                            row = convert_time(item[key])
-                        elif  key == 'size':
-                            row = size_format(item[key])
-                        else:
-                            row = item[key]
-                        values.add(row)
-        if  len(values) == 1:
-            yield str(values.pop())
-        else:
-            yield str(list(values))
+        if  ftr not in ACCESSORS:
+            ACCESSORS[ftr] = compile_filter(ftr)
+        accessors.append(ACCESSORS[ftr])
+    return accessors
+
+def get_value(data, filters):
+    """Filter data from a row for given list of filters"""
+    for accessor in compile_filters(filters):
+        yield accessor(data)
 
 def fullpath(path):
     "Expand path to full path"
@@ -109,64 +122,177 @@ def fullpath(path):
         path = os.path.join(os.environ['HOME'], path)
     return path
 
-def get_data(host, query, idx, limit, debug, threshold=300, ckey=None, cert=None):
-    """Contact DAS server and retrieve data for given DAS query"""
-    if  not ckey and not cert:
-        ckey, cert = get_key_cert()
-    params  = {'input':query, 'idx':idx, 'limit':limit}
-    path    = '/das/cache'
-    pat     = re.compile('http[s]{0,1}://')
-    if  not pat.match(host):
-        msg = 'Invalid hostname: %s' % host
-        raise Exception(msg)
-    url = host + path
-    headers = {"Accept": "application/json"}
-    encoded_data = urllib.urlencode(params, doseq=True)
-    url += '?%s' % encoded_data
-    req  = urllib2.Request(url=url, headers=headers)
-    if  ckey and cert:
-        ckey = fullpath(ckey)
-        cert = fullpath(cert)
-        hdlr = HTTPSClientAuthHandler(ckey, cert)
-    else:
-        hdlr = urllib2.HTTPHandler(debuglevel=debug)
-    opener = urllib2.build_opener(hdlr)
-    fdesc = opener.open(req)
-    data = fdesc.read()
-    fdesc.close()
+def is_pid(data):
+    "Check if DAS response is a pid of request which is still processed"
+    return data and isinstance(data, str) and len(data) == 32 \
+        and PAT_PID.match(data) is not None
 
-    pat = re.compile(r'^[a-z0-9]{32}')
-    if  data and isinstance(data, str) and pat.match(data) and len(data) == 32:
-        pid = data
-    else:
-        pid = None
-    sleep   = 1  # initial waiting time in seconds
-    wtime   = 30 # final waiting time in seconds
-    time0   = time.time()
-    while pid:
-        params.update({'pid':data})
-        encoded_data = urllib.urlencode(params, doseq=True)
-        url  = host + path + '?%s' % encoded_data
-        req  = urllib2.Request(url=url, headers=headers)
-        try:
-            fdesc = opener.open(req)
-            data = fdesc.read()
-            fdesc.close()
-        except urllib2.HTTPError as err:
-            return json.dumps({"status":"fail", "reason":str(err)})
-        if  data and isinstance(data, str) and pat.match(data) and len(data) == 32:
-            pid = data
-        else:
-            pid = None
-        time.sleep(sleep)
-        if  sleep < wtime:
-            sleep *= 2
+def fail(reason):
+    "Return DAS response for failed request"
+    return json.dumps({"status":"fail", "reason":reason})
+
+class DASClient(object):
+    """
+    Asynchronous DAS client. Many requests are submitted at once and
+    pids of those which are still processed by DAS are polled together,
+    over keep-alive connections of the shared curl pool. Results of a
+    query are fetched in pages (idx/limit windows) which are yielded as
+    they arrive. Pids and results are shared with other calls through
+    given cache, see cmssh.das_cache.
+    """
+    def __init__(self, host='https://cmsweb.cern.ch', ckey=None, cert=None,
+            threshold=300, debug=0, cache=DAS_CACHE):
+        if  not re.match('http[s]{0,1}://', host):
+            msg = 'Invalid hostname: %s' % host
+            raise Exception(msg)
+        if  not ckey and not cert:
+            ckey, cert = get_key_cert()
+        self.url       = host + '/das/cache'
+        self.ckey      = fullpath(ckey) if ckey else ckey
+        self.cert      = fullpath(cert) if cert else cert
+        self.threshold = threshold
+        self.debug     = debug
+        self.headers   = {"Accept": "application/json"}
+        self.cache     = cache
+
+    def responses(self, params_list):
+        """
+        Send requests for given list of parameters concurrently and yield
+        (params, HTTP code, data) in order of their completion
+        """
+        if  RequestHandler:
+            mgr = RequestHandler()
+            calls = [(self.url, params) for params in params_list]
+            for _url, params, data, code in mgr.get_many(calls, self.headers,
+                    ckey=self.ckey, cert=self.cert, verbose=self.debug,
+                    decoder=None, status=True):
+                yield params, code, data
+            return
+        # urllib fallback, requests are sent one by one
+        if  self.ckey and self.cert:
+            hdlr = HTTPSClientAuthHandler(self.ckey, self.cert)
         else:
-            sleep = wtime
-        if  (time.time()-time0) > threshold:
-            reason = "client timeout after %s sec" % int(time.time()-time0)
-            return json.dumps({"status":"fail", "reason":reason})
-    return data
+            hdlr = urllib2.HTTPHandler(debuglevel=self.debug)
+        opener = urllib2.build_opener(hdlr)
+        for params in params_list:
+            url = self.url + '?%s' % urllib.urlencode(params, doseq=True)
+            req = urllib2.Request(url=url, headers=self.headers)
+            try:
+                fdesc = opener.open(req)
+                data  = fdesc.read()
+                fdesc.close()
+                yield params, 200, data
+            except urllib2.HTTPError as err:
+                yield params, err.code, str(err)
+
+    def fetch(self, requests):
+        """
+        Submit given list of (query, idx, limit) requests and yield
+        (request, data) pairs in order of their completion, where data
+        is raw DAS response. Pids of pending requests are polled with
+        doubling sleep time (up to 30 sec) shared by all of them.
+        Cached results are yielded first and pids of queries which DAS
+        still processes are reused.
+        """
+        pending = {} # id(params): (request, params)
+        reused  = set() # id(params) of requests polled with cached pid
+        for request in requests:
+            query, idx, limit = request
+            data = self.cache.get(query, idx, limit) if self.cache else None
+            if  data is not None:
+                yield request, data
+                continue
+            params = {'input':query, 'idx':idx, 'limit':limit}
+            pid = self.cache.get_pid(query) if self.cache else None
+            if  pid:
+                params['pid'] = pid
+                reused.add(id(params))
+            pending[id(params)] = (request, params)
+        sleep  = 1  # initial waiting time in seconds
+        wtime  = 30 # final waiting time in seconds
+        time0  = time.time()
+        while pending:
+            plist = [params for _, params in pending.values()]
+            for params, code, data in self.responses(plist):
+                request, _ = pending[id(params)]
+                if  code != 200 and id(params) in reused:
+                    # cached pid is gone on DAS side, submit query again
+                    reused.discard(id(params))
+                    self.cache.drop_pid(request[0])
+                    del params['pid']
+                elif code != 200:
+                    del pending[id(params)]
+                    yield request, fail('HTTP code %s, %s' % (code, data))
+                elif is_pid(data):
+                    reused.discard(id(params)) # DAS knows the pid
+                    params['pid'] = data
+                    if  self.cache:
+                        self.cache.put_pid(request[0], data)
+                else:
+                    del pending[id(params)]
+                    if  self.cache:
+                        self.cache.put(request[0], request[1], request[2], data)
+                    yield request, data
+            if  pending and (time.time()-time0) > self.threshold:
+                reason = "client timeout after %s sec" % int(time.time()-time0)
+                for request, _ in pending.values():
+                    yield request, fail(reason)
+                return
+            if  pending:
+                time.sleep(sleep)
+                sleep = min(sleep*2, wtime)
+
+    def get(self, query, idx=0, limit=0):
+        "Return raw DAS response for given query"
+        for _request, data in self.fetch([(query, idx, limit)]):
+            return data
+
+    def queries(self, queries, idx=0, limit=0):
+        """
+        Submit given list of queries at once and yield (query, response)
+        pairs in order of their completion, response is decoded JSON
+        """
+        for request, data in self.fetch([(q, idx, limit) for q in queries]):
+            yield request[0], json.loads(data)
+
+    def pages(self, query, idx=0, limit=0, page=DAS_PAGE):
+        """
+        Yield decoded DAS responses for consecutive pages of given query
+        results starting at idx, limit=0 means all results. The first
+        page is fetched alone since DAS processes the query for it, the
+        rest is requested at once and yielded in order as pages arrive.
+        """
+        size  = min(page, limit) if limit else page
+        first = json.loads(self.get(query, idx, size))
+        yield first
+        if  first.get('status') != 'ok' or \
+            not isinstance(first.get('data'), list):
+            return
+        end = first.get('nresults', 0)
+        if  limit:
+            end = min(end, idx + limit)
+        starts = range(idx + size, end, size)
+        ready  = {}
+        for request, data in self.fetch(\
+                [(query, s, min(size, end-s)) for s in starts]):
+            ready[request[1]] = data
+            while starts and starts[0] in ready:
+                yield json.loads(ready.pop(starts.pop(0)))
+
+def page_rows(pages):
+    "Yield records from data of given DAS responses"
+    for jsondict in pages:
+        if  jsondict.get('status') != 'ok':
+            print "status: %s reason: %s" \
+                % (jsondict.get('status'), jsondict.get('reason', 'N/A'))
+            return
+        for row in jsondict.get('data', []):
+            yield row
+
+def get_data(host, query, idx, limit, debug, threshold=300, ckey=None, cert=None):
+    """Contact DAS server and retrieve data for given DAS query"""
+    client = DASClient(host, ckey, cert, threshold, debug)
+    return client.get(query, idx, limit)
 
 def prim_value(row):
     """Extract primary key value from DAS record"""
@@ -179,6 +305,17 @@ def prim_value(row):
     else:
         return row[key][att]
 
+def das_queries(host, queries, idx=0, limit=0, debug=0):
+    """
+    Submit given list of DAS queries at once and yield (query, response)
+    pairs as they complete, response is decoded JSON
+    """
+    cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+    with working_pem(PEMMGR.pem) as ckey:
+        client = DASClient(host, ckey, cert, debug=debug)
+        for query, jsondict in client.queries(queries, idx, limit):
+            yield query, jsondict
+
 def das_client(host, query, idx, limit, debug, dformat):
     "DAS client"
     if  not query:
@@ -186,75 +323,80 @@ def das_client(host, query, idx, limit, debug, dformat):
     ckey = None
     cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
     with working_pem(PEMMGR.pem) as ckey:
-        data = get_data(host, query, idx, limit, debug, ckey, cert)
-    if  dformat == 'plain':
-        jsondict = json.loads(data)
-        if  not jsondict.has_key('status'):
-            print 'DAS record without status field:\n%s' % jsondict
-            return
-        if  jsondict['status'] != 'ok':
-            print "status: %s reason: %s" \
-                % (jsondict.get('status'), jsondict.get('reason', 'N/A'))
-            return
-        nres = jsondict['nresults']
-        if  not limit:
-            drange = '%s' % nres
+        client = DASClient(host, ckey, cert, debug=debug)
+        if  dformat == 'plain':
+            # records are printed while following pages are fetched
+            print_results(client.pages(query, idx, limit), idx, limit)
         else:
-            drange = '%s-%s out of %s' % (idx+1, idx+limit, nres)
-        if  limit:
-            msg  = "\nShowing %s results" % drange
-            msg += ", for more results use --idx/--limit options\n"
-            print msg
-        mongo_query = jsondict['mongo_query']
-        unique  = False
-        fdict   = mongo_query.get('filters', {})
-        filters = fdict.get('filters', [])
-        aggregators = mongo_query.get('aggregators', [])
-        if  'unique' in fdict.keys():
-            unique = True
-        if  filters and not aggregators:
-            data = jsondict['data']
-            if  isinstance(data, dict):
-                rows = [r for r in get_value(data, filters)]
-                print ' '.join(rows)
-            elif isinstance(data, list):
-                if  unique:
-                    data = unique_filter(data)
-                for row in data:
-                    rows = [r for r in get_value(row, filters)]
-                    print ' '.join(rows)
-            else:
-                print jsondict
-        elif aggregators:
-            data = jsondict['data']
+            return json.loads(client.get(query, idx, limit))
+
+def print_results(pages, idx, limit):
+    "Print DAS results from given sequence of pages (DAS responses)"
+    jsondict = pages.next()
+    if  not jsondict.has_key('status'):
+        print 'DAS record without status field:\n%s' % jsondict
+        return
+    if  jsondict['status'] != 'ok':
+        print "status: %s reason: %s" \
+            % (jsondict.get('status'), jsondict.get('reason', 'N/A'))
+        return
+    nres = jsondict['nresults']
+    if  not limit:
+        drange = '%s' % nres
+    else:
+        drange = '%s-%s out of %s' % (idx+1, idx+limit, nres)
+    if  limit:
+        msg  = "\nShowing %s results" % drange
+        msg += ", for more results use --idx/--limit options\n"
+        print msg
+    mongo_query = jsondict['mongo_query']
+    unique  = False
+    fdict   = mongo_query.get('filters', {})
+    filters = fdict.get('filters', [])
+    aggregators = mongo_query.get('aggregators', [])
+    if  'unique' in fdict.keys():
+        unique = True
+    data = jsondict['data']
+    if  isinstance(data, list):
+        # records of following pages are consumed as they arrive
+        data = page_rows(itertools.chain([jsondict], pages))
+    if  filters and not aggregators:
+        accessors = compile_filters(filters)
+        if  isinstance(data, dict):
+            print ' '.join([get(data) for get in accessors])
+        elif isinstance(data, GeneratorType):
             if  unique:
                 data = unique_filter(data)
             for row in data:
-                if  row['key'].find('size') != -1 and \
-                    row['function'] == 'sum':
-                    val = size_format(row['result']['value'])
-                else:
-                    val = row['result']['value']
-                print '%s(%s)=%s' \
-                % (row['function'], row['key'], val)
+                print ' '.join([get(row) for get in accessors])
         else:
-            data = jsondict['data']
-            if  isinstance(data, list):
-                old = None
-                val = None
-                for row in data:
-                    val = prim_value(row)
-                    if  not limit:
-                        if  val != old:
-                            print val
-                            old = val
-                    else:
-                        print val
-                if  val != old and not limit:
-                    print val
-            elif isinstance(data, dict):
-                print prim_value(data)
+            print jsondict
+    elif aggregators:
+        if  unique:
+            data = unique_filter(data)
+        for row in data:
+            if  row['key'].find('size') != -1 and \
+                row['function'] == 'sum':
+                val = size_format(row['result']['value'])
             else:
-                print data
+                val = row['result']['value']
+            print '%s(%s)=%s' \
+            % (row['function'], row['key'], val)
     else:
-        return json.loads(data)
+        if  isinstance(data, GeneratorType):
+            old = None
+            val = None
+            for row in data:
+                val = prim_value(row)
+                if  not limit:
+                    if  val != old:
+                        print val
+                        old = val
+                else:
+                    print val
+            if  val != old and not limit:
+                print val
+        elif isinstance(data, dict):
+            print prim_value(data)
+        else:
+            print data
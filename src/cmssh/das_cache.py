@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+In-memory cache of DAS queries. DAS answers a new query with a pid of
+the request it processes, the pid is remembered per query, such that
+repeated or paginated queries poll the same request instead of starting
+the DAS workflow again. Results are kept per query and idx/limit window
+for a limited time, a cached window also serves windows it contains.
+"""
+
+# system modules
+import os
+import re
+import json
+import time
+import threading
+from   collections import OrderedDict
+
+def normalize(query):
+    "Return normalized form of given DAS query"
+    query = ' '.join(query.split())
+    return re.sub(r'\s*([=|,<>])\s*', r'\1', query)
+
+def contains(idx1, limit1, idx2, limit2):
+    "Check if idx1/limit1 window of results contains idx2/limit2 one"
+    if  idx2 < idx1:
+        return False
+    if  not limit1: # all results starting at idx1
+        return True
+    return limit2 and idx2 + limit2 <= idx1 + limit1
+
+class DASCache(object):
+    """
+    Cache of DAS pids and results, results expire after ttl seconds and
+    at most max_entries of them are kept (least recently used are
+    dropped first). Pids expire after pid_ttl seconds.
+    """
+    def __init__(self, ttl=600, max_entries=100, pid_ttl=3600):
+        self.ttl         = ttl
+        self.max_entries = max_entries
+        self.pid_ttl     = pid_ttl
+        self.lock        = threading.Lock()
+        self.results     = OrderedDict() # (query, idx, limit): (data, expire)
+        self.pids        = {} # query: (pid, expire)
+
+    def enabled(self):
+        "Check if cache is enabled"
+        return self.ttl > 0 and os.environ.get('CMSSH_CACHE', '1') != '0'
+
+    def get(self, query, idx=0, limit=0):
+        """
+        Return cached raw DAS response for given query and idx/limit
+        window or None
+        """
+        if  not self.enabled():
+            return None
+        query = normalize(query)
+        with self.lock:
+            data = self.lookup((query, idx, limit))
+            if  data is not None:
+                return data
+            # look-up cached window which contains requested one
+            for key in self.results.keys():
+                if  key[0] == query and contains(key[1], key[2], idx, limit):
+                    data = self.lookup(key)
+                    if  data is not None:
+                        start = key[1]
+                        break
+        if  data is None:
+            return None
+        jsondict = json.loads(data)
+        if  not isinstance(jsondict.get('data'), list):
+            return None
+        rows = jsondict['data']
+        first = idx - start
+        jsondict['data'] = rows[first:first+limit] if limit else rows[first:]
+        return json.dumps(jsondict)
+
+    def lookup(self, key):
+        "Return valid entry for given key, must be called under the lock"
+        entry = self.results.get(key)
+        if  not entry:
+            return None
+        data, expire = entry
+        if  expire < time.time():
+            del self.results[key]
+            return None
+        # move entry to the end of LRU order
+        del self.results[key]
+        self.results[key] = entry
+        return data
+
+    def put(self, query, idx, limit, data):
+        "Store raw DAS response for given query and idx/limit window"
+        if  not self.enabled():
+            return
+        try:
+            if  json.loads(data).get('status') != 'ok':
+                return # failures are not cached
+        except ValueError:
+            return
+        query = normalize(query)
+        with self.lock:
+            self.results.pop((query, idx, limit), None)
+            self.results[(query, idx, limit)] = (data, time.time() + self.ttl)
+            while len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+            # the request is complete, its pid is not valid anymore
+            self.pids.pop(query, None)
+
+    def get_pid(self, query):
+        "Return pid of pending DAS request for given query or None"
+        if  not self.enabled():
+            return None
+        query = normalize(query)
+        with self.lock:
+            pid, expire = self.pids.get(query, (None, 0))
+            if  pid and expire < time.time():
+                del self.pids[query]
+                return None
+            return pid
+
+    def put_pid(self, query, pid):
+        "Remember pid of pending DAS request for given query"
+        if  self.enabled():
+            with self.lock:
+                self.pids[normalize(query)] = (pid, time.time() + self.pid_ttl)
+
+    def drop_pid(self, query):
+        "Forget pid of given query, e.g. DAS rejected it"
+        with self.lock:
+            self.pids.pop(normalize(query), None)
+
+    def clear(self):
+        "Remove all cache entries"
+        with self.lock:
+            self.results.clear()
+            self.pids.clear()
+
+    def info(self):
+        "Return dict with cache statistics"
+        with self.lock:
+            now = time.time()
+            expired = len([1 for _, exp in self.results.values() if exp < now])
+            return {'entries': len(self.results), 'expired': expired,
+                    'size': sum(len(d) for d, _ in self.results.values()),
+                    'pids': len(self.pids)}
+
+# create an singleton instance which will be used through the code
+DAS_CACHE = DASCache(int(os.environ.get('CMSSH_DAS_CACHE_TTL', 600)))
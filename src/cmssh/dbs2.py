@@ -24,6 +24,7 @@ from   cmssh.filemover import get_pfns, resolve_user_srm_path, lfn2pfn
 from   cmssh.cms_urls import dbs_url, dbs_instances
 from   cmssh.iprint import print_error, print_warning
 from   cmssh.regex import pat_dataset, pat_block, pat_lfn, pat_run
+from   cmssh.runlumi import RunLumiMask
 
 def list_datasets(kwargs):
     """Find sites"""
@@ -151,19 +152,11 @@ def run_lumi(arg, verbose=None):
         query  = 'find run,lumi where run=%s' % arg
     params = {"api":"executeQuery", "apiversion": "DBS_2_0_9", "query":query}
     data   = urllib2.urlopen(dbs_url(), urllib.urlencode(params))
-    run_lumi = {}
+    rdict = {}
     for row in qlxml_parser(data, 'run'):
         rec = row['run']
-        run = rec['run']
-        lumi = rec['lumi']
-        if  run_lumi.has_key(run):
-            run_lumi[run].append(lumi)
-        else:
-            run_lumi[run] = [lumi]
-    for key, val in run_lumi.items():
-        val.sort()
-        run_lumi[key] = val
-    return run_lumi
+        rdict.setdefault(rec['run'], []).append(rec['lumi'])
+    return RunLumiMask(rdict)
 
 def main():
     "Main function"
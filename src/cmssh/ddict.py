@@ -25,53 +25,29 @@ examples:
         print rec
         {'a':{'b':1, 'c':[1,2]}, 'x': {'y': {'z': 1}}
 
+Compound keys are parsed once and cached, DotDict.path('a.b.c') returns
+compiled accessor which works on plain dicts without any wrappers, and
+DotView provides the same API as a zero-copy view of existing dict:
+
+    .. doctest::
+
+        files = DotDict.path('phedex.block.file').get(json_dict)
+        view  = DotView(json_dict)
+        print view['phedex.block.name']
+
 For a complete list of examples, see DotDict_t.py unit test module.
 """
 
 from types import GeneratorType
 
+PATHS = {} # cache of compiled compound keys
+
 def isdictinstance(obj):
     """
     Return if provided object is type of dict or instance of DotDict class
     """
     return isinstance(obj, dict) or isinstance(obj, DotDict)
 
-def convert_dot_notation(key, val):
-    """
-    Take provided key/value pair and convert it into dict if it
-    is required.
-    """
-    split_list = key.split('.')
-    if  len(split_list) == 1: # no dot notation found
-        return key, val
-    split_list.reverse()
-    newval = val
-    item = None
-    for item in split_list:
-        if  item == split_list[-1]:
-            return item, newval
-        newval = {item:newval}
-    return item, newval
-
-def yield_obj(rdict, ckey):
-    """
-    Helper function for DotDict class. For a given dict and compound key,
-    e.g. a.b.c, extract and yield next key and its object(s).
-    """
-    keys = ckey.split('.')
-    key  = keys[0]
-    if  len(keys) > 1:
-        next_key = '.'.join(keys[1:])
-    else:
-        next_key = None
-    if  rdict.has_key(key):
-        obj = rdict[key]
-        if  isinstance(obj, list) or isinstance(obj, GeneratorType):
-            for item in obj:
-                yield next_key, item
-        else:
-            yield next_key, obj
-
 def helper_loop(combo, vals):
     "Helper function"
     if  isinstance(vals, dict):
@@ -83,6 +59,153 @@ def helper_loop(combo, vals):
                 for kkk in DotDict(item).get_keys():
                     yield '%s.%s' % (combo, kkk)
 
+class DotPath(object):
+    """
+    Compiled compound key, e.g. a.b.c. Its methods walk plain dicts (and
+    DotDict instances) directly, i.e. without wrapping nested objects.
+    """
+    __slots__ = ['keys', 'last']
+    def __init__(self, ckey):
+        self.keys = tuple(ckey.split('.'))
+        self.last = len(self.keys) - 1
+
+    def get(self, obj, default=None):
+        """
+        Get value of the key in given dict, see DotDict.get. In a case of
+        accessed value of a list type walk into its first element which
+        yields non-empty value.
+        """
+        return self.walk(obj, 0, default)
+
+    def walk(self, obj, idx, default):
+        "Walk given dict starting from idx-th key"
+        keys = self.keys
+        while True:
+            key = keys[idx]
+            if  key not in obj:
+                return default
+            val = dict.__getitem__(obj, key)
+            if  idx == self.last:
+                return val
+            idx += 1
+            if  isinstance(val, dict):
+                obj = val
+                default = None
+            elif isinstance(val, list):
+                for elem in val:
+                    if  isinstance(elem, dict):
+                        newobj = self.walk(elem, idx, None)
+                        if  newobj:
+                            return newobj
+                return val
+            else:
+                return val
+
+    def values(self, obj):
+        """
+        Generator which yields all values of the key in given dict, lists
+        are walked through at any depth
+        """
+        nodes = [obj]
+        for key in self.keys:
+            found = []
+            for node in nodes:
+                if  isinstance(node, dict) and key in node:
+                    val = dict.__getitem__(node, key)
+                    if  isinstance(val, list) or isinstance(val, GeneratorType):
+                        found.extend(val)
+                    else:
+                        found.append(val)
+            nodes = found
+        for node in nodes:
+            yield node
+
+    def set(self, obj, value):
+        """
+        Set value of the key in given dict, missing intermediate dicts
+        are created
+        """
+        keys = self.keys
+        for idx, key in enumerate(keys):
+            if  key not in obj:
+                for nkey in reversed(keys[idx+1:]):
+                    value = {nkey: value}
+                break
+            if  idx == self.last:
+                break
+            obj = dict.__getitem__(obj, key)
+            if  not isinstance(obj, dict):
+                msg = 'Cannot assign new value, internal obj is not dict'
+                raise Exception(msg)
+        dict.__setitem__(obj, key, value)
+
+    def delete(self, obj):
+        "Delete the key from given dict"
+        for key in self.keys[:-1]:
+            obj = dict.__getitem__(obj, key)
+        dict.__delitem__(obj, self.keys[-1])
+
+def dot_path(ckey):
+    "Return compiled compound key, compiled keys are cached"
+    path = PATHS.get(ckey)
+    if  path is None:
+        if  len(PATHS) > 10000: # keys may come from data, keep cache small
+            PATHS.clear()
+        path = PATHS[ckey] = DotPath(ckey)
+    return path
+
+class DotView(object):
+    """
+    Zero-copy view of existing dict with DotDict API, nested dicts are
+    returned as views and assignments go to the underlying dict
+    """
+    __slots__ = ['data']
+    def __init__(self, data):
+        object.__setattr__(self, 'data', data)
+
+    def __getattr__(self, key):
+        obj = self.data.get(key, None)
+        if  isinstance(obj, dict):
+            return DotView(obj)
+        return obj
+
+    def __getitem__(self, key):
+        return self.get(key)
+
+    def __setitem__(self, key, val):
+        dot_path(key).set(self.data, val)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return repr(self.data)
+
+    def keys(self):
+        "Return top level keys"
+        return self.data.keys()
+
+    def get(self, ckey, default=None):
+        "Get value for provided compound key, see DotDict.get"
+        obj = dot_path(ckey).get(self.data, default)
+        if  obj is not default and isinstance(obj, dict):
+            return DotView(obj)
+        return obj
+
+    def get_values(self, ckey):
+        "Generator which yields values for any compound key"
+        return dot_path(ckey).values(self.data)
+
+    def delete(self, ckey):
+        "Delete provided compound key"
+        dot_path(ckey).delete(self.data)
+
 class DotDict(dict):
     """
     Access python dictionaries via dot notations, original idea taken from
@@ -93,6 +216,8 @@ class DotDict(dict):
     def __init__(self, idict):
         super(DotDict, self).__init__(idict)
 
+    path = staticmethod(dot_path)
+
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
@@ -115,33 +240,7 @@ class DotDict(dict):
         """
         Set value for provided compound key.
         """
-        obj  = self
-        keys = ikey.split('.')
-        for idx in range(0, len(keys)):
-            key = keys[idx]
-            if  not obj.has_key(key):
-                ckey = '.'.join(keys[idx:])
-                nkey, nval = convert_dot_notation(ckey, value)
-                if  isinstance(obj, DotDict):
-                    super(DotDict, obj).__setitem__(nkey, nval)
-                else:
-                    obj.__setitem__(nkey, nval)
-                return
-            if  key != keys[-1]:
-                try:
-                    obj = super(DotDict, obj).__getitem__(key)
-                except:
-                    try:
-                        obj = obj[key]
-                    except:
-                        raise
-                if  not isinstance(obj, dict):
-                    msg = 'Cannot assign new value, internal obj is not dict'
-                    raise Exception(msg)
-        if  isinstance(obj, DotDict):
-            super(DotDict, obj).__setitem__(key, value)
-        else:
-            obj.__setitem__(key, value)
+        dot_path(ikey).set(self, value)
 
     def _get_keys(self, ckey):
         """Helper generator which yields all keys for a starting ckey"""
@@ -186,63 +285,24 @@ class DotDict(dict):
         """
         Delete provided compound key from DotDict
         """
-        obj = self
-        keys = ckey.split('.')
-        for key in keys:
-            if  key == keys[-1]:
-                del obj[key]
-                break
-            if  isinstance(obj, DotDict):
-                obj = super(DotDict, obj).__getitem__(key)
-            else:
-                obj = obj.__getitem__(key)
+        dot_path(ckey).delete(self)
 
     def get(self, ckey, default=None):
         """
         Get value for provided compound key. In a case of
         accessed value of a list type returns its first element.
         """
-        obj = default
-        keys = ckey.split('.')
-        first = keys[0]
-        if  self.has_key(first):
-            obj = super(DotDict, self).__getitem__(first)
-            if  first == ckey:
-                if  isinstance(obj, dict):
-                    return DotDict(obj)
-                else:
-                    return obj
-            if  isdictinstance(obj):
-                return DotDict(obj).get('.'.join(keys[1:]))
-            elif isinstance(obj, list):
-                for elem in obj:
-                    if  isdictinstance(elem):
-                        newobj = elem.get('.'.join(keys[1:]))
-                        if  newobj:
-                            if  isinstance(newobj, dict):
-                                return DotDict(newobj)
-                            return newobj
+        obj = dot_path(ckey).get(self, default)
+        if  obj is not default and isinstance(obj, dict):
+            return DotDict(obj)
         return obj
 
     def get_values(self, ckey):
         """
-        Generator which yields values for any compound key. It works
-        up to three level deep in DotDict structure.
+        Generator which yields values for any compound key, lists are
+        walked through at any depth of DotDict structure.
         """
-        for next_key, item in yield_obj(self, ckey):
-            if  isdictinstance(item):
-                for final, elem in yield_obj(item, next_key):
-                    if  isdictinstance(elem) and elem.has_key(final):
-                        yield elem[final]
-                    else:
-                        yield elem
-            elif isinstance(item, list) or isinstance(item, GeneratorType):
-                for final, elem in item:
-                    for last, att in yield_obj(elem, final):
-                        if  isdictinstance(att) and att.has_key(last):
-                            yield att[last]
-                        else:
-                            yield att
+        return dot_path(ckey).values(self)
 
     def get_keys(self, ckey=None):
         """Return all keys for a starting ckey"""
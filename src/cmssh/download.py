@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Resumable and chunk-parallel downloads from HTTP(S) endpoints. A file
+is split into chunks which are fetched via HTTP range requests by a
+pool of threads into <file>.part, completed chunks are recorded in
+<file>.progress sidecar file, so an interrupted download resumes from
+the last completed chunk. Upon completion the file is verified against
+its catalog checksum (if provided) and moved into place.
+"""
+
+# system modules
+import os
+import json
+import zlib
+import tempfile
+import threading
+from   collections import deque
+
+# pycurl module
+import pycurl
+
+# cmssh modules
+from   cmssh.checksum import VERIFIER
+
+CHUNK_SIZE = 64*1024*1024 # default size of downloaded chunks
+
+def parse_headers(data):
+    "Parse HTTP response headers into dict with lower-case keys"
+    headers = {}
+    for line in data.splitlines():
+        if  line.find(':') != -1:
+            key, val = line.split(':', 1)
+            headers[key.strip().lower()] = val.strip()
+    return headers
+
+class RangeDownload(object):
+    """
+    Download given url into given file name using nthreads parallel HTTP
+    range requests of chunk_size bytes each. Endpoints which don't
+    support range requests are downloaded as a single chunk.
+    """
+    def __init__(self, url, fname, nthreads=4, chunk_size=CHUNK_SIZE,
+            ckey=None, cert=None, verbose=None, callback=None):
+        self.url        = url
+        self.fname      = fname
+        self.nthreads   = nthreads
+        self.chunk_size = chunk_size
+        self.ckey       = ckey
+        self.cert       = cert
+        self.verbose    = verbose
+        self.callback   = callback # called with (bytes done, size)
+        self.part       = fname + '.part'
+        self.sidecar    = fname + '.progress'
+        self.lock       = threading.Lock()
+        self.size       = None
+        self.done       = set()
+        self.errors     = []
+
+    def curl(self):
+        "Return new curl handle with common options"
+        curl = pycurl.Curl()
+        curl.setopt(pycurl.URL, self.url)
+        curl.setopt(pycurl.NOSIGNAL, 1)
+        curl.setopt(pycurl.FOLLOWLOCATION, 1)
+        curl.setopt(pycurl.MAXREDIRS, 5)
+        curl.setopt(pycurl.CONNECTTIMEOUT, 30)
+        # abort chunks which stall for 5 minutes, they are retried later
+        curl.setopt(pycurl.LOW_SPEED_LIMIT, 1)
+        curl.setopt(pycurl.LOW_SPEED_TIME, 300)
+        curl.setopt(pycurl.SSL_VERIFYPEER, False)
+        if  self.ckey:
+            curl.setopt(pycurl.SSLKEY, self.ckey)
+        if  self.cert:
+            curl.setopt(pycurl.SSLCERT, self.cert)
+        if  self.verbose > 1:
+            curl.setopt(pycurl.VERBOSE, 1)
+        return curl
+
+    def info(self):
+        "Return size of remote file and flag if it supports range requests"
+        curl = self.curl()
+        hbuf = []
+        curl.setopt(pycurl.NOBODY, 1)
+        curl.setopt(pycurl.HEADERFUNCTION, hbuf.append)
+        try:
+            curl.perform()
+            code = curl.getinfo(pycurl.RESPONSE_CODE)
+            size = int(curl.getinfo(pycurl.CONTENT_LENGTH_DOWNLOAD))
+        finally:
+            curl.close()
+        if  code != 200 or size < 0:
+            raise IOError('Unable to get size of %s, HTTP code %s' \
+                    % (self.url, code))
+        headers = parse_headers(''.join(hbuf))
+        return size, headers.get('accept-ranges') == 'bytes'
+
+    def chunks(self):
+        "Return list of (start, end) byte ranges of all chunks"
+        return [(start, min(start+self.chunk_size, self.size)-1) \
+                for start in xrange(0, self.size, self.chunk_size)]
+
+    def load_state(self):
+        "Load completed chunks of interrupted download of the same file"
+        try:
+            with open(self.sidecar, 'r') as stream:
+                state = json.load(stream)
+        except (IOError, ValueError):
+            return set()
+        if  state.get('size') != self.size or \
+            state.get('chunk_size') != self.chunk_size or \
+            not os.path.isfile(self.part) or \
+            os.path.getsize(self.part) != self.size:
+            return set()
+        return set(state.get('done', []))
+
+    def save_state(self):
+        "Save completed chunks into sidecar file, must be called under the lock"
+        state = {'url': self.url, 'size': self.size,
+                 'chunk_size': self.chunk_size, 'done': sorted(self.done)}
+        fdir = os.path.dirname(os.path.abspath(self.sidecar))
+        fdesc, tmp = tempfile.mkstemp(dir=fdir, suffix='.tmp')
+        with os.fdopen(fdesc, 'w') as stream:
+            json.dump(state, stream)
+        os.rename(tmp, self.sidecar)
+
+    def fetch(self, idx, start, end, whole=False):
+        "Fetch given byte range into its place in the part file"
+        curl = self.curl()
+        nbytes = [0]
+        with open(self.part, 'r+b') as stream:
+            stream.seek(start)
+            def write(data):
+                "Write data into part file, abort on unexpected extra data"
+                nbytes[0] += len(data)
+                if  nbytes[0] > end - start + 1:
+                    return 0
+                stream.write(data)
+            if  not whole:
+                curl.setopt(pycurl.RANGE, '%s-%s' % (start, end))
+            curl.setopt(pycurl.WRITEFUNCTION, write)
+            try:
+                curl.perform()
+                code = curl.getinfo(pycurl.RESPONSE_CODE)
+            finally:
+                curl.close()
+        if  code != (200 if whole else 206) or nbytes[0] != end - start + 1:
+            raise IOError('Fail to fetch bytes %s-%s of %s, HTTP code %s' \
+                    % (start, end, self.url, code))
+        with self.lock:
+            self.done.add(idx)
+            self.save_state()
+            ndone = sum(e - s + 1 for i, (s, e) in enumerate(self.chunks()) \
+                        if i in self.done)
+        if  self.callback:
+            self.callback(ndone, self.size)
+
+    def worker(self, todo, whole):
+        "Worker thread, fetch chunks until all are done or an error occurs"
+        while True:
+            with self.lock:
+                if  not todo or self.errors:
+                    return
+                idx, (start, end) = todo.popleft()
+            try:
+                self.fetch(idx, start, end, whole)
+            except Exception as exc:
+                with self.lock:
+                    self.errors.append(str(exc))
+
+    def run(self, checksum=None):
+        """
+        Download the file, verify it against given adler32 checksum (if
+        any) and return (file name, size). Raise IOError if download is
+        interrupted, it can be resumed by another run of the same file.
+        """
+        self.size, ranges = self.info()
+        if  not ranges: # fetch whole file at once, nothing to resume
+            self.chunk_size = max(self.size, 1)
+            nthreads = 1
+        else:
+            nthreads = self.nthreads
+        self.done = self.load_state()
+        if  not self.done:
+            with open(self.part, 'wb') as stream:
+                stream.truncate(self.size)
+        elif self.verbose:
+            print "Resume download of %s, %s of %s chunks are done" \
+                % (self.fname, len(self.done), len(self.chunks()))
+        todo = deque([(idx, rng) for idx, rng in enumerate(self.chunks()) \
+                        if idx not in self.done])
+        threads = []
+        for _ in xrange(min(nthreads, len(todo))):
+            thr = threading.Thread(target=self.worker, args=(todo, not ranges))
+            thr.daemon = True
+            thr.start()
+            threads.append(thr)
+        for thr in threads:
+            while thr.is_alive(): # join with timeout keeps Ctrl-C working
+                thr.join(1)
+        if  self.errors:
+            raise IOError(self.errors[0])
+        if  checksum and \
+            VERIFIER.verify(self.part, {'adler32': checksum}) == 'mismatch':
+            os.remove(self.part)
+            os.remove(self.sidecar)
+            raise IOError('Checksum mismatch of %s, expect adler32 %s' \
+                    % (self.fname, checksum))
+        os.rename(self.part, self.fname)
+        if  os.path.isfile(self.sidecar):
+            os.remove(self.sidecar)
+        return self.fname, self.size
+
+def test():
+    "Test resumable download against local stand-in HTTP server"
+    import random
+    import hashlib
+    import BaseHTTPServer
+    import SocketServer
+
+    data = ''.join(chr(random.randint(0, 255)) for _ in xrange(3*1024*1024))
+    failed = set() # chunks which failed once, they succeed on retry
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        "HTTP handler which supports HEAD and GET with byte ranges"
+        protocol_version = 'HTTP/1.1'
+        def do_HEAD(self):
+            "HEAD request"
+            self.send_response(200)
+            self.send_header('Content-Length', len(data))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+        def do_GET(self):
+            "GET request"
+            rng = self.headers.get('Range', '')
+            if  rng and rng.endswith('524287') and rng not in failed:
+                failed.add(rng) # fail 2nd chunk to interrupt download
+                self.send_response(503)
+                self.send_header('Content-Length', 0)
+                self.end_headers()
+                return
+            if  rng:
+                start, end = [int(i) for i in rng.split('=')[1].split('-')]
+                self.send_response(206)
+            else:
+                start, end = 0, len(data)-1
+                self.send_response(200)
+            self.send_header('Content-Length', end-start+1)
+            self.end_headers()
+            self.wfile.write(data[start:end+1])
+        def log_message(self, *args):
+            "Keep test output clean"
+            pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        "Threaded HTTP server"
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thr = threading.Thread(target=server.serve_forever)
+    thr.daemon = True
+    thr.start()
+    url = 'http://127.0.0.1:%s/file.root' % server.server_address[1]
+    fname = os.path.join(tempfile.mkdtemp(), 'file.root')
+    checksum = '%08x' % (zlib.adler32(data) & 0xffffffff)
+    mgr = RangeDownload(url, fname, nthreads=4, chunk_size=256*1024)
+    try:
+        mgr.run(checksum)
+        raise Exception('download should be interrupted')
+    except IOError as exc:
+        print "Interrupted download: %s, %s chunks done" \
+            % (exc, len(mgr.done))
+    mgr = RangeDownload(url, fname, nthreads=4, chunk_size=256*1024,
+            verbose=1)
+    print "Resumed download:", mgr.run(checksum)
+    with open(fname, 'rb') as stream:
+        assert hashlib.md5(stream.read()).hexdigest() == \
+                hashlib.md5(data).hexdigest()
+    assert not os.path.exists(fname + '.progress')
+    print "Downloaded file matches original one"
+    server.shutdown()
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Execution engine of external (GRID middleware) commands. Both pipes of
+a command are drained concurrently, so a chatty command can't block on
+a full pipe, and commands are killed once their timeout expires. Many
+commands can run in parallel by a pool of threads, every submitted
+command gets a future which holds its result.
+"""
+
+# system modules
+import os
+import time
+import fcntl
+import errno
+import signal
+import select
+import threading
+import subprocess
+from   collections import deque
+
+def run_cmd(cmd, timeout=None):
+    """
+    Execute given command in subprocess and return (stdout, stderr, return
+    code). The command is killed when it runs longer than timeout seconds.
+    """
+    # new session allows to kill the shell along with its children
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+    output = {proc.stdout: [], proc.stderr: []}
+    for stream in output.keys():
+        flags = fcntl.fcntl(stream, fcntl.F_GETFL)
+        fcntl.fcntl(stream, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    deadline = time.time() + timeout if timeout else None
+    streams  = output.keys()
+    expired  = False
+    def kill():
+        "Kill command and all its children"
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        while streams:
+            wait = None
+            if  deadline:
+                wait = deadline - time.time()
+                if  wait <= 0:
+                    expired = True
+                    break
+            try:
+                ready, _, _ = select.select(streams, [], [], wait)
+            except select.error as exc:
+                if  exc.args[0] == errno.EINTR:
+                    continue
+                raise
+            for stream in ready:
+                data = os.read(stream.fileno(), 65536)
+                if  data:
+                    output[stream].append(data)
+                else:
+                    streams.remove(stream)
+    except KeyboardInterrupt: # command does not get Ctrl-C in its session
+        kill()
+        raise
+    if  expired:
+        kill()
+    proc.wait()
+    for stream in output.keys():
+        stream.close()
+    stdout = ''.join(output[proc.stdout])
+    stderr = ''.join(output[proc.stderr])
+    if  expired:
+        stderr += '\nCommand %s is killed after %s sec timeout' % (cmd, timeout)
+    return stdout, stderr, proc.returncode
+
+def stream_cmd(cmd, errors=None):
+    """
+    Execute given command and yield lines of its stdout as they come.
+    Stderr is drained by separate thread into optional errors list. The
+    command is killed if consumer stops before the end of its output.
+    """
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+    def drain():
+        "Read stderr of the command"
+        for data in iter(lambda: proc.stderr.read(4096), ''):
+            if  errors is not None:
+                errors.append(data)
+    thr = threading.Thread(target=drain)
+    thr.daemon = True
+    thr.start()
+    try:
+        # readline does not wait for read-ahead buffer to fill up
+        for line in iter(proc.stdout.readline, ''):
+            yield line
+    finally:
+        if  proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        proc.wait()
+        thr.join()
+        proc.stdout.close()
+        proc.stderr.close()
+
+class CmdFuture(object):
+    "Future of submitted command, holds its (stdout, stderr, return code)"
+    def __init__(self, cmd, timeout=None):
+        self.cmd     = cmd
+        self.timeout = timeout
+        self.event   = threading.Event()
+        self.value   = None
+        self.error   = None
+
+    def done(self):
+        "Check if command is finished"
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for command completion and return (stdout, stderr, return
+        code), re-raise an exception if command failed to start
+        """
+        if  timeout is None:
+            while not self.event.wait(1): # wait with timeout keeps Ctrl-C
+                pass
+        elif not self.event.wait(timeout):
+            raise RuntimeError('Command %s is still running' % self.cmd)
+        if  self.error:
+            raise self.error
+        return self.value
+
+class CommandExecutor(object):
+    """
+    Execute commands in a pool of nworkers threads, commands which run
+    longer than timeout seconds are killed (zero means no timeout).
+    """
+    def __init__(self, nworkers=8, timeout=0):
+        self.nworkers = max(1, nworkers)
+        self.timeout  = timeout
+        self.cond     = threading.Condition()
+        self.pending  = deque()
+        self.workers  = []
+        self.idle     = 0 # number of workers waiting for commands
+
+    def submit(self, cmd, timeout=None):
+        "Submit given command and return its future"
+        future = CmdFuture(cmd, timeout if timeout is not None else self.timeout)
+        with self.cond:
+            self.pending.append(future)
+            # start workers lazily, when all existing ones are busy
+            if  self.idle < len(self.pending) and \
+                len(self.workers) < self.nworkers:
+                thr = threading.Thread(target=self.worker)
+                thr.daemon = True
+                thr.start()
+                self.workers.append(thr)
+            self.cond.notify()
+        return future
+
+    def worker(self):
+        "Worker thread, execute pending commands"
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.idle += 1
+                    self.cond.wait()
+                    self.idle -= 1
+                future = self.pending.popleft()
+            try:
+                future.value = run_cmd(future.cmd, future.timeout)
+            except Exception as exc:
+                future.error = exc
+            future.event.set()
+
+    def execute(self, cmd, timeout=None):
+        "Execute given command in calling thread, return (stdout, stderr)"
+        stdout, stderr, _code = run_cmd(cmd, \
+                timeout if timeout is not None else self.timeout)
+        return stdout, stderr
+
+    def map(self, cmds, timeout=None):
+        """
+        Execute given commands in parallel and return list of their
+        (stdout, stderr) in order of commands
+        """
+        futures = [self.submit(cmd, timeout) for cmd in cmds]
+        return [f.result()[:2] for f in futures]
+
+# create an singleton instance which will be used through the code
+EXECUTOR = CommandExecutor(int(os.environ.get('CMSSH_EXEC_WORKERS', 8)),
+        int(os.environ.get('CMSSH_EXEC_TIMEOUT', 0)))
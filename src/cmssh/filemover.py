@@ -8,12 +8,14 @@ import re
 import sys
 import json
 import stat
+import glob
 import time
-import thread
+import Queue
+import fnmatch
+import threading
 import urllib
 import urllib2
 import datetime
-from multiprocessing import Process
 
 # for DBS2 XML parsing
 import xml.etree.ElementTree as ET
@@ -25,10 +27,23 @@ from cmssh.ddict import DotDict
 from cmssh.cms_urls import phedex_url, dbs_url, dbs_instances
 from cmssh.cms_objects import CMSObj
 from cmssh.utils import execmd
+from cmssh.executor import EXECUTOR, stream_cmd
 from cmssh.utils import PrintProgress, qlxml_parser
-from cmssh.url_utils import get_data
+from cmssh.url_utils import get_data, get_data_many, get_data_stream
 from cmssh.sitedb import SiteDBManager
+from cmssh.tfc import TFCMGR
+from cmssh.replicas import REPLICAS
 from cmssh.srmls import srmls_printer, srm_ls_printer
+from cmssh.srmls import srmls_parser, srm_ls_parser
+from cmssh.se_tree import TreeWalker
+from cmssh.scheduler import TransferScheduler, TransferJob, site_of
+from cmssh.ranking import RANKER
+from cmssh.download import RangeDownload
+from cmssh.checksum import VERIFIER
+from cmssh.progress import TransferProgress, run_with_progress
+from cmssh.transfer_queue import TRANSFER_QUEUE, HOST, time_stamp
+from cmssh.auth_utils import PEMMGR, working_pem
+from cmssh.regex import pat_block, pat_dataset
 
 def get_dbs_se(lfn):
     "Get original SE from DBS for given LFN"
@@ -49,6 +64,10 @@ def get_dbs_se(lfn):
         return sename
     os.environ['DBS_INSTANCE'] = default_instance
 
+# srm tools which accept multiple SURLs and number of SURLs per call
+MULTI_SURL_TOOLS = ['srmrm']
+SURL_CHUNK = 100
+
 def file_size(ifile):
     "Return file size"
     if  os.path.isfile(ifile):
@@ -170,11 +189,8 @@ def resolve_srm_path(node, verbose=None):
     """
     Use TFC phedex API to resolve srm path for given node
     """
-    params = {'node':node}
-    result = get_data(phedex_url('tfc'), params)
-    for row in result['phedex']['storage-mapping']['array']:
-        if  row['protocol'] == 'srmv2' and row['element_name'] == 'lfn-to-pfn':
-            yield (row['result'], row['path-match'])
+    for rule in TFCMGR.rules(node).get('srmv2', []):
+        yield (rule['result'], rule['path-match'])
 
 def resolve_user_srm_path(node, ldir='/store/user', verbose=None):
     """
@@ -194,6 +210,9 @@ def lfn2pfn(lfn, sename, mgr=None):
         mgr = SiteDBManager()
     cmsname = mgr.get_name(sename)
     if  cmsname:
+        pfn = TFCMGR.pfn(cmsname, lfn)
+        if  pfn: # resolved locally via site TFC
+            return [pfn]
         params = {'protocol':'srmv2', 'lfn':lfn, 'node':cmsname}
         result = get_data(phedex_url('lfn2pfn'), params)
         try:
@@ -206,35 +225,80 @@ def lfn2pfn(lfn, sename, mgr=None):
             print msg
     return pfnlist
 
+def http_pfns(lfn):
+    """
+    Resolve HTTP(S) PFNs of given LFN via TFC rules of its replica nodes.
+    Return list of PFNs ordered by expected throughput.
+    """
+    protocols = os.environ.get('CMSSH_HTTP_PROTOCOLS', 'WebDAV,davs,https,http')
+    replicas  = REPLICAS.replicas(lfn)
+    TFCMGR.prefetch([cmsname for cmsname, _se in replicas])
+    pfnlist   = []
+    nodes     = {}
+    for cmsname, _se in replicas:
+        for protocol in protocols.split(','):
+            pfn = TFCMGR.pfn(cmsname, lfn, protocol.strip())
+            if  not pfn:
+                continue
+            if  pfn.startswith('davs://'):
+                pfn = 'https://' + pfn[len('davs://'):]
+            if  pfn.startswith('http') and pfn not in pfnlist:
+                pfnlist.append(pfn)
+                nodes[pfn] = cmsname
+                break
+    return RANKER.rank(pfnlist, nodes)
+
+def file_checksums(lfn):
+    "Return dict of checksums DBS holds for given LFN, e.g. adler32"
+    params = {'logical_file_name': lfn, 'detail': 'True'}
+    try:
+        rows = get_data(dbs_url('files'), params)
+    except Exception:
+        return {}
+    for row in rows:
+        return dict((key, str(row[key])) for key in ['adler32', 'check_sum'] \
+                if row.get(key) not in [None, '', 'NULL'])
+    return {}
+
 def get_pfns(lfn, verbose=None):
     """
     Look-up LFN in Phedex and get corresponding list of PFNs
     """
     pfnlist   = []
     selist    = []
-    params    = {'se':'*', 'lfn':lfn}
-    json_dict = get_data(phedex_url('fileReplicas'), params)
-    ddict     = DotDict(json_dict)
-    if  not json_dict['phedex']['block']:
+    cmsnames  = []
+    for cmsname, se in REPLICAS.replicas(lfn):
+        if  se not in selist:
+            selist.append(se)
+        if  cmsname not in cmsnames:
+            cmsnames.append(cmsname)
+    if  not cmsnames:
         return pfnlist, selist
-    for fname in ddict.get('phedex.block.file'):
-        for replica in fname['replica']:
-            cmsname = replica['node']
-            se      = replica['se']
-            if  se not in selist:
-                selist.append(se)
-            # query Phedex for PFN
-            params = {'protocol':'srmv2', 'lfn':lfn, 'node':cmsname}
-            result = get_data(phedex_url('lfn2pfn'), params)
-            try:
-                for item in result['phedex']['mapping']:
-                    pfn = item['pfn']
-                    if  pfn not in pfnlist:
-                        pfnlist.append(pfn)
-            except:
-                msg = "Fail to look-up PFNs in Phedex\n" + str(result)
-                print msg
-                continue
+    # resolve PFNs locally via TFC rules of all nodes
+    TFCMGR.prefetch(cmsnames)
+    pfns = dict((n, TFCMGR.pfn(n, lfn)) for n in cmsnames)
+    # query Phedex for PFNs on nodes we failed to resolve
+    url      = phedex_url('lfn2pfn')
+    requests = [(url, {'protocol':'srmv2', 'lfn':lfn, 'node':n}) \
+                for n in cmsnames if not pfns[n]]
+    results  = {}
+    for _url, params, result in get_data_many(requests):
+        results[params['node']] = result
+    for cmsname in cmsnames:
+        if  pfns[cmsname]:
+            if  pfns[cmsname] not in pfnlist:
+                pfnlist.append(pfns[cmsname])
+            continue
+        result = results.get(cmsname)
+        try:
+            for item in result['phedex']['mapping']:
+                pfn = item['pfn']
+                if  pfn not in pfnlist:
+                    pfnlist.append(pfn)
+        except:
+            msg = "Fail to look-up PFNs in Phedex\n" + str(result)
+            print msg
+            continue
     return pfnlist, selist
 
 def pfn_dst(lfn, dst, verbose=None):
@@ -289,63 +353,68 @@ def pfn_dst(lfn, dst, verbose=None):
             pfn = 'file:///%s' % pfn
         pfnlist   = [pfn]
     else:
-        if  lfn.find(':') != -1:
-            node, lfn = lfn.split(':')
-            params    = {'node':node, 'lfn':lfn, 'protocol':'srmv2'}
-            method    = 'lfn2pfn'
-        else:
-            params    = {'se':'*', 'lfn':lfn}
-            method    = 'fileReplicas'
-        json_dict = get_data(phedex_url(method), params)
-        ddict     = DotDict(json_dict)
         if  verbose:
             print "Look-up LFN:"
             print lfn
-        phedex = json_dict['phedex']
-        if  phedex.has_key('mapping'):
-            if  not phedex['mapping']:
-                msg  = "LFN: %s\n" % lfn
-                msg += 'No replicas found\n'
-                msg += str(json_dict)
-                raise Exception(msg)
-            filelist = ddict.get('phedex.mapping.pfn')
-            if  not filelist:
-                filelist = []
-            if  isinstance(filelist, basestring):
-                filelist = [filelist]
+        replicas  = []
+        nodes     = {} # pfn: cmsname
+        if  lfn.find(':') != -1:
+            node, lfn = lfn.split(':')
+            pfn = TFCMGR.pfn(node, lfn)
+            if  pfn: # resolved locally via site TFC
+                filelist = [pfn]
+            else:
+                params    = {'node':node, 'lfn':lfn, 'protocol':'srmv2'}
+                json_dict = get_data(phedex_url('lfn2pfn'), params)
+                if  not json_dict['phedex']['mapping']:
+                    msg  = "LFN: %s\n" % lfn
+                    msg += 'No replicas found\n'
+                    msg += str(json_dict)
+                    raise Exception(msg)
+                filelist = DotDict.path('phedex.mapping.pfn').get(json_dict)
+                if  not filelist:
+                    filelist = []
+                if  isinstance(filelist, basestring):
+                    filelist = [filelist]
             for fname in filelist:
                 pfnlist.append(fname)
-        elif  phedex.has_key('block') and not phedex['block']:
-            msg = 'No replicas found in PhEDEx, will try to get original SE from DBS'
-            print_warning(msg)
-            sename = get_dbs_se(lfn)
-            msg = 'Orignal LFN site %s' % sename
-            print_info(msg)
-            mgr = SiteDBManager()
-            pfnlist = lfn2pfn(lfn, sename, mgr)
-        filelist = ddict.get('phedex.block.file')
-        if  not filelist:
-            filelist = []
-        for fname in filelist:
-            for replica in fname['replica']:
-                cmsname = replica['node']
-                se      = replica['se']
-                if  verbose:
-                    print "found LFN on node=%s, se=%s" % (cmsname, se)
-                if  cmsname.count('T0', 0, 2) == 1:
-                    continue # skip T0's
-                # query Phedex for PFN
-                params = {'protocol':'srmv2', 'lfn':lfn, 'node':cmsname}
-                result = get_data(phedex_url('lfn2pfn'), params)
-                try:
-                    for item in result['phedex']['mapping']:
-                        pfn = item['pfn']
-                        if  pfn not in pfnlist:
-                            pfnlist.append(pfn)
-                except:
-                    msg = "Fail to look-up PFNs in Phedex\n" + str(result)
-                    print msg
-                    continue
+        else:
+            replicas = REPLICAS.replicas(lfn)
+            if  not replicas:
+                msg = 'No replicas found in PhEDEx, will try to get original SE from DBS'
+                print_warning(msg)
+                sename = get_dbs_se(lfn)
+                msg = 'Orignal LFN site %s' % sename
+                print_info(msg)
+                mgr = SiteDBManager()
+                pfnlist = lfn2pfn(lfn, sename, mgr)
+        TFCMGR.prefetch([cmsname for cmsname, _se in replicas])
+        for cmsname, se in replicas:
+            if  verbose:
+                print "found LFN on node=%s, se=%s" % (cmsname, se)
+            if  cmsname.count('T0', 0, 2) == 1:
+                continue # skip T0's
+            pfn = TFCMGR.pfn(cmsname, lfn)
+            if  pfn: # resolved locally via site TFC
+                if  pfn not in pfnlist:
+                    pfnlist.append(pfn)
+                    nodes[pfn] = cmsname
+                continue
+            # query Phedex for PFN
+            params = {'protocol':'srmv2', 'lfn':lfn, 'node':cmsname}
+            result = get_data(phedex_url('lfn2pfn'), params)
+            try:
+                for item in result['phedex']['mapping']:
+                    pfn = item['pfn']
+                    if  pfn not in pfnlist:
+                        pfnlist.append(pfn)
+                        nodes[pfn] = cmsname
+            except:
+                msg = "Fail to look-up PFNs in Phedex\n" + str(result)
+                print msg
+                continue
+        # try replicas with best expected throughput first
+        pfnlist = RANKER.rank(pfnlist, nodes)
     if  verbose > 1:
         print "PFN list:"
         for pfn in pfnlist:
@@ -356,10 +425,8 @@ def pfn_dst(lfn, dst, verbose=None):
         ifile = item.split("/")[-1] if not dstfname else dstfname
         yield item, '%s/%s' % (dst, ifile)
 
-def get_size(surl, verbose=None):
-    """
-    Execute srm-ls <surl> command and retrieve file size information
-    """
+def size_cmd(surl):
+    "Return srm-ls <surl> command which provides file size information"
     srmls = os.environ.get('SRM_LS', '')
     if  not srmls:
         print_error('Unable to find srm ls tool')
@@ -368,14 +435,39 @@ def get_size(surl, verbose=None):
         srmargs = ''
     else:
         srmargs = '-2'
-    cmd = '%s %s %s' % (srmls, srmargs, surl)
-    if  verbose:
-        print_info(cmd)
-    if  cmd.find('file:///') != -1:
-        return file_size(cmd.split('file:///')[-1])
-    stdout, stderr = execmd(cmd)
-    if  verbose:
-        print_info(stdout + stderr)
+    return '%s %s %s' % (srmls, srmargs, surl)
+
+def get_size(surl, verbose=None):
+    """
+    Execute srm-ls <surl> command and retrieve file size information
+    """
+    return get_sizes([surl], verbose)[0]
+
+def get_sizes(surls, verbose=None):
+    """
+    Retrieve size information of given list of files, srm-ls commands
+    of remote files are executed in parallel
+    """
+    cmds  = [size_cmd(surl) for surl in surls]
+    sizes = [None]*len(cmds)
+    remote = []
+    for idx, cmd in enumerate(cmds):
+        if  verbose:
+            print_info(cmd)
+        if  cmd.find('file:///') != -1:
+            sizes[idx] = file_size(cmd.split('file:///')[-1])
+        else:
+            remote.append(idx)
+    results = EXECUTOR.map([cmds[idx] for idx in remote])
+    for idx, (stdout, stderr) in zip(remote, results):
+        if  verbose:
+            print_info(stdout + stderr)
+        sizes[idx] = parse_size(cmds[idx], stdout)
+    return sizes
+
+def parse_size(cmd, stdout):
+    "Parse output of given srm-ls command and return file size"
+    srmls = os.environ.get('SRM_LS', '')
     orig_size = 0
     if  cmd.find('file:///') != -1: # srm-ls returns XML
         if  srmls.find('srm-ls') != -1:
@@ -401,16 +493,14 @@ def check_file(src, dst, verbose):
     """
     Check if file is transfered and return dst, dst_size upon success.
     """
-    # find file size from replica
-    orig_size = get_size(src, verbose)
+    # find file size from replica and destination (if any) at once
+    orig_size, dst_size = get_sizes([src, dst], verbose)
     if  verbose:
         print "%s, size %s" % (src, orig_size)
 
     if  not orig_size or orig_size == 'null':
         return False
 
-    # find file size from destination (if any)
-    dst_size = get_size(dst, verbose)
     if  verbose:
         print "%s, size %s" % (dst, dst_size)
 
@@ -421,65 +511,79 @@ def check_file(src, dst, verbose):
         return (dst, int(dst_size))
     return False
 
-def execute(cmds, src, dst, verbose):
+def verify_file(status, lfn, verbose):
     """
-    Execute given command, but also check if file is in place at dst
+    Verify checksum of transferred file against DBS. Return status
+    extended by verification outcome or False if checksums differ, such
+    file is removed to be copied again.
+    """
+    dst, size = status[:2]
+    if  not dst.startswith('file:') or not lfn or not lfn.startswith('/store') \
+        or os.environ.get('CMSSH_VERIFY_CHECKSUM', '1') == '0':
+        return (dst, size, 'unverified')
+    fname = '/' + dst.replace('file:', '').lstrip('/')
+    result = VERIFIER.verify(fname, file_checksums(lfn))
+    if  result == 'mismatch':
+        print_warning('Checksum of %s does not match DBS one' % fname)
+        os.remove(fname)
+        return False
+    if  verbose:
+        print "%s, checksum %s" % (dst, result)
+    return (dst, size, result)
+
+def execute(cmds, src, dst, verbose, progress=None, callback=None, lfn=None):
+    """
+    Execute given command(s), but also check if file is in place at dst.
+    Local copies of given LFN are verified against its DBS checksum.
+    Outcome of every copy from src replica is recorded to rank replicas
+    of subsequent copies. If progress is given it is updated from the
+    output of copy command and passed to callback while it runs.
     """
     status = check_file(src, dst, verbose)
+    if  status:
+        # file of the same size may still be truncated or corrupted one
+        status = verify_file(status, lfn, verbose)
     if  status:
         return status
-    else:
-        if  isinstance(cmds, basestring):
-            stdout, stderr = execmd(cmds)
-            if  verbose:
-                print_info('Output of %s' % cmd)
-                print stdout + stderr
-            status = check_file(src, dst, verbose)
-        elif isinstance(cmds, list):
-            for cmd in cmds:
-                if  not cmd:
-                    continue
-                stdout, stderr = execmd(cmd)
-                if  verbose:
-                    print_info('Output of %s' % cmd)
-                    print stdout + stderr
-                status = check_file(src, dst, verbose)
-                if  status:
-                    return status
+    if  isinstance(cmds, basestring):
+        cmds = [cmds]
+    for cmd in cmds:
+        if  not cmd:
+            continue
+        time0 = time.time()
+        if  progress:
+            stdout, _code = run_with_progress(cmd, progress, dst, callback)
+            stderr = ''
+        else:
+            stdout, stderr = execmd(cmd)
+        elapsed = time.time() - time0
+        if  verbose:
+            print_info('Output of %s' % cmd)
+            print stdout + stderr
+        status = check_file(src, dst, verbose)
+        if  status:
+            status = verify_file(status, lfn, verbose)
+        # xrdcp reads via global redirector which picks its own replica
+        if  not cmd.startswith('xrdcp'):
+            if  status:
+                RANKER.record(src, status[1], elapsed)
+            else:
+                RANKER.record(src, success=False)
+        if  status:
+            return status
     return status
 
-def active_jobs(queue):
-    "Return number of active jobs in a queue"
-    njobs = 0
-    for _, (proc, _status) in queue.items():
-        if  proc.is_alive():
-            njobs += 1
-    return njobs
-
-def worker(queue, threshold):
-    """
-    Worker which start processes in a queue and monitor that number of
-    jobs does not exceed a given threshold
-    """
-    while True:
-        njobs = active_jobs(queue)
-        if  njobs < threshold:
-            # start process
-            for lfn, (proc, status) in queue.items():
-                if  active_jobs(queue) >= threshold:
-                    break
-                if  not status and not proc.is_alive():
-                    proc.start()
-                    queue[lfn] = (proc, 'started')
-        time.sleep(5)
-
 class FileMover(object):
     def __init__(self):
         self.instance = "Instance at %d" % self.__hash__()
-        self.queue = {} # download queue
-        threshold = os.environ.get('CMSSH_TRANSFER_LIMIT', 3)
-        thread.start_new_thread(worker, (self.queue, threshold))
-        self.methods = ['xrdcp', 'lcgcp', 'srmcp']
+        self.scheduler = TransferScheduler(\
+                int(os.environ.get('CMSSH_TRANSFER_LIMIT', 3)),
+                int(os.environ.get('CMSSH_TRANSFER_SRC_LIMIT', 2)),
+                int(os.environ.get('CMSSH_TRANSFER_DST_LIMIT', 0)),
+                int(os.environ.get('CMSSH_TRANSFER_RETRIES', 1)),
+                TRANSFER_QUEUE)
+        self.methods = ['xrdcp', 'lcgcp', 'srmcp', 'http']
+        self.srm_bases = {} # node: SURL prefix of /store area
 
     def transfer_cmds(self, lfn, dst, verbose=0):
         "Generate transfer commands"
@@ -512,6 +616,11 @@ class FileMover(object):
         if  method not in self.methods:
             print_error('Unknown transfer method "%s"' % method)
             return 'fail'
+        if  method == 'http':
+            return self.download(lfn, dst, verbose, background)
+        if  background:
+            # background jobs try commands of all methods in order
+            return 'accepted' if self.submit(lfn, dst, verbose) else 'fail'
         for xrdcmd, lcgcmd, srmcmd, pfn, pdst in self.transfer_cmds(lfn, dst, verbose):
             if  method == 'xrdcp':
                 cmd = xrdcmd
@@ -521,70 +630,138 @@ class FileMover(object):
                 cmd = srmcmd
             if  not cmd:
                 return 'fail'
-            if  background:
-                # I need to pass list of commands for transfer method
-                # for that I'll use background variable
-                background = [xrdcmd, lcgcmd, srmcmd]
-            status = self.transfer(cmd, lfn, pfn, pdst, verbose, background)
+            status = self.transfer(cmd, lfn, pfn, pdst, verbose)
             if  status == 'success' or status == 'accepted':
                 return status
         return 'fail'
 
-    def transfer(self, cmd, lfn, pfn, pdst, verbose=0, background=False):
+    def submit(self, lfn, dst, verbose=0, callback=None, jid=None):
+        """
+        Submit transfer of given LFN to the scheduler, transfer commands
+        of all methods are tried in order. With CMSSH_TRANSFER_METHOD=http
+        files are downloaded from HTTP(S) endpoints to local disk instead,
+        if LFN has any. Return transfer job or None if LFN can't be
+        resolved. The jid is id of resumed job in persistent transfer queue.
+        """
+        if  os.environ.get('CMSSH_TRANSFER_METHOD', 'xrdcp') == 'http' \
+            and local_dst(lfn, dst):
+            job = self.http_job(lfn, dst, verbose, callback, jid)
+            if  job:
+                return self.scheduler.submit(job)
+            if  verbose:
+                print_warning('http fails to copy %s, fallback to GRID middleware' % lfn)
+        for xrdcmd, lcgcmd, srmcmd, pfn, pdst in \
+                self.transfer_cmds(lfn, dst, verbose):
+            progress = TransferProgress()
+            job = TransferJob(lfn, pdst, execute,
+                    ([xrdcmd, lcgcmd, srmcmd], pfn, pdst, 0, progress, None,
+                     lfn),
+                    site_of(pfn), site_of(pdst), callback)
+            job.progress = progress
+            job.target   = dst
+            job.method   = 'xrdcp'
+            job.jid      = jid
+            return self.scheduler.submit(job)
+        return None
+
+    def http_job(self, lfn, dst, verbose=0, callback=None, jid=None):
+        """
+        Return transfer job which downloads LFN from HTTP(S) endpoints of
+        its replicas to local destination or None if it is not possible
+        """
+        fname = local_dst(lfn, dst)
+        if  not fname:
+            print_error('Destination %s is not local disk' % dst)
+            return None
+        pfnlist = http_pfns(lfn)
+        if  not pfnlist:
+            if  verbose:
+                print_warning('No HTTP endpoints found for %s' % lfn)
+            return None
+        checksum = file_checksums(lfn).get('adler32')
+        nthreads = int(os.environ.get('CMSSH_DOWNLOAD_THREADS', 4))
+        cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+        def run():
+            "Try replicas one by one until download succeeds"
+            for pfn in pfnlist:
+                if  verbose:
+                    print_info('Download %s' % pfn)
+                time0 = time.time()
+                try:
+                    with working_pem(PEMMGR.pem) as ckey:
+                        mgr = RangeDownload(pfn, fname, nthreads,
+                                ckey=ckey, cert=cert, verbose=verbose)
+                        status = mgr.run(checksum)
+                    RANKER.record(pfn, status[1], time.time()-time0)
+                    # RangeDownload verifies adler32 itself
+                    return status + \
+                        ('adler32 ok' if checksum else 'unverified',)
+                except Exception as exc:
+                    RANKER.record(pfn, success=False)
+                    if  verbose:
+                        print_error(str(exc))
+            return False
+        job = TransferJob(lfn, fname, run, (), site_of(pfnlist[0]), 'local',
+                callback)
+        job.target = dst
+        job.method = 'http'
+        job.jid    = jid
+        return job
+
+    def download(self, lfn, dst, verbose=0, background=False, jid=None):
+        """
+        Resumable chunk-parallel download of LFN from HTTP(S) endpoints of
+        its replicas to local destination, see cmssh.download
+        """
+        job = self.http_job(lfn, dst, verbose, None, jid)
+        if  not job:
+            return 'fail'
+        if  background:
+            self.scheduler.submit(job)
+            return 'accepted'
+        status = job.func(*job.args)
+        if  not status:
+            return 'fail'
+        print "\nDone, file located at %s (%s)" \
+                % (status[0], size_format(status[1]))
+        return 'success'
+
+    def transfer(self, cmd, lfn, pfn, pdst, verbose=0):
         """Copy LFN to given destination"""
         err  = 'Unable to identify total size of the file,'
         err += ' GRID middleware fails.'
-        if  not background:
-            bar  = PrintProgress('Fetching LFN info')
+        bar  = PrintProgress('Fetching LFN info')
         if  verbose:
             print_info(cmd)
-        if  background:
-            # here background is a list of commands
-            if  not isinstance(background, list):
-                return 'fail'
-            proc = Process(target=execute, args=(background, pfn, pdst, 0))
-            self.queue[lfn] = (proc, None)
-            return 'accepted'
-        elif verbose:
-            status = execute(cmd, pfn, pdst, verbose)
+            status = execute(cmd, pfn, pdst, verbose, lfn=lfn)
             if  not status:
                 return 'fail'
             else:
-                dst, dst_size = status
+                dst, dst_size = status[:2]
                 size = size_format(dst_size)
                 if  not size or not dst_size:
                     print_error(err)
                     print "Status of transfer:\n", status
                     return 'fail'
                 else:
-                    print "\nDone, file located at %s (%s)" \
-                        % (dst, size_format(dst_size))
+                    print "\nDone, file located at %s (%s), checksum %s" \
+                        % (dst, size_format(dst_size), status[2])
                 return 'success'
         else:
-            ifile = pdst
             pfn_size = get_size(pfn)
             if  pfn_size and pfn_size != 'null':
                 tot_size = float(pfn_size)
                 bar.print_msg('LFN size=%s' % size_format(tot_size))
                 bar.init('Download in progress:')
-                proc = Process(target=execute, args=(cmd, pfn, pdst, verbose))
-                proc.start()
-                while True:
-                    if  proc.is_alive():
-                        size = get_size(ifile)
-                        if  not size or size == 'null':
-                            bar.refresh('')
-                            pass
-                        else:
-                            progress = float(size)*100/tot_size
-                            bar.refresh(progress)
-                            if  progress == 100:
-                                break
-                    else:
-                        break
-                    time.sleep(0.5)
+                # progress comes from copy command output or local file
+                # size, remote storage is not polled while copy runs
+                progress = TransferProgress(tot_size)
+                def refresh(progress):
+                    "Refresh progress bar"
+                    bar.refresh(progress.percent, progress.info())
+                status = execute(cmd, pfn, pdst, verbose, progress, refresh,
+                        lfn)
                 bar.clear()
-                status = check_file(pfn, pdst, verbose)
                 if  status:
                     return 'success'
             else:
@@ -592,26 +769,33 @@ class FileMover(object):
                 return 'fail'
         return 'fail'
 
+    def resume(self, row):
+        "Resume transfer job of given persistent queue record"
+        if  row['method'] == 'http':
+            status = self.download(row['lfn'], row['dst'], 0, True, row['id'])
+        else:
+            job = self.submit(row['lfn'], row['dst'], 0, None, row['id'])
+            status = 'accepted' if job else 'fail'
+        if  status == 'fail':
+            TRANSFER_QUEUE.update(row['id'], status='failed',
+                    error='unable to resume transfer', finished=time.time())
+        return status
+
     def list_lfn(self, lfn, verbose=0):
         """List LFN"""
         pat_lfn = re.compile('^/.*\.root$')
         if  pat_lfn.match(lfn):
-            pfnlist, selist = get_pfns(arg, verbose)
-            for pfn in pfnlist:
-                print '%s %s' % (lfn, get_size(pfn, verbose))
+            pfnlist, selist = get_pfns(lfn, verbose)
+            for pfn, size in zip(pfnlist, get_sizes(pfnlist, verbose)):
+                print '%s %s' % (lfn, size)
 
-    def list_se(self, arg, verbose=0):
-        """list content of given directory on SE"""
-        try:
-            node, ldir = arg.split(':')
-        except:
-            msg = 'Given argument "%s" does not represent SE:dir' % arg
-            raise Exception(msg)
+    def ls_cmd(self, node, ldir, verbose=0):
+        "Return SURL of given directory and command which lists it"
         srmls = os.environ.get('SRM_LS', '')
         if  not srmls:
             print_error('Unable to find srm ls tool')
             sys.exit(1)
-        dst = [r for r in resolve_user_srm_path(node, ldir)][0]
+        dst = self.srm_path(node, ldir, verbose)
         if  os.environ.get('LCG_LS', ''):
             cmd = "%s -l -v -b -D srmv2 %s" % (os.environ['LCG_LS'], dst)
         else:
@@ -621,94 +805,190 @@ class FileMover(object):
                 cmd = "%s -2 -l %s" % (srmls, dst)
         if  verbose:
             print cmd
-        stdout, stderr = execmd(cmd)
-        if  stderr:
-            print_error(stderr)
-        output = []
-        row = {}
+        return dst, cmd
+
+    def list_se(self, arg, verbose=0):
+        """list content of given directory on SE, yield lines of listing"""
+        try:
+            node, ldir = arg.split(':')
+        except:
+            msg = 'Given argument "%s" does not represent SE:dir' % arg
+            raise Exception(msg)
+        srmls = os.environ.get('SRM_LS', '')
+        dst, cmd = self.ls_cmd(node, ldir, verbose)
+        # listing is parsed and printed while srm tool writes it
+        errors = []
+        lines  = stream_cmd(cmd, errors)
+        if  os.environ.get('LCG_LS', ''):
+            rows = (l.rstrip('\n') for l in lines if l.find('SE type') == -1)
+        elif srmls.find('srmls') != -1:
+            rows = srmls_printer(lines, dst.split('=')[-1])
+        else:
+            rows = srm_ls_printer(lines, dst.split('=')[-1])
+        for row in rows:
+            yield row
+        if  errors:
+            print_error(''.join(errors))
+
+    def se_entries(self, node, ldir, verbose=0):
+        """
+        Return list of entries of given directory on SE, every entry is
+        dict(name=path, size=bytes, dir=bool), paths are in /store area
+        """
+        srmls = os.environ.get('SRM_LS', '')
+        dst, cmd = self.ls_cmd(node, ldir, verbose)
+        stdout, stderr, code = EXECUTOR.submit(cmd).result()
+        if  code:
+            raise Exception('%s\n%s' % (cmd, stdout + stderr))
+        rows = []
         if  os.environ.get('LCG_LS', ''):
             for line in stdout.split('\n'):
-                if  line.find('SE type') != -1:
+                fields = line.split()
+                if  len(fields) < 7 or line.find('SE type') != -1:
                     continue
-                output.append(line)
-            return '\n'.join(output)
+                rows.append((fields[-1], fields[4], fields[0][0] == 'd'))
         elif srmls.find('srmls') != -1:
-            for line in srmls_printer(stdout, dst.split('=')[-1]):
-                output.append(line)
-            return '\n'.join(output)
+            for row in srmls_parser(stdout):
+                name = row.get('name', '')
+                isdir = row.get('ftype') == 'directory' or name.endswith('/')
+                rows.append((name, row.get('size', 0), isdir))
         else:
-            for line in srm_ls_printer(stdout, dst.split('=')[-1]):
-                output.append(line)
-            return '\n'.join(output)
+            for row in srm_ls_parser(stdout):
+                if  row.has_key('surl'):
+                    rows.append((row['surl'], row.get('bytes', 0),
+                        row.get('filetype') == 'directory'))
+        top = '/store/' + ldir.rstrip('/').split('/store/')[-1]
+        entries = []
+        for name, size, isdir in rows:
+            path = '/store/' + name.rstrip('/').split('/store/')[-1]
+            if  path == top: # listing includes directory itself
+                continue
+            entries.append(dict(name=path, size=long(size), dir=isdir))
+        return entries
 
-    def rm_lfn(self, arg, verbose=0):
-        """Remove user lfn from a node"""
-        try:
-            node, lfn = arg.split(':')
-        except:
-            msg = 'Given argument "%s" does not represent SE:LFN' % arg
-            raise Exception(msg)
-        cmd = os.environ.get('SRM_RM', '')
-        dst = [r for r in resolve_user_srm_path(node)][0]
-        dst, path = dst.split('=')
-        if  dst[-1] != '=':
-            dst += '='
-        for item in lfn.split('/'):
-            if  not item or item in path:
+    def srm_path(self, node, ldir, verbose=0):
+        """
+        Resolve SURL of given path on given node. Paths are resolved via
+        TFC rules of the node, otherwise via base SURL of /store/user area
+        which is resolved once per node.
+        """
+        ldir = '/store/' + ldir.split('/store/')[-1]
+        pfn  = TFCMGR.pfn(node, ldir)
+        if  pfn:
+            return pfn
+        if  node not in self.srm_bases:
+            base = [r for r in resolve_user_srm_path(node, verbose=verbose)][0]
+            if  base.rstrip('/').endswith('/store/user'):
+                self.srm_bases[node] = base.rstrip('/')[:-len('/store/user')]
+            else: # TFC does not map /store area by simple prefix
+                self.srm_bases[node] = None
+        if  self.srm_bases[node]:
+            return self.srm_bases[node] + ldir
+        return [r for r in resolve_user_srm_path(node, ldir, verbose)][0]
+
+    def se_paths(self, args, default='/store/user', verbose=0):
+        """
+        Expand given list of SE:path arguments into list of (node, path)
+        pairs, paths may contain shell-like wild-cards which are matched
+        against content of their directory on SE.
+        """
+        if  isinstance(args, basestring):
+            args = args.split()
+        pairs = []
+        for arg in args:
+            spath = arg.split(':', 1)
+            node  = spath[0]
+            path  = spath[1] if len(spath) > 1 and spath[1] else default
+            if  not path:
+                msg = 'Given argument "%s" does not represent SE:path' % arg
+                raise Exception(msg)
+            if  not glob.has_magic(path):
+                pairs.append((node, path))
                 continue
-            path += '/%s' % item
-        cmd = "%s %s" % (cmd, dst+path)
-        if  verbose:
-            print cmd
-        try:
-            stdout, stderr = execmd(cmd)
+            ddir, pat = os.path.split(path.rstrip('/'))
+            if  glob.has_magic(ddir):
+                raise Exception('Wild-cards are allowed only in last part of %s' % arg)
+            # entries exclude ddir itself, which the listing includes
+            names = set([os.path.basename(e['name']) \
+                    for e in self.se_entries(node, ddir, verbose)])
+            matches = sorted(fnmatch.filter(names, pat))
+            if  not matches:
+                print_warning('No match for %s' % arg)
+            for name in matches:
+                pairs.append((node, '%s/%s' % (ddir, name)))
+        return pairs
+
+    def srm_cmds(self, tool, surls):
+        """
+        Return list of commands which apply given srm tool to given SURLs,
+        tools which accept multiple SURLs get them in a single call
+        """
+        if  os.path.basename(tool.split()[0]) in MULTI_SURL_TOOLS:
+            return ['%s %s' % (tool, ' '.join(surls[idx:idx+SURL_CHUNK])) \
+                    for idx in xrange(0, len(surls), SURL_CHUNK)]
+        return ['%s %s' % (tool, surl) for surl in surls]
+
+    def srm_run(self, tool, surls, verbose=0):
+        "Apply given srm tool to given SURLs in parallel, return status"
+        if  not tool:
+            print_error('Unable to find srm tool')
+            return 'fail'
+        cmds = self.srm_cmds(tool, surls)
+        futures = [(cmd, EXECUTOR.submit(cmd)) for cmd in cmds]
+        status = 'success'
+        for cmd, future in futures:
+            try:
+                stdout, stderr, code = future.result()
+            except Exception as exc:
+                stdout, stderr, code = '', str(exc), -1
             if  verbose:
+                print_info(cmd)
                 print_info(stdout + stderr)
-        except:
+            if  code:
+                status = 'fail'
+                if  not verbose:
+                    print_error('%s\n%s' % (cmd, stdout + stderr))
+        return status
+
+    def rm_lfn(self, arg, verbose=0):
+        """
+        Remove user lfn(s) from a node, arg is a SE:LFN or list of them,
+        LFNs may contain wild-cards
+        """
+        pairs = self.se_paths(arg, None, verbose)
+        surls = [self.srm_path(n, p, verbose) for n, p in pairs]
+        if  not surls:
             return 'fail'
-        return 'success'
+        return self.srm_run(os.environ.get('SRM_RM', ''), surls, verbose)
 
     def rmdir(self, path, verbose=0):
-        """rmdir command"""
-        spath = path.split(':')
-        if  len(spath) == 1:
-            node = spath[0]
-            ldir = '/store/user'
-        else:
-            node = spath[0]
-            ldir = spath[1]
-        dst = [r for r in resolve_user_srm_path(node, ldir)][0]
-        cmd = '%s %s' % (os.environ.get('SRM_RMDIR', ''), dst)
-        if  verbose:
-            print_info(cmd)
-        try:
-            stdout, stderr = execmd(cmd)
-            if  verbose:
-                print_info(stdout + stderr)
-        except:
-            return 'fail'
-        return 'success'
+        """rmdir command, path is a SE:dir or list of them"""
+        pairs = self.se_paths(path, verbose=verbose)
+        # remove sub-directories before their parents
+        return self.srm_levels(os.environ.get('SRM_RMDIR', ''), pairs,
+                reverse=True, verbose=verbose)
 
     def mkdir(self, path, verbose=0):
-        """mkdir command"""
-        spath = path.split(':')
-        if  len(spath) == 1:
-            node = spath[0]
-            ldir = '/store/user'
-        else:
-            node = spath[0]
-            ldir = spath[1]
-        dst = [r for r in resolve_user_srm_path(node, ldir)][0]
-        cmd = '%s %s' % (os.environ.get('SRM_MKDIR', ''), dst)
-        if  verbose:
-            print_info(cmd)
-        try:
-            stdout, stderr = execmd(cmd)
-            if  verbose:
-                print_info(stdout + stderr)
-        except:
-            return 'fail'
-        return 'success'
+        """mkdir command, path is a SE:dir or list of them"""
+        pairs = self.se_paths(path, verbose=verbose)
+        # create parent directories before their sub-directories
+        return self.srm_levels(os.environ.get('SRM_MKDIR', ''), pairs,
+                reverse=False, verbose=verbose)
+
+    def srm_levels(self, tool, pairs, reverse=False, verbose=0):
+        """
+        Apply given srm tool to given (node, path) pairs level by level of
+        path depth, paths of the same level are processed in parallel
+        """
+        levels = {}
+        for node, path in pairs:
+            depth = len([p for p in path.split('/') if p])
+            levels.setdefault(depth, []).append(self.srm_path(node, path, verbose))
+        status = 'success' if levels else 'fail'
+        for depth in sorted(levels.keys(), reverse=reverse):
+            if  self.srm_run(tool, levels[depth], verbose) != 'success':
+                status = 'fail'
+        return status
 
 def lfn_exists(lfn, dst):
     "Check if given LFN exists at local destination"
@@ -722,8 +1002,11 @@ def lfn_exists(lfn, dst):
     return False
 
 FM_SINGLETON = FileMover()
-def copy_lfn(lfn, dst, verbose=0, background=False, overwrite=False):
-    """Copy lfn to destination"""
+def check_dst(lfn, dst, overwrite=False):
+    """
+    Check if given LFN can be copied to destination, remove existing
+    destination file if overwrite flag is set
+    """
     if  overwrite:
         if  os.path.isfile(dst):
             os.remove(dst)
@@ -745,45 +1028,194 @@ def copy_lfn(lfn, dst, verbose=0, background=False, overwrite=False):
                 print_warning('Destination %s is not local disk')
             if  fname:
                 print_warning('File %s already exists' % fname)
-                return 'fail'
+                return False
+    return True
+
+def local_dst(lfn, dst):
+    "Return local file name for given LFN and destination or None"
+    if  os.path.isdir(dst):
+        return os.path.join(dst, lfn.split('/')[-1])
+    if  os.path.isdir(os.path.dirname(os.path.abspath(dst))):
+        return dst
+    return None
+
+def copy_lfn(lfn, dst, verbose=0, background=False, overwrite=False):
+    """Copy lfn to destination"""
+    if  not check_dst(lfn, dst, overwrite):
+        return 'fail'
     method = os.environ.get('CMSSH_TRANSFER_METHOD', 'xrdcp')
     status = FM_SINGLETON.copy(lfn, dst, method, verbose, background)
     if  status == 'fail':
-        print_warning('xrdcp fails to copy file, fallback to GRID middleware mechanism')
+        print_warning('%s fails to copy file, fallback to GRID middleware mechanism' % method)
         if  os.environ.get('LCG_CP', ''):
             status = FM_SINGLETON.copy(lfn, dst, 'lcgcp', verbose, background)
         else:
             status = FM_SINGLETON.copy(lfn, dst, 'srmcp', verbose, background)
     return status
 
-def dqueue(arg=None):
-    """Return download queue"""
-    download_queue = FM_SINGLETON.queue
-    alive   = []
-    waiting = []
-    ended   = []
-    for lfn, (proc, status) in download_queue.items():
-        if not status:
-            waiting.append(lfn)
-        elif  proc.is_alive():
-            alive.append(lfn)
+def copy_lfns(lfns, dst, verbose=0, background=False, overwrite=False):
+    """
+    Copy list of LFNs to destination. All transfers are submitted to the
+    transfer scheduler, in foreground mode we wait for all of them and
+    report their status as they finish.
+    """
+    lfns = [l for l in lfns if check_dst(l, dst, overwrite)]
+    if  not lfns: # nothing to copy, same status as copy_lfn
+        return 'fail'
+    # resolve replicas of all LFNs in bulk before we resolve their PFNs
+    REPLICAS.lookup([l for l in lfns if not os.path.exists(l)])
+    done = Queue.Queue()
+    callback = None if background else done.put
+    jobs = []
+    for lfn in lfns:
+        try:
+            job = FM_SINGLETON.submit(lfn, dst, verbose, callback)
+        except Exception as exc:
+            job = None
+            if  verbose:
+                print_error(str(exc))
+        if  job:
+            jobs.append(job)
+        else:
+            print_error('Unable to resolve %s' % lfn)
+    if  background:
+        return 'accepted' if jobs else 'fail'
+    failed = len(lfns) - len(jobs)
+    for idx in xrange(len(jobs)):
+        job = done.get(True, 86400*365) # timeout keeps Ctrl-C working
+        msg = '[%s/%s] %s' % (idx+1, len(jobs), job.lfn)
+        if  job.status == 'done':
+            print_info('%s, %s, checksum %s' % (msg, job.dst, job.result[2]))
         else:
-            ended.append((lfn, proc.exitcode))
-            del download_queue[lfn]
+            failed += 1
+            err = ', %s' % job.error if job.error else ''
+            print_error('%s, failed%s' % (msg, err))
+    return 'fail' if failed else 'success'
+
+def expand_sources(args):
+    """
+    Expand cp sources into list of local files and LFNs. Sources can
+    be local files/globs, LFNs/LFN globs, @file with list of LFNs (one
+    per line), blocks or datasets.
+    """
+    lfns = []
+    for arg in args:
+        if  os.path.exists(arg):
+            lfns.append(arg)
+        elif arg[0] == '@': # file with list of LFNs
+            with open(arg[1:]) as stream:
+                for line in stream:
+                    line = line.strip()
+                    if  line and line[0] != '#':
+                        lfns.append(line)
+        elif glob.glob(arg):
+            lfns += sorted(glob.glob(arg))
+        elif pat_block.match(arg):
+            block = arg.replace('block=', '')
+            params = {'block_name': block}
+            for row in get_data_stream(dbs_url('files'), params):
+                lfns.append(row['logical_file_name'])
+            REPLICAS.lookup(block=block)
+        elif arg.replace('file=', '').startswith('/store'):
+            lfn = arg.replace('file=', '')
+            if  lfn.find('*') != -1: # DBS supports LFN wild-cards
+                params = {'logical_file_name': lfn}
+                for row in get_data_stream(dbs_url('files'), params):
+                    lfns.append(row['logical_file_name'])
+            else:
+                lfns.append(lfn)
+        elif pat_dataset.match(arg):
+            dataset = arg.replace('dataset=', '')
+            params = {'dataset': dataset}
+            for row in get_data_stream(dbs_url('files'), params):
+                lfns.append(row['logical_file_name'])
+            REPLICAS.lookup(dataset=dataset)
+        else:
+            lfns.append(arg)
+    return lfns
+
+def dqueue(arg=None):
+    """
+    Return download queue, it is read from persistent transfer queue and
+    includes jobs of previous cmssh sessions
+    """
+    if  arg and arg == 'clear':
+        TRANSFER_QUEUE.clear()
+        print_info('Finished jobs are removed from transfer queue')
+        return
+    # progress of running jobs is known only to their session
+    progress = dict((j.jid, j.progress) for j in \
+            FM_SINGLETON.scheduler.select(['running']) if j.progress)
+    jobs    = TRANSFER_QUEUE.select()
+    # active jobs of sessions on other hosts are never resumed here
+    remote  = [r for r in jobs if r['status'] in ['waiting', 'running'] \
+                and r['host'] != HOST]
+    jobs    = [r for r in jobs if r not in remote]
+    alive   = [r for r in jobs if r['status'] == 'running']
+    waiting = [r for r in jobs if r['status'] == 'waiting']
+    ended   = [r for r in jobs if r['status'] in ['done', 'failed']]
     print "In progress: %s jobs" % len(alive)
     if  arg and arg == 'list':
-        for lfn in alive:
-            print lfn
+        for row in alive:
+            msg = "%s => %s, started %s" \
+                % (row['lfn'], row['dst'], time_stamp(row['started']))
+            if  progress.get(row['id']):
+                msg += ", %s" % progress[row['id']]
+            print msg
         if  len(alive): print
     print "Waiting    : %s jobs" % len(waiting)
     if  arg and arg == 'list':
-        for lfn in waiting:
-            print lfn
+        for row in waiting:
+            msg = "%s => %s, submitted %s" \
+                % (row['lfn'], row['dst'], time_stamp(row['submitted']))
+            if  row['retries']:
+                msg += ", retry %s" % row['retries']
+            print msg
         if  len(waiting): print
     print "Finished   : %s jobs" % len(ended)
     if  arg and arg == 'list':
-        for lfn, code in ended:
-            print "%s, exit code %s" % (lfn, code)
+        for row in ended:
+            msg = "%s => %s, %s %s" % (row['lfn'], row['dst'], row['status'],
+                    time_stamp(row['finished']))
+            if  row['status'] == 'done':
+                msg += ", %s, checksum %s" \
+                    % (size_format(row['bytes']), row['checksum'])
+            elif row['error']:
+                msg += ", %s" % row['error']
+            if  row['retries']:
+                msg += ", %s retries" % row['retries']
+            print msg
+    if  remote:
+        if  arg and arg == 'list' and len(ended): print
+        print "Other hosts: %s jobs" % len(remote)
+        if  arg and arg == 'list':
+            for row in remote:
+                print "%s => %s, %s on %s (pid %s), submitted %s" \
+                    % (row['lfn'], row['dst'], row['status'],
+                       row['host'] or 'unknown host', row['pid'],
+                       time_stamp(row['submitted']))
+
+def resume_transfers():
+    """
+    Resume transfers which were waiting or running when previous cmssh
+    session died. Jobs are resubmitted in background thread since their
+    replicas need to be resolved again.
+    """
+    rows = TRANSFER_QUEUE.orphans()
+    if  not rows:
+        return
+    print_info('Resume %s transfer(s) of previous cmssh session' % len(rows))
+    def run():
+        "Resubmit transfer jobs"
+        for row in rows:
+            try:
+                FM_SINGLETON.resume(row)
+            except Exception as exc:
+                TRANSFER_QUEUE.update(row['id'], status='failed',
+                        error=str(exc), finished=time.time())
+    thr = threading.Thread(target=run)
+    thr.daemon = True
+    thr.start()
 
 def list_lfn(lfn, verbose=0):
     """List lfn info"""
@@ -793,6 +1225,51 @@ def list_se(arg, verbose=0):
     """List SE content"""
     return FM_SINGLETON.list_se(arg, verbose)
 
+def se_walk(arg, verbose=0):
+    "Walk directory tree of given SE:dir, see cmssh.se_tree"
+    try:
+        node, ldir = arg.split(':')
+    except:
+        msg = 'Given argument "%s" does not represent SE:dir' % arg
+        raise Exception(msg)
+    ldir = '/store/' + ldir.rstrip('/').split('/store/')[-1]
+    lister = lambda path: FM_SINGLETON.se_entries(node, path, verbose)
+    walker = TreeWalker(lister, int(os.environ.get('CMSSH_LS_THREADS', 4)))
+    return walker.walk(ldir)
+
+def list_se_tree(arg, verbose=0):
+    "Recursive listing of SE directory, yield lines as directories are listed"
+    for event in se_walk(arg, verbose):
+        if  event[0] != 'dir':
+            continue
+        _, path, entries, error = event
+        yield '\n%s:' % path
+        if  error:
+            print_error(error)
+        for entry in sorted(entries, key=lambda e: e['name']):
+            ftype = 'd' if entry['dir'] else '-'
+            yield '%s %12s %s' % (ftype, entry['size'],
+                    entry['name'].split('/')[-1])
+
+def du_se(arg, summary=False, verbose=0):
+    """
+    Disk usage of SE directory, yield total of every subdirectory as
+    soon as it is known, total of given directory comes last. Summary
+    flag reports only total of given directory.
+    """
+    last = None
+    for event in se_walk(arg, verbose):
+        if  event[0] == 'dir':
+            if  event[3]:
+                print_error(event[3])
+            continue
+        _, path, size, nfiles, _ndirs = event
+        last = '%-10s %8s files %s' % (size_format(size), nfiles, path)
+        if  not summary:
+            yield last
+    if  summary and last:
+        yield last
+
 def rm_lfn(lfn, verbose=0):
     """Remove lfn from destination"""
     return FM_SINGLETON.rm_lfn(lfn, verbose)
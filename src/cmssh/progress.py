@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Progress of running transfers. The progress is taken from the output of
+copy command itself (xrdcp progress bar, lcg-cp -v byte counts) or from
+size of local destination file, i.e. we never poll remote storage for
+it. Transfer rate and ETA are derived from recent progress updates.
+"""
+
+# system modules
+import os
+import re
+import time
+import select
+import subprocess
+from   collections import deque
+
+# cmssh modules
+from   cmssh.utils import size_format
+
+# xrdcp progress bar, e.g. [1.5MB/10MB][ 15%][==>      ][1.5MB/s]
+PAT_PERCENT = re.compile(r'\[\s*(\d+)%\]')
+PAT_XRD_BYTES = re.compile(r'\[(\d+(?:\.\d+)?)([kMGTP]?B)/')
+# lcg-cp -v output, e.g. 524288000 bytes  12345.67 KB/sec avg ...
+PAT_BYTES = re.compile(r'(\d+) bytes')
+UNITS = {'B': 1, 'kB': 1024, 'MB': 1024**2, 'GB': 1024**3,
+         'TB': 1024**4, 'PB': 1024**5}
+
+def parse_progress(line):
+    "Parse line of copy command output and return (bytes, percent)"
+    nbytes  = None
+    percent = None
+    match = PAT_PERCENT.search(line)
+    if  match:
+        percent = int(match.group(1))
+        match = PAT_XRD_BYTES.search(line)
+        if  match:
+            nbytes = int(float(match.group(1))*UNITS[match.group(2)])
+    else:
+        match = PAT_BYTES.search(line)
+        if  match:
+            nbytes = int(match.group(1))
+    return nbytes, percent
+
+def time_format(sec):
+    "Format given number of seconds as HH:MM:SS"
+    return time.strftime('%H:%M:%S', time.gmtime(sec))
+
+class TransferProgress(object):
+    """
+    Progress of a single transfer. The rate is measured over the last
+    window seconds of updates, ETA is based on that rate.
+    """
+    def __init__(self, total=None, window=10):
+        self.total   = total
+        self.window  = window
+        self.nbytes  = 0
+        self.percent = None
+        self.started = time.time()
+        self.samples = deque() # (timestamp, bytes) pairs within the window
+
+    def update(self, nbytes=None, percent=None):
+        "Update progress with transferred bytes and/or percent"
+        if  percent is not None:
+            self.percent = percent
+            if  nbytes is None and self.total:
+                nbytes = int(self.total*percent/100.)
+        if  nbytes is None:
+            return
+        self.nbytes = nbytes
+        if  self.total and percent is None:
+            self.percent = min(100, int(nbytes*100./self.total))
+        now = time.time()
+        self.samples.append((now, nbytes))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+
+    def rate(self):
+        "Return transfer rate in bytes/sec or None if it is not known yet"
+        if  len(self.samples) < 2:
+            return None
+        (time0, bytes0), (time1, bytes1) = self.samples[0], self.samples[-1]
+        if  time1 <= time0:
+            return None
+        return (bytes1 - bytes0)/(time1 - time0)
+
+    def eta(self):
+        "Return estimated time to completion in seconds or None"
+        rate = self.rate()
+        if  not rate or not self.total:
+            return None
+        return max(0, (self.total - self.nbytes)/rate)
+
+    def info(self):
+        "Return rate and ETA in human readable form"
+        rate = self.rate()
+        if  rate is None:
+            return ''
+        msg = '%s/s' % size_format(rate)
+        eta = self.eta()
+        if  eta is not None:
+            msg += ' ETA %s' % time_format(eta)
+        return msg
+
+    def __str__(self):
+        percent = '%s%%' % self.percent if self.percent is not None else 'N/A'
+        info = self.info()
+        return '%s %s' % (percent, info) if info else percent
+
+def run_with_progress(cmd, progress, dst=None, callback=None, interval=0.5):
+    """
+    Execute given command and update given progress from its output and
+    from the size of local destination file (if any). Callback is called
+    with progress every interval seconds. Return (output, return code),
+    stdout and stderr are read together, so the command can't block on
+    a full pipe.
+    """
+    local = None
+    if  dst and dst.startswith('file:'):
+        local = '/' + dst.replace('file:', '').lstrip('/')
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, close_fds=True)
+    fdesc  = proc.stdout.fileno()
+    output = []
+    buf    = ''
+    last   = 0
+    while True:
+        ready, _, _ = select.select([fdesc], [], [], interval)
+        if  ready:
+            data = os.read(fdesc, 4096)
+            if  not data:
+                break
+            output.append(data)
+            # progress bars are redrawn with carriage return
+            lines = re.split('[\r\n]', buf + data)
+            buf = lines.pop()
+            for line in lines:
+                nbytes, percent = parse_progress(line)
+                progress.update(nbytes, percent)
+        if  local and os.path.isfile(local):
+            progress.update(os.path.getsize(local))
+        if  callback and time.time() - last >= interval:
+            callback(progress)
+            last = time.time()
+    proc.wait()
+    if  callback:
+        callback(progress)
+    return ''.join(output), proc.returncode
@@ -15,25 +15,128 @@ This is broken into 2 APIs, datasets which returns list of
 datasets and filesummaries which provides details about
 given dataset. So we invoke 1 request to datasets API
 followed by N requests to filesummaries API.
+
+All curl handles are taken from process-wide CurlPool, so
+subsequent requests to the same data-service re-use already
+established (keep-alive) connections and TLS sessions.
 """
 
 import os
 import sys
 import stat
+import json
+import time
 import urllib
-import thread
 import pycurl
+import threading
 import urllib
 import urllib2
 import tempfile
 import traceback
 import subprocess
+from collections import deque
+from urlparse import urlparse
 from cmssh.auth_utils import PEMMGR, read_pem, working_pem, get_key_cert, HTTPSClientAuthHandler
 try:
     import cStringIO as StringIO
 except:
     import StringIO
 
+def parse_headers(data):
+    """
+    Parse raw HTTP headers into dict with lower-case keys. Only headers
+    of the last response are kept, e.g. the one we got after redirects.
+    """
+    headers = {}
+    for line in data.splitlines():
+        if  line.startswith('HTTP/'): # new response
+            headers = {}
+        elif line.find(':') != -1:
+            key, val = line.split(':', 1)
+            headers[key.strip().lower()] = val.strip()
+    return headers
+
+class CurlPool(object):
+    """
+    Thread-safe pool of pycurl.Curl handles. Handles are grouped by
+    (host, client cert) key, at most max_per_host handles are in use
+    for a given key at any time and handles which stay idle longer
+    than idle_timeout seconds are closed.
+    """
+    def __init__(self, max_per_host=4, idle_timeout=300):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.cond  = threading.Condition()
+        self.idle  = {} # key: list of (curl, last access time) pairs
+        self.inuse = {} # key: number of handles given away
+
+    def key(self, url, cert=None):
+        "Return pool key for given url and client certificate"
+        return (urlparse(url).netloc, cert)
+
+    def acquire(self, key, block=True):
+        """
+        Get curl handle for given key. If all handles for given key are
+        in use we either wait for one (block=True) or return None.
+        """
+        with self.cond:
+            self.evict()
+            while True:
+                handles = self.idle.get(key)
+                if  handles:
+                    curl, _ = handles.pop()
+                    break
+                if  self.inuse.get(key, 0) < self.max_per_host:
+                    curl = pycurl.Curl()
+                    break
+                if  not block:
+                    return None
+                self.cond.wait()
+            self.inuse[key] = self.inuse.get(key, 0) + 1
+        return curl
+
+    def release(self, key, curl, reuse=True):
+        """
+        Return curl handle back to the pool. Handles which fail during
+        request processing should be released with reuse=False.
+        """
+        with self.cond:
+            self.inuse[key] = max(0, self.inuse.get(key, 0) - 1)
+            if  reuse:
+                self.idle.setdefault(key, []).append((curl, time.time()))
+            else:
+                curl.close()
+            self.cond.notify_all()
+
+    def evict(self):
+        "Close handles which were idle longer than idle_timeout"
+        with self.cond:
+            tstamp = time.time() - self.idle_timeout
+            for key, handles in self.idle.items():
+                keep = []
+                for curl, atime in handles:
+                    if  atime < tstamp:
+                        curl.close()
+                    else:
+                        keep.append((curl, atime))
+                if  keep:
+                    self.idle[key] = keep
+                else:
+                    del self.idle[key]
+
+    def clear(self):
+        "Close all idle handles"
+        with self.cond:
+            for handles in self.idle.values():
+                for curl, _ in handles:
+                    curl.close()
+            self.idle = {}
+
+# create an singleton instance which will be used through the code
+CURL_POOL = CurlPool(\
+        max_per_host=int(os.environ.get('CMSSH_CURL_POOL_SIZE', 4)),
+        idle_timeout=int(os.environ.get('CMSSH_CURL_IDLE_TIMEOUT', 300)))
+
 class RequestHandler(object):
     """
     RequestHandler provides APIs to fetch single/multiple
@@ -48,7 +151,7 @@ class RequestHandler(object):
         self.connecttimeout = config.get('connecttimeout', 30)
         self.followlocation = config.get('followlocation', 1)
         self.maxredirs = config.get('maxredirs', 5)
-        self.cache = {} # fill at run time
+        self.pool = config.get('pool', CURL_POOL)
 
     def set_opts(self, curl, url, params, headers,
                  ckey=None, cert=None, post=None, doseq=True, verbose=None):
@@ -58,6 +161,9 @@ class RequestHandler(object):
         curl.setopt(pycurl.CONNECTTIMEOUT, self.connecttimeout)
         curl.setopt(pycurl.FOLLOWLOCATION, self.followlocation)
         curl.setopt(pycurl.MAXREDIRS, self.maxredirs)
+        curl.setopt(pycurl.FORBID_REUSE, 0)
+        if  hasattr(pycurl, 'TCP_KEEPALIVE'): # available since libcurl 7.25
+            curl.setopt(pycurl.TCP_KEEPALIVE, 1)
         curl.setopt(pycurl.COOKIEJAR, '.cookie')
         curl.setopt(pycurl.COOKIEFILE, '.cookie')
 
@@ -100,15 +206,154 @@ class RequestHandler(object):
     def get_data(self, url, params, headers=None, post=None,
                 ckey=None, cert=None, doseq=True, verbose=None):
         """Fetch data for given set of parameters"""
-        if  self.cache.has_key(thread):
-            curl = self.cache.get(thread)
-        else:
-            curl = pycurl.Curl()
-            self.cache[thread] = curl
-        bbuf, hbuf = self.set_opts(curl, url, params, headers,
-                ckey, cert, post, doseq, verbose)
-        curl.perform()
+        _code, _headers, data = self.get_response(url, params, headers,
+                post, ckey, cert, doseq, verbose)
+        return data
+
+    def get_response(self, url, params, headers=None, post=None,
+                ckey=None, cert=None, doseq=True, verbose=None):
+        """
+        Fetch data for given set of parameters and return HTTP status code,
+        dict of response headers and data stream
+        """
+        key  = self.pool.key(url, cert)
+        curl = self.pool.acquire(key)
+        try:
+            # reset options left from previous request, reset keeps
+            # alive connections and TLS session cache of the handle
+            curl.reset()
+            bbuf, hbuf = self.set_opts(curl, url, params, headers,
+                    ckey, cert, post, doseq, verbose)
+            curl.perform()
+            code = curl.getinfo(pycurl.RESPONSE_CODE)
+        except:
+            self.pool.release(key, curl, reuse=False)
+            raise
+        self.pool.release(key, curl)
         bbuf.seek(0)# to use file description seek to the begining of the stream
         data = bbuf # leave StringIO object, which will serve as file descriptor
         hbuf.flush()
-        return data
+        return code, parse_headers(hbuf.getvalue()), data
+
+    def get_many(self, urls_params, headers=None, post=None,
+                ckey=None, cert=None, doseq=True, verbose=None,
+                window=None, decoder='json', status=False, info=False):
+        """
+        Fetch data for given list of (url, params) pairs concurrently.
+        Requests are processed via pycurl.CurlMulti, at most window of
+        them at a time (default is pool limit of handles per host).
+        Yield (url, params, data) tuples in order of their completion,
+        where data is decoded according to given decoder. If status is
+        set, HTTP status code is yielded as 4th element of the tuple. If
+        info is set, dict of response headers is yielded as last element.
+        """
+        if  not window:
+            window = self.pool.max_per_host
+        pending = deque(urls_params)
+        active  = {} # curl: (key, url, params, bbuf, hbuf)
+        multi   = pycurl.CurlMulti()
+        try:
+            while pending or active:
+                # fill processing window with new requests
+                while pending and len(active) < window:
+                    url, params = pending[0]
+                    key  = self.pool.key(url, cert)
+                    curl = self.pool.acquire(key, block=not active)
+                    if  not curl: # all handles are busy, wait for active ones
+                        break
+                    pending.popleft()
+                    curl.reset()
+                    bbuf, hbuf = self.set_opts(curl, url, params, headers,
+                            ckey, cert, post, doseq, verbose)
+                    multi.add_handle(curl)
+                    active[curl] = (key, url, params, bbuf, hbuf)
+                while True:
+                    ret, _ = multi.perform()
+                    if  ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                done = 0
+                while True:
+                    nqueued, ok_list, err_list = multi.info_read()
+                    done += len(ok_list)
+                    for curl in ok_list:
+                        multi.remove_handle(curl)
+                        key, url, params, bbuf, hbuf = active.pop(curl)
+                        code = curl.getinfo(pycurl.RESPONSE_CODE)
+                        self.pool.release(key, curl)
+                        bbuf.seek(0)
+                        row = (url, params, self.decode(bbuf, decoder))
+                        if  status:
+                            row += (code,)
+                        if  info:
+                            row += (parse_headers(hbuf.getvalue()),)
+                        yield row
+                    for curl, errno, errmsg in err_list:
+                        multi.remove_handle(curl)
+                        key, url, params, _, _ = active.pop(curl)
+                        self.pool.release(key, curl, reuse=False)
+                        raise pycurl.error(errno, '%s, url=%s' % (errmsg, url))
+                    if  not nqueued:
+                        break
+                # wait for network activity unless we can schedule new requests
+                if  active and not (done and pending):
+                    multi.select(1.0)
+        finally:
+            for curl, (key, _url, _params, _bbuf) in active.items():
+                multi.remove_handle(curl)
+                self.pool.release(key, curl, reuse=False)
+            multi.close()
+
+    def get_stream(self, url, params, headers=None, post=None,
+                ckey=None, cert=None, doseq=True, verbose=None, response=None):
+        """
+        Fetch data for given set of parameters and yield response body
+        in chunks as they arrive from the network, i.e. the body is never
+        held in memory as a whole. Raise pycurl.error on transfer failure
+        and on HTTP status codes other than 200. If response dict is
+        given, 304 (not modified) is accepted as well and HTTP status
+        code and headers are stored in it once the body is read.
+        """
+        key    = self.pool.key(url, cert)
+        curl   = self.pool.acquire(key)
+        multi  = pycurl.CurlMulti()
+        chunks = deque()
+        reuse  = False
+        try:
+            curl.reset()
+            _, hbuf = self.set_opts(curl, url, params, headers,
+                    ckey, cert, post, doseq, verbose)
+            curl.setopt(pycurl.WRITEFUNCTION, chunks.append)
+            multi.add_handle(curl)
+            running = True
+            while running:
+                while True:
+                    ret, nhandles = multi.perform()
+                    if  ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                running = nhandles > 0
+                _, _, err_list = multi.info_read()
+                for _curl, errno, errmsg in err_list:
+                    raise pycurl.error(errno, '%s, url=%s' % (errmsg, url))
+                code = curl.getinfo(pycurl.RESPONSE_CODE)
+                if  code and code != 200 and \
+                    not (code == 304 and response is not None):
+                    raise pycurl.error(pycurl.E_HTTP_RETURNED_ERROR, \
+                            'HTTP code %s, url=%s' % (code, url))
+                while chunks:
+                    yield chunks.popleft()
+                if  running:
+                    multi.select(1.0)
+            if  response is not None:
+                response['code'] = curl.getinfo(pycurl.RESPONSE_CODE)
+                response['headers'] = parse_headers(hbuf.getvalue())
+            reuse = True
+        finally:
+            multi.remove_handle(curl)
+            multi.close()
+            self.pool.release(key, curl, reuse=reuse)
+
+    def decode(self, stream, decoder='json'):
+        """Decode data from given stream"""
+        if  decoder == 'json':
+            return json.load(stream)
+        return stream.read()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Replica ranking. Throughput and failure rate of every source site are
+measured from completed copies and kept in a small persistent store,
+candidate replicas are ordered by expected throughput. Users can
+prefer or exclude sites via CMSSH_PREFER_SITES/CMSSH_EXCLUDE_SITES,
+comma separated lists of CMS names or SE hosts which may contain
+shell-like wild-cards, e.g. CMSSH_PREFER_SITES=T1_*,T2_CH_CERN
+"""
+
+# system modules
+import os
+import json
+import time
+import fnmatch
+import tempfile
+import threading
+
+# cmssh modules
+from cmssh.scheduler import site_of
+
+def stats_file():
+    "Return default location of site statistics store"
+    return os.path.join(os.environ['HOME'], '.cmssh/site_stats.json')
+
+def site_list(name):
+    "Return list of site patterns from given environment variable"
+    return [s.strip() for s in os.environ.get(name, '').split(',') if s.strip()]
+
+class ReplicaRanker(object):
+    """
+    Keep per-site transfer statistics: moving average of throughput
+    (bytes/sec), number of successful and failed copies, and rank
+    replicas by throughput weighted with success probability.
+    """
+    def __init__(self, fname=None, alpha=0.3, default_rate=10*1024*1024):
+        self.fname        = fname
+        self.alpha        = alpha # weight of new measurement in the average
+        self.default_rate = default_rate # rate of sites we know nothing about
+        self.lock         = threading.Lock()
+        self.stats        = None # site: stats dict, read at run time
+
+    def path(self):
+        "Return location of the store"
+        return self.fname if self.fname else stats_file()
+
+    def load(self):
+        "Load statistics from the store, must be called under the lock"
+        try:
+            with open(self.path(), 'r') as stream:
+                self.stats = json.load(stream)
+        except (IOError, ValueError):
+            self.stats = {}
+        return self.stats
+
+    def save(self):
+        "Save statistics into the store, must be called under the lock"
+        fname = self.path()
+        fdir  = os.path.dirname(fname)
+        if  not os.path.isdir(fdir):
+            os.makedirs(fdir)
+        fdesc, tmp = tempfile.mkstemp(dir=fdir, suffix='.tmp')
+        with os.fdopen(fdesc, 'w') as stream:
+            json.dump(self.stats, stream)
+        os.rename(tmp, fname)
+
+    def record(self, pfn, size=0, elapsed=0, success=True):
+        "Record outcome of copy from the site of given PFN"
+        site = site_of(pfn)
+        with self.lock:
+            # re-read the store, other cmssh sessions may update it too
+            stats = self.load()
+            row = stats.setdefault(site, \
+                    {'rate': None, 'ok': 0, 'fail': 0, 'bytes': 0})
+            if  success:
+                row['ok'] += 1
+                row['bytes'] += size
+                if  size and elapsed > 0:
+                    rate = size/float(elapsed)
+                    if  row['rate'] is None:
+                        row['rate'] = rate
+                    else:
+                        row['rate'] = self.alpha*rate + \
+                                (1-self.alpha)*row['rate']
+            else:
+                row['fail'] += 1
+            row['timestamp'] = time.time()
+            try:
+                self.save()
+            except (IOError, OSError):
+                pass # statistics are optional
+
+    def expected_rate(self, site):
+        "Return expected throughput of given site"
+        with self.lock:
+            stats = self.stats if self.stats is not None else self.load()
+            row = stats.get(site)
+            rates = [r['rate'] for r in stats.values() if r['rate']]
+        if  not row:
+            # unknown sites get median rate of known ones to be explored
+            if  rates:
+                return sorted(rates)[len(rates)/2]
+            return self.default_rate
+        rate = row['rate'] if row['rate'] else self.default_rate
+        # probability of success with Laplace smoothing
+        return rate*(row['ok'] + 1.)/(row['ok'] + row['fail'] + 2.)
+
+    def rank(self, pfns, nodes=None):
+        """
+        Order given PFNs by expected throughput of their sites. Optional
+        nodes dict provides CMS name of every PFN which is used to match
+        preferred and excluded sites along with SE host of the PFN.
+        """
+        if  not nodes:
+            nodes = {}
+        prefer  = site_list('CMSSH_PREFER_SITES')
+        exclude = site_list('CMSSH_EXCLUDE_SITES')
+        def match(pfn, patterns):
+            "Return index of first matching pattern or None"
+            names = [site_of(pfn), nodes.get(pfn)]
+            for idx, pat in enumerate(patterns):
+                for name in names:
+                    if  name and fnmatch.fnmatch(name, pat):
+                        return idx
+            return None
+        ranked = []
+        for idx, pfn in enumerate(pfns):
+            if  match(pfn, exclude) is not None:
+                continue
+            pidx = match(pfn, prefer)
+            if  pidx is None:
+                pidx = len(prefer)
+            rate = self.expected_rate(site_of(pfn))
+            ranked.append((pidx, -rate, idx, pfn)) # keep order of equals
+        ranked.sort()
+        return [row[-1] for row in ranked]
+
+# create an singleton instance which will be used through the code
+RANKER = ReplicaRanker()
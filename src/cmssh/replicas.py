@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Index of file replicas known to PhEDEx. Replicas of many LFNs, of all
+files in a block or in a dataset are resolved via few bulk fileReplicas
+requests and kept as LFN -> [(node, se), ...] index, so multi-file
+operations do not issue one PhEDEx request per file.
+"""
+
+# system modules
+import time
+import threading
+
+# cmssh modules
+from cmssh.cms_urls import phedex_url
+from cmssh.url_utils import get_data, get_data_many
+
+class ReplicaIndex(object):
+    """
+    LFN -> [(node, se), ...] index of PhEDEx file replicas. Index entries
+    are valid for threshold seconds since replicas come and go.
+    """
+    def __init__(self, threshold=600, chunk=50):
+        self.threshold = threshold # in sec, default 10 minutes
+        self.chunk     = chunk # number of LFNs per fileReplicas request
+        self.index     = {} # lfn: (timestamp, replicas), filled at run time
+        self.lock      = threading.Lock()
+
+    def update(self, data, lfns=None):
+        """
+        Update index from fileReplicas API response. LFNs we asked for
+        but which are not present in the response have no replicas.
+        Return list of LFNs found in the response.
+        """
+        tstamp = time.time()
+        found  = []
+        with self.lock:
+            for block in data['phedex']['block']:
+                for row in block['file']:
+                    replicas = []
+                    for replica in row['replica']:
+                        item = (replica.get('node'), replica.get('se'))
+                        if  item not in replicas:
+                            replicas.append(item)
+                    self.index[row['name']] = (tstamp, replicas)
+                    found.append(row['name'])
+            for lfn in set(lfns if lfns else []) - set(found):
+                self.index[lfn] = (tstamp, [])
+        return found
+
+    def valid(self, lfn):
+        "Check if index holds valid entry for given LFN"
+        with self.lock:
+            return lfn in self.index and \
+                time.time() - self.index[lfn][0] < self.threshold
+
+    def get(self, lfn):
+        "Return indexed replicas of given LFN"
+        with self.lock:
+            return list(self.index[lfn][1])
+
+    def lookup(self, lfns=None, block=None, dataset=None):
+        """
+        Resolve replicas of given list of LFNs, all files of given block
+        or dataset. Return dict of lfn: [(node, se), ...] pairs.
+        """
+        url = phedex_url('fileReplicas')
+        if  block or dataset:
+            params = {'se': '*'}
+            if  block:
+                params['block'] = block
+            else:
+                params['dataset'] = dataset
+            found = self.update(get_data(url, params))
+            return dict((lfn, self.get(lfn)) for lfn in found)
+        lfns = list(lfns if lfns else [])
+        missing = [lfn for lfn in set(lfns) if not self.valid(lfn)]
+        requests = []
+        for idx in xrange(0, len(missing), self.chunk):
+            params = {'se': '*', 'lfn': missing[idx:idx+self.chunk]}
+            requests.append((url, params))
+        for _url, params, data in get_data_many(requests):
+            self.update(data, params['lfn'])
+        return dict((lfn, self.get(lfn)) for lfn in lfns)
+
+    def replicas(self, lfn):
+        "Return list of (node, se) replicas of given LFN"
+        if  not self.valid(lfn):
+            self.lookup([lfn])
+        return self.get(lfn)
+
+# create an singleton instance which will be used through the code
+REPLICAS = ReplicaIndex()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Run/lumi masks represented as sorted lists of [start, end] lumi
+section ranges, e.g. the CMS golden JSON {run: [[1, 10], [15, 20]]}.
+All set operations work on ranges directly, lumi sections are never
+expanded into individual numbers.
+"""
+
+# system modules
+import sys
+from   bisect import bisect_right
+
+def merge_ranges(ranges):
+    "Sort given [start, end] ranges and merge overlapping/adjacent ones"
+    output = []
+    for start, end in sorted(ranges):
+        if  output and start <= output[-1][1] + 1:
+            if  end > output[-1][1]:
+                output[-1][1] = end
+        else:
+            output.append([start, end])
+    return output
+
+class LumiRanges(object):
+    """
+    Set of lumi sections stored as sorted list of non-overlapping
+    [start, end] ranges. It supports union (|), intersection (&),
+    difference (-), membership test and iteration over lumi sections.
+    """
+    __slots__ = ('ranges',)
+    def __init__(self, ranges=None):
+        self.ranges = merge_ranges(ranges) if ranges else []
+
+    @classmethod
+    def from_lumis(cls, lumis):
+        "Create LumiRanges from given list of lumi sections or ranges"
+        if  isinstance(lumis, LumiRanges):
+            return cls(lumis.ranges)
+        lumis = list(lumis) if lumis else []
+        if  lumis and isinstance(lumis[0], (list, tuple)): # CMS JSON ranges
+            return cls([[int(r[0]), int(r[-1])] for r in lumis])
+        obj = cls()
+        for lumi in sorted(set(int(l) for l in lumis)):
+            if  obj.ranges and lumi == obj.ranges[-1][1] + 1:
+                obj.ranges[-1][1] = lumi
+            else:
+                obj.ranges.append([lumi, lumi])
+        return obj
+
+    def __contains__(self, lumi):
+        idx = bisect_right(self.ranges, [lumi, sys.maxint])
+        return idx > 0 and self.ranges[idx-1][1] >= lumi
+
+    def __iter__(self):
+        for start, end in self.ranges:
+            for lumi in xrange(start, end+1):
+                yield lumi
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in self.ranges)
+
+    def __nonzero__(self):
+        return bool(self.ranges)
+
+    def __eq__(self, other):
+        return isinstance(other, LumiRanges) and self.ranges == other.ranges
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.ranges)
+
+    def union(self, other):
+        "Return union of this and other ranges"
+        return LumiRanges(self.ranges + other.ranges)
+
+    def intersection(self, other):
+        "Return intersection of this and other ranges"
+        output = []
+        idx, jdx = 0, 0
+        while idx < len(self.ranges) and jdx < len(other.ranges):
+            start = max(self.ranges[idx][0], other.ranges[jdx][0])
+            end   = min(self.ranges[idx][1], other.ranges[jdx][1])
+            if  start <= end:
+                output.append([start, end])
+            if  self.ranges[idx][1] < other.ranges[jdx][1]:
+                idx += 1
+            else:
+                jdx += 1
+        obj = LumiRanges()
+        obj.ranges = output
+        return obj
+
+    def difference(self, other):
+        "Return ranges of this object which are not present in other"
+        output = []
+        jdx = 0
+        for start, end in self.ranges:
+            while jdx < len(other.ranges) and other.ranges[jdx][1] < start:
+                jdx += 1
+            kdx = jdx
+            while kdx < len(other.ranges) and other.ranges[kdx][0] <= end:
+                ostart, oend = other.ranges[kdx]
+                if  ostart > start:
+                    output.append([start, ostart-1])
+                start = max(start, oend+1)
+                kdx += 1
+            if  start <= end:
+                output.append([start, end])
+        obj = LumiRanges()
+        obj.ranges = output
+        return obj
+
+    __or__  = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def tolist(self):
+        "Return list of [start, end] ranges"
+        return [list(r) for r in self.ranges]
+
+class RunLumiMask(dict):
+    """
+    Dictionary of run: LumiRanges pairs. It can be created from golden
+    JSON like dict {run: [[start, end], ...]} or from run-lumi dict
+    {run: [lumi, ...]}. A run with empty lumi ranges represents the
+    whole run, this is how cmssh treats run-lumi dicts, and it acts as
+    a wildcard in all set operations. The only exception is difference
+    of whole run and some of its lumis, since the mask does not know
+    run boundaries the whole run is kept in this case.
+    """
+    def __init__(self, rdict=None):
+        super(RunLumiMask, self).__init__()
+        if  rdict:
+            for run, lumis in rdict.iteritems():
+                self.add(run, lumis)
+
+    def add(self, run, lumis):
+        "Add given lumis (list of lumis or ranges) to given run"
+        run   = int(run)
+        lumis = LumiRanges.from_lumis(lumis)
+        if  self.has_key(run):
+            lumis = self[run] | lumis
+        self[run] = lumis
+
+    def contains(self, run, lumi):
+        "Check if given run/lumi pair belongs to the mask"
+        if  run not in self:
+            return False
+        return not self[run] or lumi in self[run]
+
+    def union(self, other):
+        "Return union of this and other masks"
+        mask = RunLumiMask()
+        for run in set(self.keys()) | set(other.keys()):
+            if  run in self and run in other:
+                if  self[run] and other[run]:
+                    mask[run] = self[run] | other[run]
+                else: # whole run
+                    mask[run] = LumiRanges()
+            else:
+                mask[run] = LumiRanges.from_lumis(self.get(run, other.get(run)))
+        return mask
+
+    def intersection(self, other):
+        "Return intersection of this and other masks"
+        mask = RunLumiMask()
+        for run in set(self.keys()) & set(other.keys()):
+            if  not self[run]: # whole run
+                mask[run] = LumiRanges.from_lumis(other[run])
+                continue
+            if  not other[run]:
+                mask[run] = LumiRanges.from_lumis(self[run])
+                continue
+            lumis = self[run] & other[run]
+            if  lumis:
+                mask[run] = lumis
+        return mask
+
+    def difference(self, other):
+        "Return part of this mask which is not present in other mask"
+        mask = RunLumiMask()
+        for run, lumis in self.iteritems():
+            if  run in other:
+                if  not other[run]: # whole run is removed
+                    continue
+                if  not lumis: # whole run is kept, see class docstring
+                    mask[run] = LumiRanges()
+                    continue
+                lumis = lumis - other[run]
+                if  not lumis:
+                    continue
+            mask[run] = LumiRanges.from_lumis(lumis)
+        return mask
+
+    __or__  = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def tojson(self):
+        "Return CMS JSON representation of the mask, {run: [[start, end]]}"
+        return dict((run, lumis.tolist()) for run, lumis in self.iteritems())
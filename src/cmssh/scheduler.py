@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Transfer scheduler. Transfer jobs are executed by a bounded pool of
+worker threads and the number of concurrent transfers per source and
+per destination site is limited as well. Workers are woken up by job
+submission and job completion, i.e. there is no polling.
+"""
+
+# system modules
+import time
+import urlparse
+import threading
+from   collections import deque
+
+# cmssh modules
+from   cmssh.iprint import print_error
+
+def site_of(url):
+    "Return site (host name) of given PFN, local files belong to local site"
+    if  not url or url.startswith('file:') or url.startswith('/'):
+        return 'local'
+    host = urlparse.urlparse(url).hostname
+    return host if host else 'local'
+
+class TransferJob(object):
+    """
+    Transfer job of given LFN to given destination, the transfer itself
+    is done by func(*args) which should return False upon failure.
+    """
+    def __init__(self, lfn, dst, func, args=(), source=None,
+            destination=None, callback=None):
+        self.lfn         = lfn
+        self.dst         = dst
+        self.func        = func
+        self.args        = args
+        self.source      = source
+        self.destination = destination
+        self.callback    = callback # called with the job once it is finished
+        self.status      = 'waiting' # waiting, running, done, failed
+        self.result      = None
+        self.error       = None
+        self.progress    = None # optional TransferProgress of the job
+        self.target      = None # destination requested by user
+        self.method      = None # transfer method requested by user
+        self.jid         = None # id of the job in persistent queue
+        self.retries     = 0
+        self.submitted   = time.time()
+        self.started     = None
+        self.finished    = None
+        self.event       = threading.Event()
+
+    def wait(self, timeout=None):
+        "Wait for job completion and return its status"
+        self.event.wait(timeout)
+        return self.status
+
+    def __repr__(self):
+        return '<TransferJob %s -> %s, %s>' % (self.lfn, self.dst, self.status)
+
+class TransferScheduler(object):
+    """
+    Run transfer jobs in a pool of nworkers threads. At most per_source
+    jobs read from the same source site and at most per_destination jobs
+    write to the same destination site at a time, zero means no limit.
+    Failed jobs are retried up to retries times. State changes of jobs
+    are recorded in optional journal, see cmssh.transfer_queue, only the
+    last history finished jobs are kept in memory.
+    """
+    def __init__(self, nworkers=3, per_source=0, per_destination=0,
+            retries=0, journal=None, history=100):
+        self.nworkers        = max(1, nworkers)
+        self.per_source      = per_source
+        self.per_destination = per_destination
+        self.retries         = retries
+        self.journal         = journal
+        self.cond            = threading.Condition()
+        self.pending         = deque()
+        self.jobs            = [] # waiting and running jobs
+        self.finished        = deque(maxlen=history) # recently finished jobs
+        self.sources         = {} # number of running jobs per source
+        self.destinations    = {} # number of running jobs per destination
+        self.workers         = []
+
+    def submit(self, job):
+        "Submit given job to the scheduler and return it"
+        self.record(job)
+        with self.cond:
+            self.jobs.append(job)
+            self.pending.append(job)
+            # start workers lazily, the pool does not exist until needed
+            while len(self.workers) < self.nworkers:
+                thr = threading.Thread(target=self.worker)
+                thr.daemon = True
+                thr.start()
+                self.workers.append(thr)
+            self.cond.notify()
+        return job
+
+    def record(self, job):
+        "Record job state in the journal"
+        if  self.journal:
+            try:
+                self.journal.record(job)
+            except Exception as exc: # worker must survive journal failure
+                print_error('Unable to record %s: %s' % (job, exc))
+
+    def eligible(self, job):
+        "Check if given job can run without exceeding site limits"
+        if  self.per_source and \
+            self.sources.get(job.source, 0) >= self.per_source:
+            return False
+        if  self.per_destination and \
+            self.destinations.get(job.destination, 0) >= self.per_destination:
+            return False
+        return True
+
+    def next_job(self):
+        "Pop first pending job which can run, must be called under the lock"
+        for job in self.pending:
+            if  self.eligible(job):
+                self.pending.remove(job)
+                return job
+        return None
+
+    def worker(self):
+        "Worker thread, run jobs as they become eligible"
+        while True:
+            with self.cond:
+                job = self.next_job()
+                while not job:
+                    self.cond.wait()
+                    job = self.next_job()
+                self.sources[job.source] = \
+                        self.sources.get(job.source, 0) + 1
+                self.destinations[job.destination] = \
+                        self.destinations.get(job.destination, 0) + 1
+                job.status  = 'running'
+                job.started = time.time()
+            self.record(job)
+            try:
+                result = job.func(*job.args)
+                error  = None
+            except Exception as exc:
+                result = None
+                error  = str(exc)
+            with self.cond:
+                self.sources[job.source] -= 1
+                self.destinations[job.destination] -= 1
+                job.result   = result
+                job.error    = error
+                retry = not result and job.retries < self.retries
+                if  retry:
+                    job.retries += 1
+                    job.status   = 'waiting'
+                else:
+                    job.status   = 'done' if result else 'failed'
+                    job.finished = time.time()
+                    self.jobs.remove(job)
+                    self.finished.append(job)
+                # site slots are free now, let other workers pick up jobs
+                self.cond.notify_all()
+            self.record(job)
+            if  retry:
+                with self.cond:
+                    self.pending.append(job)
+                    self.cond.notify()
+                continue
+            job.event.set()
+            if  job.callback:
+                try:
+                    job.callback(job)
+                except Exception as exc: # worker must survive bad callback
+                    print_error('Callback of %s failed: %s' % (job, exc))
+
+    def select(self, states=None):
+        "Return list of jobs in given states, e.g. ['waiting', 'running']"
+        with self.cond:
+            jobs = self.jobs + list(self.finished)
+            return [j for j in jobs if not states or j.status in states]
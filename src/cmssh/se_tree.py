@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Recursive traversal of storage element directory trees. Directories are
+listed by a bounded pool of threads (every listing is an srm call), the
+walker reports content of every directory as soon as it is listed and
+total size/number of files of every subtree as soon as all directories
+of the subtree are listed, i.e. partial totals stream while we walk.
+"""
+
+# system modules
+import Queue
+import threading
+
+class TreeWalker(object):
+    """
+    Walk directory tree with at most nworkers concurrent listings. The
+    lister(path) returns list of dict(name=path, size=bytes, dir=bool)
+    entries of given directory.
+    """
+    def __init__(self, lister, nworkers=4):
+        self.lister   = lister
+        self.nworkers = max(1, nworkers)
+
+    def worker(self, todo, done):
+        "Worker thread, list directories until it gets None"
+        while True:
+            path = todo.get()
+            if  path is None:
+                return
+            try:
+                done.put((path, list(self.lister(path)), None))
+            except Exception as exc:
+                done.put((path, [], str(exc)))
+
+    def walk(self, top):
+        """
+        Walk the tree under top directory and yield events:
+        ('dir', path, entries, error) when directory is listed and
+        ('total', path, size, nfiles, ndirs) when its subtree is done.
+        Totals come bottom-up, total of top directory is the last event.
+        """
+        todo = Queue.Queue()
+        done = Queue.Queue()
+        workers = []
+        for _ in xrange(self.nworkers):
+            thr = threading.Thread(target=self.worker, args=(todo, done))
+            thr.daemon = True
+            thr.start()
+            workers.append(thr)
+        # bookkeeping is done in this thread only, no locks are needed
+        info = {top: {'parent': None, 'size': 0, 'files': 0, 'dirs': 0}}
+        running = 1
+        todo.put(top)
+        try:
+            while running:
+                path, entries, error = done.get(True, 86400*365) # Ctrl-C
+                running -= 1
+                yield ('dir', path, entries, error)
+                node = info[path]
+                subdirs = [e['name'] for e in entries if e['dir']]
+                for entry in entries:
+                    if  not entry['dir']:
+                        node['size']  += entry['size']
+                        node['files'] += 1
+                node['dirs']    += len(subdirs)
+                node['pending']  = len(subdirs)
+                for sub in subdirs:
+                    info[sub] = {'parent': path, 'size': 0, 'files': 0,
+                                 'dirs': 0}
+                    todo.put(sub)
+                    running += 1
+                # propagate totals of finished subtrees to their parents
+                while path and not info[path]['pending']:
+                    node = info.pop(path)
+                    yield ('total', path, node['size'], node['files'],
+                            node['dirs'])
+                    path = node['parent']
+                    if  path:
+                        parent = info[path]
+                        parent['size']    += node['size']
+                        parent['files']   += node['files']
+                        parent['dirs']    += node['dirs']
+                        parent['pending'] -= 1
+        finally:
+            # drop directories nobody waits for when consumer stops early
+            while True:
+                try:
+                    todo.get_nowait()
+                except Queue.Empty:
+                    break
+            for _ in workers:
+                todo.put(None)
@@ -15,7 +15,7 @@ import urllib2
 
 # cmssh modules
 from   cmssh.utils import memoize
-from   cmssh.url_utils import get_data_and_close
+from   cmssh.url_utils import get_data, get_data_and_close
 from   cmssh.auth_utils import PEMMGR, working_pem, HTTPSClientAuthHandler
 
 def rowdict(columns, row):
@@ -57,17 +57,15 @@ class SiteDBManager(object):
         url = self.url + '/site-names'
         names = {}
         cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+        # site names and resources rarely change, they're served from cache
+        for row in parser(get_data(url, {}, decoder=None)):
+            names[row['site_name']] = row['alias']
+        # get site resources
+        url = self.url + '/site-resources'
+        for row in parser(get_data(url, {}, decoder=None)):
+            for sename in row['fqdn'].split(','):
+                self.mapping[sename.strip()] = names[row['site_name']]
         with working_pem(PEMMGR.pem) as key:
-            with get_data_and_close(url, key, cert) as data:
-                for row in parser(data.read()):
-                    names[row['site_name']] = row['alias']
-            # get site resources
-            url = self.url + '/site-resources'
-            with get_data_and_close(url, key, cert) as data:
-                for row in parser(data.read()):
-                    fqdn = row['fqdn']
-                    for sename in row['fqdn'].split(','):
-                        self.mapping[sename.strip()] = names[row['site_name']]
             # get people info
             url = self.url + '/people'
             with get_data_and_close(url, key, cert) as data:
@@ -12,6 +12,28 @@ import os
 import re
 import sys
 
+PAGE_SIZE = 100 # number of rows formatted at once by printers
+
+def stream_lines(stream):
+    """
+    Return iterator over lines of given stream which can be a string,
+    file object (e.g. subprocess pipe) or iterable of lines
+    """
+    if  isinstance(stream, basestring):
+        return iter(stream.split('\n'))
+    return stream
+
+def pages(rows, size=PAGE_SIZE):
+    "Group given rows into lists of given size"
+    page = []
+    for row in rows:
+        page.append(row)
+        if  len(page) == size:
+            yield page
+            page = []
+    if  page:
+        yield page
+
 def permissions(dfield, ufield, gfield, ofield):
     "Return UNIX permission string"
     def helper(field):
@@ -26,7 +48,7 @@ def permissions(dfield, ufield, gfield, ofield):
 # srmls paser/formater/printer implementation
 #
 def srmls_parser(stream):
-    "srmls parser"
+    "srmls parser, stream is a string or iterable of srmls output lines"
     pat = re.compile('\s*[0-9]*\s*/.*')
     row = {}
     uid = ''
@@ -34,7 +56,7 @@ def srmls_parser(stream):
     user = ''
     group = ''
     world = ''
-    for line in stream.split('\n'):
+    for line in stream_lines(stream):
         line = line.replace('\n', '')
         if  pat.match(line): # new row
             if  row:
@@ -46,19 +68,19 @@ def srmls_parser(stream):
             elif len(content) == 2: # it is file
                 row['size'] = content[0]
                 row['name'] = content[1]
-        for perm in ['user', 'group', 'world']:
-            if  line.lower().find('%spermission' % perm) != -1:
-                value = line.split()[-1].lower().replace('permissions', '')
-                if  perm == 'user':
-                    user = value
-                if  perm == 'group':
-                    group = value
-                if  perm == 'world':
-                    world = value
-                if  perm == 'user':
-                    uid = line.split()[1].replace('uid=', '').lower()
-                elif perm == 'group':
-                    gid = line.split()[1].replace('gid=', '').lower()
+        low = line.lower()
+        if  low.find('permission') != -1:
+            for perm in ['user', 'group', 'world']:
+                if  low.find('%spermission' % perm) != -1:
+                    value = low.split()[-1].replace('permissions', '')
+                    if  perm == 'user':
+                        user = value
+                        uid = line.split()[1].replace('uid=', '').lower()
+                    elif perm == 'group':
+                        group = value
+                        gid = line.split()[1].replace('gid=', '').lower()
+                    else:
+                        world = value
         if  uid:
             row['uid'] = uid
         if  gid:
@@ -69,45 +91,47 @@ def srmls_parser(stream):
             row['group'] = group
         if  world:
             row['world'] = world
-        if  line.lower().find('modified') != -1:
+        if  low.find('modified') != -1:
             row['tstamp'] = line.split(':', 1)[-1]
-        if  line.lower().find('type') != -1:
-            row['ftype'] = line.split()[-1].lower()
+        if  low.find('type') != -1:
+            row['ftype'] = low.split()[-1]
     if  row:
         yield row
 
 def srmls_printer(stream, dst=''):
-    "srmls printer"
-    rows = []
+    """
+    srmls printer, rows are formatted in pages as they are parsed from
+    the stream, size column only grows from page to page
+    """
     size_of_size = 0
-    for row in srmls_parser(stream):
-        size   = row.get('size', 0)
-        if  len(str(size)) > size_of_size:
-            size_of_size = len(str(size))
-        rows.append(row)
-    for row in rows:
-        name   = row.get('name').replace(dst, '')
-        if  not name:
-            name = '.'
-        elif name == '/':
-            name = '.'
-        elif name[0] == '/':
-            name = name[1:]
-        size   = row.get('size', 0)
-        if  len(str(size)) < size_of_size:
-            size = str(size).rjust(size_of_size-len(str(size))+1, ' ')
-        tstamp = row.get('tstamp', '')
-        ftype  = 'd' if row.get('ftype', '') == 'directory' else '-'
-        user   = row.get('user', 'r--')
-        group  = row.get('group', 'r--')
-        world  = row.get('world', 'r--')
-        perm   = permissions(ftype, user, group, world)
-        uid    = row.get('uid', '')
-        gid    = row.get('gid', '')
-        if  uid and gid:
-            yield "%s %s %s %s %s %s" % (perm, uid, gid, size, tstamp, name)
-        else:
-            yield "%s %s %s %s" % (perm, size, tstamp, name)
+    for rows in pages(srmls_parser(stream)):
+        for row in rows:
+            size   = row.get('size', 0)
+            if  len(str(size)) > size_of_size:
+                size_of_size = len(str(size))
+        for row in rows:
+            name   = row.get('name').replace(dst, '')
+            if  not name:
+                name = '.'
+            elif name == '/':
+                name = '.'
+            elif name[0] == '/':
+                name = name[1:]
+            size   = row.get('size', 0)
+            if  len(str(size)) < size_of_size:
+                size = str(size).rjust(size_of_size-len(str(size))+1, ' ')
+            tstamp = row.get('tstamp', '')
+            ftype  = 'd' if row.get('ftype', '') == 'directory' else '-'
+            user   = row.get('user', 'r--')
+            group  = row.get('group', 'r--')
+            world  = row.get('world', 'r--')
+            perm   = permissions(ftype, user, group, world)
+            uid    = row.get('uid', '')
+            gid    = row.get('gid', '')
+            if  uid and gid:
+                yield "%s %s %s %s %s %s" % (perm, uid, gid, size, tstamp, name)
+            else:
+                yield "%s %s %s %s" % (perm, size, tstamp, name)
 
 #
 # srm-ls paser/formater/printer implementation
@@ -120,13 +144,18 @@ def check_ls_fields(data):
         return True
     return False
 
-def srm_ls_format(arr, dst=''):
-    "Perform ls format of input rows"
+def srm_ls_format(arr, dst='', widths=None):
+    """
+    Perform ls format of input rows, optional widths dict keeps lengths
+    of bytes, user and group fields between calls
+    """
+    if  widths is None:
+        widths = {}
     output = []
     size   = 0 # total size
-    lbytes = 1 # length of the bytes field
-    luser  = 1 # length of the user field
-    lgroup = 1 # length of the group field
+    lbytes = widths.get('bytes', 1) # length of the bytes field
+    luser  = widths.get('user', 1) # length of the user field
+    lgroup = widths.get('group', 1) # length of the group field
     ufield = ''
     user   = ''
     ofield = ''
@@ -159,6 +188,7 @@ def srm_ls_format(arr, dst=''):
         fields = (name, mask, user, group, size, date)
         output.append(fields)
     output.sort()
+    widths.update({'bytes': lbytes, 'user': luser, 'group': lgroup})
     field_format = '%(mask)s %(user)s %(group)s %s %s %s'
     out = []
     for row in output:
@@ -176,24 +206,30 @@ def srm_ls_format(arr, dst=''):
     return out
 
 def srm_ls_printer(stream, dst=''):
-    "printer for srm-ls command"
-    for row in srm_ls_format(srm_ls_parser(stream), dst):
-        yield row
+    """
+    printer for srm-ls command, rows are formatted (and sorted) in pages
+    as they are parsed from the stream
+    """
+    widths = {}
+    for rows in pages(srm_ls_parser(stream)):
+        for row in srm_ls_format(rows, dst, widths):
+            yield row
 
 def srm_ls_parser(stream):
-    "parser for srm-ls command"
+    "parser for srm-ls command, stream is a string or iterable of lines"
     row = {}
     entities = ['file_status', 'filelocality', 'filetype', 'otherpermission']
-    for line in stream.split('\n'):
+    for line in stream_lines(stream):
         if  line.find('SRM-CLIENT*') == -1:
             continue
         if  line.find('SRM-CLIENT*REQUEST_STATUS') != -1:
             continue
+        line = line.rstrip('\n')
         if  line.find('SRM-CLIENT*SURL') != -1:
             if  row:
                 yield row
                 row = {}
-        key, val = line.split('=')
+        key, val = line.split('=', 1) # SURLs contain = sign
         key = key.replace('SRM-CLIENT*', '').lower()
         if  key == 'bytes':
             val = long(val)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Trivial File Catalog (TFC) of CMS sites. The lfn-to-pfn rules of every
+node are fetched once from PhEDEx tfc API (the response is persisted by
+url_cache) and LFNs are resolved into PFNs locally by applying the
+path-match/result rules, exactly as PhEDEx lfn2pfn API does it.
+"""
+
+# system modules
+import re
+import time
+import threading
+
+# cmssh modules
+from cmssh.cms_urls import phedex_url
+from cmssh.url_utils import get_data, get_data_many
+
+def parse_rules(data):
+    """
+    Parse PhEDEx tfc API response and return dict of lfn-to-pfn rules
+    per protocol, rules keep their order defined in site TFC.
+    """
+    rules = {}
+    for row in data['phedex']['storage-mapping']['array']:
+        if  row.get('element_name') != 'lfn-to-pfn':
+            continue
+        dst = row.get('destination-match')
+        rule = {'path-match': row['path-match'],
+                'result': row['result'],
+                'chain': row.get('chain'),
+                'pat': re.compile(row['path-match']),
+                'dst': re.compile(dst) if dst else None}
+        rules.setdefault(row['protocol'], []).append(rule)
+    return rules
+
+def substitute(result, match):
+    "Substitute $N placeholders of TFC result with groups of given match"
+    def group(item):
+        "Return group for given $N item"
+        try:
+            return match.group(int(item.group(1))) or ''
+        except IndexError:
+            return ''
+    return re.sub(r'\$(\d+)', group, result).replace('\\?', '?')
+
+def convert(rules, node, name, protocol, depth=0):
+    "Convert given name using TFC rules of given protocol, return None if fails"
+    if  depth > 10: # protect against cyclic chains
+        return None
+    for rule in rules.get(protocol, []):
+        if  rule['dst'] and not rule['dst'].match(node):
+            continue
+        if  rule['chain']:
+            cname = convert(rules, node, name, rule['chain'], depth+1)
+            if  cname is None:
+                continue
+        else:
+            cname = name
+        match = rule['pat'].match(cname)
+        if  match:
+            return substitute(rule['result'], match)
+    return None
+
+class TFCManager(object):
+    """
+    Cache of TFC rules per node. Rules are kept in memory for threshold
+    seconds, the underlying tfc API responses are cached on disk.
+    """
+    def __init__(self, threshold=10800):
+        self.threshold = threshold # in sec, default 3 hours
+        self.tfc       = {} # node: (timestamp, rules), filled at run time
+        self.lock      = threading.Lock()
+
+    def valid(self, node):
+        "Check if we hold valid rules for given node"
+        with self.lock:
+            return node in self.tfc and \
+                time.time() - self.tfc[node][0] < self.threshold
+
+    def update(self, node, data):
+        "Update rules of given node from tfc API response"
+        try:
+            rules = parse_rules(data)
+        except (KeyError, TypeError, re.error):
+            rules = {}
+        with self.lock:
+            self.tfc[node] = (time.time(), rules)
+
+    def prefetch(self, nodes):
+        "Fetch TFC rules for given list of nodes concurrently"
+        nodes = [n for n in set(nodes) if not self.valid(n)]
+        if  not nodes:
+            return
+        url = phedex_url('tfc')
+        requests = [(url, {'node': node}) for node in nodes]
+        for _url, params, data in get_data_many(requests):
+            self.update(params['node'], data)
+
+    def rules(self, node):
+        "Return TFC rules of given node"
+        if  not self.valid(node):
+            data = get_data(phedex_url('tfc'), {'node': node})
+            self.update(node, data)
+        with self.lock:
+            return self.tfc[node][1]
+
+    def pfn(self, node, lfn, protocol='srmv2'):
+        "Resolve given LFN into PFN on given node, return None if fails"
+        try:
+            rules = self.rules(node)
+        except Exception:
+            return None
+        return convert(rules, node, lfn, protocol)
+
+# create an singleton instance which will be used through the code
+TFCMGR = TFCManager()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Persistent transfer queue. Every transfer job submitted to the transfer
+scheduler is journaled in sqlite database along with its state, number
+of retries, transferred bytes and timestamps. Jobs which were waiting or
+running when cmssh session died are resumed by the next session on
+the same host, the database may live on shared (AFS) home directory.
+"""
+
+# system modules
+import os
+import time
+import socket
+import sqlite3
+import threading
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lfn TEXT, dst TEXT, method TEXT, status TEXT,
+    retries INTEGER DEFAULT 0, bytes INTEGER DEFAULT 0,
+    checksum TEXT, error TEXT, pid INTEGER, host TEXT,
+    submitted REAL, started REAL, finished REAL)"""
+FIELDS = ['id', 'lfn', 'dst', 'method', 'status', 'retries', 'bytes',
+          'checksum', 'error', 'pid', 'host', 'submitted', 'started',
+          'finished']
+HOST = socket.gethostname()
+
+def queue_file():
+    "Return default location of transfer queue database"
+    return os.path.join(os.environ['HOME'], '.cmssh/transfers.db')
+
+def pid_alive(pid):
+    "Check if process with given pid is alive"
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+class TransferQueue(object):
+    """
+    Journal of transfer jobs in sqlite database. The database is shared by
+    all cmssh sessions of the user, each job belongs to session (host and
+    pid) which submitted it.
+    """
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.lock  = threading.Lock()
+        self.ready = False
+
+    def path(self):
+        "Return location of the database"
+        return self.fname if self.fname else queue_file()
+
+    def connect(self):
+        "Return new connection to the database, must be called under the lock"
+        fname = self.path()
+        if  not self.ready:
+            fdir = os.path.dirname(fname)
+            if  not os.path.isdir(fdir):
+                os.makedirs(fdir)
+        conn = sqlite3.connect(fname, timeout=30)
+        if  not self.ready:
+            conn.execute(SCHEMA)
+            columns = [r[1] for r in conn.execute('PRAGMA table_info(jobs)')]
+            if  'host' not in columns: # database of older cmssh version
+                conn.execute('ALTER TABLE jobs ADD COLUMN host TEXT')
+            conn.commit()
+            self.ready = True
+        return conn
+
+    def record(self, job):
+        "Record current state of given transfer job"
+        nbytes   = job.progress.nbytes if job.progress else 0
+        checksum = None
+        if  job.status == 'done' and isinstance(job.result, tuple):
+            nbytes = job.result[1]
+            if  len(job.result) > 2:
+                checksum = job.result[2]
+        row = dict(lfn=job.lfn, dst=job.target or job.dst,
+                method=job.method, status=job.status, retries=job.retries,
+                bytes=nbytes, checksum=checksum, error=job.error,
+                pid=os.getpid(), host=HOST, submitted=job.submitted,
+                started=job.started, finished=job.finished)
+        keys = sorted(row.keys())
+        with self.lock:
+            try:
+                conn = self.connect()
+                try:
+                    if  job.jid:
+                        stm = 'UPDATE jobs SET %s WHERE id=?' \
+                                % ', '.join('%s=?' % k for k in keys)
+                        conn.execute(stm, [row[k] for k in keys] + [job.jid])
+                    else:
+                        stm = 'INSERT INTO jobs (%s) VALUES (%s)' \
+                                % (', '.join(keys), ', '.join('?'*len(keys)))
+                        cur = conn.execute(stm, [row[k] for k in keys])
+                        job.jid = cur.lastrowid
+                    conn.commit()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, IOError, OSError):
+                pass # journal is optional, transfers go on without it
+
+    def update(self, jid, **kwds):
+        "Update fields of job with given id"
+        keys = sorted(kwds.keys())
+        stm  = 'UPDATE jobs SET %s WHERE id=?' \
+                % ', '.join('%s=?' % k for k in keys)
+        with self.lock:
+            try:
+                conn = self.connect()
+                try:
+                    conn.execute(stm, [kwds[k] for k in keys] + [jid])
+                    conn.commit()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, IOError, OSError):
+                pass
+
+    def select(self, states=None):
+        "Return list of job records (dicts) in given states"
+        stm = 'SELECT %s FROM jobs' % ', '.join(FIELDS)
+        args = []
+        if  states:
+            stm += ' WHERE status IN (%s)' % ', '.join('?'*len(states))
+            args = list(states)
+        stm += ' ORDER BY id'
+        with self.lock:
+            try:
+                conn = self.connect()
+                try:
+                    rows = conn.execute(stm, args).fetchall()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, IOError, OSError):
+                return []
+        return [dict(zip(FIELDS, row)) for row in rows]
+
+    def orphans(self):
+        """
+        Return records of jobs which were waiting or running in sessions
+        which are gone and claim them for current session. Only sessions
+        of this host are checked, we can't tell if remote ones are alive.
+        """
+        jobs = [r for r in self.select(['waiting', 'running']) \
+                if r['host'] == HOST and r['pid'] != os.getpid() \
+                and not pid_alive(r['pid'])]
+        claimed = []
+        with self.lock:
+            try:
+                conn = self.connect()
+                try:
+                    for row in jobs:
+                        # another session may claim the same job
+                        cur = conn.execute(\
+                                'UPDATE jobs SET pid=? ' \
+                                'WHERE id=? AND pid=? AND host=?',
+                                (os.getpid(), row['id'], row['pid'], HOST))
+                        if  cur.rowcount:
+                            claimed.append(row)
+                    conn.commit()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, IOError, OSError):
+                return []
+        return claimed
+
+    def clear(self):
+        "Remove finished jobs from the queue"
+        with self.lock:
+            try:
+                conn = self.connect()
+                try:
+                    conn.execute("DELETE FROM jobs WHERE status IN " \
+                            "('done', 'failed')")
+                    conn.commit()
+                finally:
+                    conn.close()
+            except (sqlite3.Error, IOError, OSError):
+                pass
+
+def time_stamp(tstamp):
+    "Return human readable form of given time stamp"
+    if  not tstamp:
+        return '-'
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(tstamp))
+
+# create an singleton instance which will be used through the code
+TRANSFER_QUEUE = TransferQueue()
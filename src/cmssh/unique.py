@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+Streaming de-duplication of result rows. Every row is reduced to a
+hash of its canonical projection (DAS bookkeeping keys are ignored),
+such that duplicates are dropped wherever they appear in a stream in a
+single pass. Hashes are kept in a set until their number exceeds given
+limit, then the filter switches to a Bloom filter of bounded size.
+"""
+
+# system modules
+import os
+import math
+
+# keys DAS adds to every record, they differ among copies of the same row
+IGNORE_KEYS = set(['_id', 'das', 'das_id', 'cache_id'])
+
+def freeze(obj):
+    "Return hashable canonical form of given JSON object"
+    if  isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.iteritems()))
+    if  isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def row_key(row):
+    """
+    Return 64-bit hash of canonical projection of given row, it does not
+    depend on order of keys and on str/unicode type of strings
+    """
+    data = getattr(row, 'data', row) # CMSObj keeps its record in data
+    if  isinstance(data, dict):
+        return hash(tuple(sorted((k, freeze(v)) \
+                for k, v in data.iteritems() if k not in IGNORE_KEYS)))
+    return hash(freeze(data))
+
+class BloomFilter(object):
+    """
+    Bloom filter of row keys for given capacity and false positive rate,
+    a false positive drops unique row, therefore rate should be small.
+    """
+    def __init__(self, capacity=10000000, error_rate=1e-6):
+        nbits = -capacity * math.log(error_rate) / math.log(2)**2
+        self.nbits   = max(8, int(nbits))
+        self.nhashes = max(1, int(round(self.nbits * math.log(2) / capacity)))
+        self.bits    = bytearray((self.nbits + 7) // 8)
+
+    def add(self, key):
+        "Add given key, return True if it was (probably) seen before"
+        # double hashing, two hashes of the key give all hash functions
+        hash1 = key
+        hash2 = hash((key, 'bloom')) | 1
+        seen  = True
+        for idx in xrange(self.nhashes):
+            bit  = (hash1 + idx * hash2) % self.nbits
+            byte = bit >> 3
+            mask = 1 << (bit & 7)
+            if  not self.bits[byte] & mask:
+                seen = False
+                self.bits[byte] |= mask
+        return seen
+
+class UniqueFilter(object):
+    """
+    Keep track of seen rows, set of row keys is used for the first
+    max_exact rows, afterwards all keys move into a Bloom filter.
+    """
+    def __init__(self, max_exact=1000000, capacity=10000000, error_rate=1e-6):
+        self.max_exact  = max_exact
+        self.capacity   = capacity
+        self.error_rate = error_rate
+        self.keys       = set()
+        self.bloom      = None
+
+    def seen(self, row):
+        "Check if given row was seen before and remember it"
+        key = row_key(row)
+        if  self.bloom:
+            return self.bloom.add(key)
+        if  key in self.keys:
+            return True
+        self.keys.add(key)
+        if  len(self.keys) > self.max_exact:
+            self.bloom = BloomFilter(\
+                    max(self.capacity, 10*self.max_exact), self.error_rate)
+            for item in self.keys:
+                self.bloom.add(item)
+            self.keys = set()
+        return False
+
+def unique_rows(rows, max_exact=None):
+    """
+    Yield rows of given iterable dropping duplicates, see UniqueFilter.
+    The max_exact limit defaults to CMSSH_UNIQUE_MAX, zero switches
+    to Bloom filter mode from the very first row.
+    """
+    if  max_exact is None:
+        max_exact = int(os.environ.get('CMSSH_UNIQUE_MAX', 1000000))
+    ufilter = UniqueFilter(max_exact)
+    for row in rows:
+        if  not ufilter.seen(row):
+            yield row
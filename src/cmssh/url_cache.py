@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#-*- coding: ISO-8859-1 -*-
+"""
+On-disk cache of CMS data-service responses. Only read-mostly APIs
+are cached, every API has its own time-to-live. Expired entries are
+re-validated via ETag/Last-Modified headers when service provides
+them and the cache size is bounded by LRU eviction of its entries.
+Streamed responses are written to the cache as they are read and kept
+as raw body files next to their entries, so they can be streamed back.
+"""
+
+# system modules
+import os
+import json
+import time
+import urllib
+import hashlib
+import tempfile
+import threading
+
+# (API url suffix, time-to-live in seconds) pairs of cached APIs
+CACHE_RULES = [
+    ('/DBSReader/datasets', 6*3600),
+    ('/DBSReader/blocks', 6*3600),
+    ('/DBSReader/files', 6*3600),
+    ('/DBSReader/filelumis', 24*3600),
+    ('/phedex/datasvc/json/prod/tfc', 24*3600),
+    ('/sitedb/data/prod/site-names', 24*3600),
+    ('/sitedb/data/prod/site-resources', 24*3600),
+]
+
+def data_path(fname):
+    "Return name of raw body file of given cache entry file"
+    return fname[:-len('.json')] + '.data'
+
+def file_size(fname):
+    "Return size of given file, zero if it does not exist"
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return 0
+
+class CacheWriter(object):
+    """
+    Write streamed response body into the cache, the body is stored in
+    temporary file and becomes cache entry once commit is called
+    """
+    def __init__(self, cache, url, params, headers):
+        self.cache   = cache
+        self.url     = url
+        self.params  = params
+        self.headers = headers if headers else {}
+        self.size    = 0
+        cdir = cache.path()
+        if  not os.path.isdir(cdir):
+            os.makedirs(cdir)
+        fdesc, self.tmp = tempfile.mkstemp(dir=cdir, suffix='.tmp')
+        self.stream = os.fdopen(fdesc, 'wb')
+
+    def write(self, chunk):
+        "Write given chunk of response body"
+        if  not self.stream:
+            return
+        self.size += len(chunk)
+        if  self.size > self.cache.max_size: # would be evicted anyway
+            self.abort()
+            return
+        try:
+            self.stream.write(chunk)
+        except (IOError, OSError):
+            self.abort()
+
+    def commit(self):
+        "Turn written body into cache entry"
+        if  not self.stream:
+            return
+        fname = self.cache.path(self.url, self.params)
+        dname = data_path(fname)
+        entry = {'url': self.url, 'params': self.params, 'stream': True,
+                 'expire': time.time() + self.cache.ttl(self.url),
+                 'etag': self.headers.get('etag'),
+                 'last_modified': self.headers.get('last-modified')}
+        try:
+            self.stream.close()
+            self.stream = None
+            old_size = file_size(dname)
+            os.rename(self.tmp, dname)
+            self.tmp = None
+            self.cache.write(fname, entry, self.size - old_size)
+        except (IOError, OSError):
+            self.abort()
+
+    def abort(self):
+        "Drop written body"
+        if  self.stream:
+            self.stream.close()
+            self.stream = None
+        if  self.tmp:
+            try:
+                os.remove(self.tmp)
+            except OSError:
+                pass
+            self.tmp = None
+
+def cache_dir():
+    "Return default location of cmssh cache"
+    return os.path.join(os.environ['HOME'], '.cmssh/cache')
+
+class URLCache(object):
+    """
+    Persistent cache of HTTP responses keyed by URL and its parameters.
+    Every entry is stored as JSON file in cache directory, the file
+    modification time is used as last access time for LRU eviction.
+    """
+    def __init__(self, cdir=None, max_size=500*1024*1024, rules=None):
+        self.cdir     = cdir
+        self.max_size = max_size
+        self.rules    = rules if rules else CACHE_RULES
+        self.lock     = threading.Lock()
+        self.size     = None # total size of cache entries, init at run time
+
+    def enabled(self):
+        "Check if cache is enabled"
+        return os.environ.get('CMSSH_CACHE', '1') != '0'
+
+    def path(self, url=None, params=None):
+        "Return cache directory or file name of entry for given url/params"
+        cdir = self.cdir if self.cdir else cache_dir()
+        if  not url:
+            return cdir
+        return os.path.join(cdir, self.key(url, params) + '.json')
+
+    def key(self, url, params=None):
+        "Return cache key for given url and parameters"
+        if  params:
+            url += '?' + urllib.urlencode(sorted(params.items()), doseq=True)
+        return hashlib.sha1(url).hexdigest()
+
+    def ttl(self, url):
+        "Return time-to-live for given url, zero for non cacheable urls"
+        if  not self.enabled():
+            return 0
+        url = url.split('?')[0].rstrip('/')
+        for suffix, ttl in self.rules:
+            if  url.endswith(suffix):
+                return ttl
+        return 0
+
+    def get(self, url, params=None, load=True):
+        """
+        Return cache entry for given url/params or None. The entry is
+        a dict with data, expire, etag and last_modified keys, it is
+        returned even if it is expired to allow its re-validation.
+        Entries of streamed responses have stream key instead of data,
+        their body is read into data only if load flag is set.
+        """
+        fname = self.path(url, params)
+        try:
+            with open(fname, 'r') as stream:
+                entry = json.load(stream)
+            if  entry.get('stream') and load:
+                with open(data_path(fname), 'rb') as stream:
+                    entry['data'] = stream.read()
+            os.utime(fname, None) # mark entry as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return entry
+
+    def open(self, url, params=None):
+        """
+        Return file object of raw body of cache entry for given url/params
+        or None, the entry has to be stored by writer
+        """
+        try:
+            return open(data_path(self.path(url, params)), 'rb')
+        except (IOError, OSError):
+            return None
+
+    def writer(self, url, params, headers=None):
+        """
+        Return CacheWriter which stores streamed response for url/params
+        or None if url is not cacheable
+        """
+        if  not self.ttl(url):
+            return None
+        try:
+            return CacheWriter(self, url, params, headers)
+        except (IOError, OSError):
+            return None
+
+    def put(self, url, params, data, headers=None):
+        "Store given data for url/params in a cache"
+        ttl = self.ttl(url)
+        if  not ttl:
+            return
+        if  not headers:
+            headers = {}
+        entry = {'url': url, 'params': params, 'data': data,
+                 'expire': time.time() + ttl,
+                 'etag': headers.get('etag'),
+                 'last_modified': headers.get('last-modified')}
+        try:
+            self.write(self.path(url, params), entry)
+        except (IOError, OSError, UnicodeDecodeError):
+            pass # cache is an optimization, never fail the request
+
+    def touch(self, url, params=None):
+        "Extend life time of re-validated entry"
+        entry = self.get(url, params, load=False)
+        if  entry:
+            entry['expire'] = time.time() + self.ttl(url)
+            try:
+                self.write(self.path(url, params), entry)
+            except (IOError, OSError):
+                pass
+
+    def write(self, fname, entry, extra=0):
+        """
+        Write cache entry into given file, extra is change of size of its
+        raw body file
+        """
+        cdir = self.path()
+        if  not os.path.isdir(cdir):
+            os.makedirs(cdir)
+        fdesc, tmp = tempfile.mkstemp(dir=cdir, suffix='.tmp')
+        try:
+            with os.fdopen(fdesc, 'w') as stream:
+                json.dump(entry, stream)
+        except:
+            os.remove(tmp)
+            raise
+        old_size = file_size(fname)
+        if  not entry.get('stream'): # drop body of former streamed entry
+            extra -= file_size(data_path(fname))
+            if  os.path.isfile(data_path(fname)):
+                os.remove(data_path(fname))
+        os.rename(tmp, fname)
+        with self.lock:
+            if  self.size is None:
+                self.size = sum(s for _, s, _ in self.entries())
+            else:
+                self.size += os.path.getsize(fname) - old_size + extra
+            if  self.size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        """
+        Yield (file name, size, last access time) of all cache entries,
+        size includes raw body of streamed entries
+        """
+        cdir = self.path()
+        if  not os.path.isdir(cdir):
+            return
+        for name in os.listdir(cdir):
+            if  not name.endswith('.json'):
+                continue
+            fname = os.path.join(cdir, name)
+            try:
+                fstat = os.stat(fname)
+            except OSError:
+                continue
+            yield fname, fstat.st_size + file_size(data_path(fname)), \
+                    fstat.st_mtime
+
+    def evict(self):
+        "Remove least recently used entries until cache fits its size"
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        size = sum(s for _, s, _ in entries)
+        # evict down to 90% of allowed size to not evict on every write
+        while entries and size > 0.9*self.max_size:
+            fname, fsize, _ = entries.pop(0)
+            for name in [fname, data_path(fname)]:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+            size -= fsize
+        self.size = size
+
+    def clear(self):
+        "Remove all cache entries"
+        with self.lock:
+            for fname, _, _ in list(self.entries()):
+                for name in [fname, data_path(fname)]:
+                    try:
+                        os.remove(name)
+                    except OSError:
+                        pass
+            self.size = 0
+
+    def info(self):
+        "Return dict with cache statistics per cached API"
+        stats = {}
+        for fname, fsize, _ in self.entries():
+            try:
+                with open(fname, 'r') as stream:
+                    entry = json.load(stream)
+            except (IOError, ValueError):
+                continue
+            api = entry['url'].split('?')[0].rstrip('/').split('/')[-1]
+            row = stats.setdefault(api, \
+                    {'entries': 0, 'expired': 0, 'size': 0})
+            row['entries'] += 1
+            row['size'] += fsize
+            if  entry['expire'] < time.time():
+                row['expired'] += 1
+        return stats
+
+# create an singleton instance which will be used through the code
+URL_CACHE = URLCache(\
+        max_size=int(os.environ.get('CMSSH_CACHE_SIZE', 500))*1024*1024)
@@ -8,7 +8,9 @@ URL utils
 # system modules
 import os
 import json
+import time
 import urllib
+import itertools
 import urllib2
 import subprocess
 from contextlib import contextmanager
@@ -17,11 +19,20 @@ from contextlib import contextmanager
 from cmssh.iprint import print_info, print_warning, print_error
 from cmssh.auth_utils import PEMMGR, working_pem
 from cmssh.auth_utils import get_key_cert, HTTPSClientAuthHandler
+from cmssh.url_cache import URL_CACHE
 try:
     from cmssh.pycurl_manager import RequestHandler
 except:
     pass
 
+CHUNK_SIZE = 64*1024 # size of chunks to read from streamed responses
+
+def decode_data(data, decoder='json'):
+    "Decode given data string"
+    if  decoder == 'json':
+        return json.loads(data)
+    return data
+
 def get_data(url, kwargs=None, headers=None,
         verbose=None, decoder='json', post=False):
     "Retrive data"
@@ -29,16 +40,32 @@ def get_data(url, kwargs=None, headers=None,
         headers =  {'Accept': 'application/json' } # DBS3 always needs that
     ckey = None
     cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+    entry = None
+    if  not post and URL_CACHE.ttl(url):
+        entry = URL_CACHE.get(url, kwargs)
+        if  entry and entry['expire'] > time.time():
+            if  verbose:
+                print_info('Use cached data for %s' % url)
+            return decode_data(entry['data'], decoder)
     try:
         # pycurl data look-up, primary way to get the data
         mgr = RequestHandler()
+        req_headers = dict(headers) if headers else {}
+        if  entry: # re-validate expired cache entry
+            if  entry.get('etag'):
+                req_headers['If-None-Match'] = entry['etag']
+            if  entry.get('last_modified'):
+                req_headers['If-Modified-Since'] = entry['last_modified']
         with working_pem(PEMMGR.pem) as ckey:
-            res = mgr.get_data(url, kwargs, headers, post, ckey, cert, verbose=verbose)
-            if  decoder == 'json':
-                data = json.load(res)
-            else:
-                data = res.read()
-            return data
+            code, res_headers, res = mgr.get_response(url, kwargs,
+                    req_headers, post, ckey, cert, verbose=verbose)
+        if  entry and code == 304: # not modified
+            URL_CACHE.touch(url, kwargs)
+            return decode_data(entry['data'], decoder)
+        data = res.read()
+        if  code == 200 and not post:
+            URL_CACHE.put(url, kwargs, data, res_headers)
+        return decode_data(data, decoder)
     except Exception as exc:
         if  verbose:
             print_error(exc)
@@ -49,6 +76,203 @@ def get_data(url, kwargs=None, headers=None,
             return get_data_helper(url, kwargs, headers,
                     verbose, decoder, post, ckey, cert)
 
+def get_data_many(urls_params, headers=None, verbose=None,
+        decoder='json', window=None):
+    """
+    Retrieve data for given list of (url, params) pairs concurrently and
+    yield (url, params, data) tuples in order of their completion.
+    """
+    urls_params = list(urls_params)
+    if  not urls_params:
+        return
+    if  not headers and urls_params[0][0].find('DBSReader') != -1:
+        headers =  {'Accept': 'application/json' } # DBS3 always needs that
+    cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+    done = set()
+    # serve requests from the cache first
+    requests = []
+    for url, params in urls_params:
+        entry = URL_CACHE.get(url, params) if URL_CACHE.ttl(url) else None
+        if  entry and entry['expire'] > time.time():
+            done.add(id(params))
+            yield url, params, decode_data(entry['data'], decoder)
+        else:
+            requests.append((url, params))
+    try:
+        # pycurl data look-up, primary way to get the data
+        mgr = RequestHandler()
+        with working_pem(PEMMGR.pem) as ckey:
+            for url, params, data, code, res_headers in mgr.get_many(
+                    requests, headers, ckey=ckey, cert=cert, verbose=verbose,
+                    window=window, decoder=None, status=True, info=True):
+                if  code == 200:
+                    URL_CACHE.put(url, params, data, res_headers)
+                done.add(id(params))
+                yield url, params, decode_data(data, decoder)
+    except Exception as exc:
+        if  verbose:
+            print_error(exc)
+            msg = 'Fall back to sequential data look-up'
+            print_warning(msg)
+        # fetch remaining requests one by one
+        for url, params in urls_params:
+            if  id(params) not in done:
+                yield url, params, get_data(url, params, headers,
+                        verbose, decoder)
+
+def json_stream(chunks):
+    """
+    Incremental JSON decoder. It takes an iterable of string chunks of
+    JSON document and yields elements of its top-level array as soon as
+    they are fully read, i.e. neither the whole document nor the list of
+    all decoded elements is held in memory. Any other JSON document is
+    yielded as a single object once it is read.
+    """
+    decoder = json.JSONDecoder()
+    chunks  = iter(chunks)
+    buf     = ''
+    idx     = 0
+    eof     = False
+    is_list = None
+    while True:
+        # skip white spaces and array separators
+        while idx < len(buf) and buf[idx] in ' \t\r\n,':
+            idx += 1
+        if  idx < len(buf):
+            if  is_list is None:
+                is_list = buf[idx] == '['
+                if  is_list:
+                    idx += 1
+                    continue
+            if  not is_list:
+                if  eof:
+                    yield json.loads(buf[idx:])
+                    return
+            elif buf[idx] == ']':
+                return
+            else:
+                try:
+                    obj, end = decoder.raw_decode(buf, idx)
+                    # element followed by anything but separator, e.g.
+                    # number at the end of buffer, may be incomplete
+                    if  eof or (end < len(buf) and buf[end] in ' \t\r\n,]'):
+                        idx = end
+                        yield obj
+                        continue
+                except ValueError:
+                    if  eof:
+                        raise
+        elif eof:
+            if  is_list:
+                raise ValueError('Unterminated JSON array')
+            return
+        # read more data, drop already decoded part of the buffer
+        try:
+            buf = buf[idx:] + chunks.next()
+            idx = 0
+        except StopIteration:
+            eof = True
+
+def cache_chunks(chunks, writer):
+    "Pass through given chunks and write them into the cache"
+    for chunk in chunks:
+        writer.write(chunk)
+        yield chunk
+
+def cached_rows(entry, stream=None):
+    """
+    Yield rows of given cache entry, body of streamed entries is read
+    from given file object
+    """
+    if  'data' in entry:
+        for row in json_stream([entry['data']]):
+            yield row
+        return
+    try:
+        for row in json_stream(iter(lambda: stream.read(CHUNK_SIZE), '')):
+            yield row
+    finally:
+        stream.close()
+
+def get_data_stream(url, kwargs=None, headers=None, verbose=None):
+    """
+    Retrieve JSON data and yield elements of its top-level array one by
+    one while the response is read from the network, see json_stream.
+    Responses of cacheable APIs are written to the cache as they are
+    read and cached responses are streamed from the cache.
+    """
+    if  not headers and url.find('DBSReader') != -1:
+        headers =  {'Accept': 'application/json' } # DBS3 always needs that
+    cert = os.path.join(os.environ['HOME'], '.globus/usercert.pem')
+    ttl = URL_CACHE.ttl(url)
+    entry = None
+    if  ttl:
+        entry = URL_CACHE.get(url, kwargs, load=False)
+        if  entry and entry['expire'] > time.time():
+            stream = None if 'data' in entry else URL_CACHE.open(url, kwargs)
+            if  'data' in entry or stream:
+                if  verbose:
+                    print_info('Use cached data for %s' % url)
+                for row in cached_rows(entry, stream):
+                    yield row
+                return
+    nrows  = 0
+    writer = None
+    try:
+        # pycurl data look-up, primary way to get the data
+        mgr = RequestHandler()
+        req_headers = dict(headers) if headers else {}
+        if  entry: # re-validate expired cache entry
+            if  entry.get('etag'):
+                req_headers['If-None-Match'] = entry['etag']
+            if  entry.get('last_modified'):
+                req_headers['If-Modified-Since'] = entry['last_modified']
+        response = {}
+        with working_pem(PEMMGR.pem) as ckey:
+            chunks = mgr.get_stream(url, kwargs if kwargs else {}, req_headers,
+                    ckey=ckey, cert=cert, verbose=verbose, response=response)
+            writer = URL_CACHE.writer(url, kwargs) if ttl else None
+            if  writer:
+                chunks = cache_chunks(chunks, writer)
+            chunks = iter(chunks)
+            try:
+                first = chunks.next()
+            except StopIteration: # empty body, e.g. 304 not modified
+                first = None
+            if  first is not None:
+                for row in json_stream(itertools.chain([first], chunks)):
+                    nrows += 1
+                    yield row
+                for _ in chunks: # read up to the end of response
+                    pass
+        if  entry and response.get('code') == 304: # not modified
+            stream = None if 'data' in entry else URL_CACHE.open(url, kwargs)
+            if  'data' not in entry and not stream:
+                raise Exception('Body of cached %s is gone' % url)
+            URL_CACHE.touch(url, kwargs)
+            for row in cached_rows(entry, stream):
+                nrows += 1
+                yield row
+        elif writer and response.get('code') == 200:
+            writer.headers = response['headers']
+            writer.commit()
+    except Exception as exc:
+        if  nrows: # can't fall back in the middle of the stream
+            raise
+        if  verbose:
+            print_error(exc)
+            msg = 'Fall back to urllib'
+            print_warning(msg)
+        # urllib data look-up, fallback mechanism
+        with working_pem(PEMMGR.pem) as ckey:
+            res = get_data_helper(url, kwargs, headers,
+                    verbose, 'stream', False, ckey, cert)
+        for row in json_stream(iter(lambda: res.read(CHUNK_SIZE), '')):
+            yield row
+    finally:
+        if  writer:
+            writer.abort() # no-op once the entry is committed
+
 def get_data_helper(url, kwargs=None, headers=None,
         verbose=None, decoder='json', post=False, ckey=None, cert=None):
     """Retrieve data helper function"""
@@ -90,6 +314,8 @@ def get_data_helper(url, kwargs=None, headers=None,
         except Exception as err:
             data = {}
             print_error(str(err))
+    elif decoder == 'stream': # caller reads the response itself
+        data = res
     else:
         data = res.read()
     return data
@@ -27,6 +27,7 @@ from   decorator import decorator
 from   cmssh.iprint import format_dict, msg_green
 from   cmssh.iprint import print_warning, print_error, print_info
 from   cmssh.regex import float_number_pattern, int_number_pattern
+from   cmssh.executor import EXECUTOR
 
 def ranges(ilist):
     """
@@ -234,8 +235,8 @@ class PrintProgress(object):
         print '' # to clear stdout
         self.init()
 
-    def refresh(self, progress):
-        "Update progress bar status"
+    def refresh(self, progress, info=''):
+        "Update progress bar status, info is extra message, e.g. rate"
         if  isinstance(progress, int) or isinstance(progress, float) or \
             isinstance(progress, long):
             progress = int(progress)
@@ -246,6 +247,8 @@ class PrintProgress(object):
             sys.stdout.write(self.return_char)
         else:
             msg = " %d%%" % progress
+            if  info:
+                msg += " %s" % info
             msg = self.msg_format() % self.msg + msg + self.return_char
             sys.stdout.write(msg)
         sys.stdout.flush()
@@ -317,14 +320,21 @@ def list_results(res, debug, flt=None):
     if  not res:
         return
     gen = formatter_output(res, debug)
+    pager = os.environ.get('CMSSH_PAGER', None)
+    if  not (pager and pager != '0'):
+        # print rows as they come, results can be a long stream
+        if  flt:
+            lines = (l for r in gen for l in str(r).split('\n'))
+            for line in filter_output(lines, flt):
+                print line
+        else:
+            for row in gen:
+                print str(row)
+        return
     out = '\n'.join([str(r) for r in gen])
     if  flt:
         out = '\n'.join(filter_output(out, flt))
-    pager = os.environ.get('CMSSH_PAGER', None)
-    if  pager and pager != '0':
-        pydoc.pager(out)
-    else:
-        print out
+    pydoc.pager(out)
 
 def formatter_output(res, debug):
     "Formatter takes care of results representation"
@@ -358,7 +368,7 @@ def formatter_output(res, debug):
                 yield repr(res)
 
 def filter_output(output, flt):
-    "Filter given output"
+    "Filter given output, either a string or iterable of lines"
     match = None
     if  flt:
         arr = flt.split()
@@ -375,7 +385,9 @@ def filter_output(output, flt):
             opt, match = arr
         else:
             raise NotImplementedError
-        for line in output.split('\n'):
+        if  isinstance(output, basestring):
+            output = output.split('\n')
+        for line in output:
             if  opt and opt == '-i':
                 if  line.lower().find(match.lower()) != -1:
                     yield line
@@ -389,14 +401,12 @@ def filter_output(output, flt):
                 if  line.find(match) != -1:
                     yield line
 
-def execmd(cmd):
-    """Execute given command in subprocess"""
-    pipe = subprocess.Popen(cmd, shell=True, 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True)
-    (child_stdout, child_stderr) = (pipe.stdout, pipe.stderr)
-    stdout = child_stdout.read()
-    stderr = child_stderr.read()
-    return stdout, stderr
+def execmd(cmd, timeout=None):
+    """
+    Execute given command in subprocess and return its (stdout, stderr),
+    see cmssh.executor
+    """
+    return EXECUTOR.execute(cmd, timeout)
 
 def adjust_value(value):
     """
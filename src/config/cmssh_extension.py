@@ -27,7 +27,7 @@ from   cmssh.cms_cmds import cmsrel, cmsrun, cms_help, cms_arch, cms_vomsinit
 from   cmssh.cms_cmds import cms_help_msg, results, cms_apt, cms_das, cms_das_json
 from   cmssh.cms_cmds import github_issues, demo, cms_json, cms_jobs, cmsenv
 from   cmssh.cms_cmds import cms_lumi, integration_tests, cms_read
-from   cmssh.cms_cmds import cms_config, cms_commands, cms_pager
+from   cmssh.cms_cmds import cms_config, cms_commands, cms_pager, cms_cache
 
 class ShellName(object):
     def __init__(self):
@@ -142,6 +142,7 @@ cmsMagicList = [ \
     ('demo', demo),
     ('test', integration_tests),
     ('pager', cms_pager),
+    ('cache', cms_cache),
 ]
 if  os.environ.get('CMSSH_EOS', 0):
     eos = '/afs/cern.ch/project/eos/installation/cms/bin/eos.select'
@@ -210,6 +211,8 @@ def main(ipython):
     ip.ex("from cmssh.auth_utils import PEMMGR, read_pem")
     ip.ex("read_pem()")
     ip.ex("cms_vomsinit()")
+    ip.ex("from cmssh.filemover import resume_transfers")
+    ip.ex("resume_transfers()")
     ip.ex("os.environ['CMSSH_PAGER']='0'")
 
     # Set cmssh prompt